@@ -0,0 +1,93 @@
+/* Página Área en Mapa: estilo de las parcelas y selección en el navegador */
+
+window.sigpacBbox = Object.assign({}, window.sigpacBbox, {
+    // Color según si el id de la parcela está en hideout.seleccionadas
+    estiloParcela: function (feature, context) {
+        const seleccionadas = (context.hideout && context.hideout.seleccionadas) || [];
+        const seleccionada = seleccionadas.indexOf(feature.properties.id) !== -1;
+        return {
+            fillColor: seleccionada ? "#00ff00" : "#3388ff",
+            color: "#ffffff",
+            weight: 2,
+            fillOpacity: seleccionada ? 0.7 : 0.4
+        };
+    },
+
+    estiloHover: function () {
+        return {fillColor: "#ffff00", fillOpacity: 0.8, weight: 3};
+    },
+
+    // Popup con todos los atributos de la parcela; se construye al abrirlo
+    popupParcela: function (feature, layer, context) {
+        const hideout = (context && (context.hideout || (context.props && context.props.hideout))) || {};
+        const etiquetas = hideout.etiquetas || {};
+        const unidades = hideout.unidades || {};
+
+        layer.bindPopup(function () {
+            const props = feature.properties || {};
+            let html = "<div style='font-family: Arial, sans-serif; font-size: 12px; line-height: 1.5;'>" +
+                "<div style='background-color: #2d6a4f; color: white; padding: 6px; margin-bottom: 8px; border-radius: 4px;'>" +
+                "<b style='font-size: 13px;'>Parcela #" + escaparHtml(props.id) + "</b></div>";
+
+            Object.keys(props).forEach(function (col) {
+                const valor = props[col];
+                if (col === "id" || valor === null || valor === undefined || String(valor).trim() === "") {
+                    return;
+                }
+                let texto;
+                if (typeof valor === "number") {
+                    texto = unidades[col] ? valor.toFixed(2) + " " + unidades[col] : (Number.isInteger(valor) ? String(valor) : valor.toFixed(2));
+                } else {
+                    texto = escaparHtml(valor);
+                }
+                const etiqueta = etiquetas[col] || col.replace(/_/g, " ").replace(/\b\w/g, function (c) { return c.toUpperCase(); });
+                html += "<div style='margin-bottom: 3px;'><b>" + escaparHtml(etiqueta) + ":</b> " + texto + "</div>";
+            });
+
+            return html + "<hr style='margin: 8px 0; border: none; border-top: 1px solid #ddd;'>" +
+                "<div style='text-align: center;'><small style='color: #999; font-size: 10px;'>Haz clic para seleccionar o deseleccionar</small></div></div>";
+        });
+    }
+});
+
+function escaparHtml(valor) {
+    return String(valor).replace(/[&<>"']/g, function (c) {
+        return {"&": "&amp;", "<": "&lt;", ">": "&gt;", "\"": "&quot;", "'": "&#39;"}[c];
+    });
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    bbox: {
+        // Alterna la parcela pulsada (o vacía la selección) sin pasar por el servidor
+        alternarSeleccion: function (n_clicks, n_deseleccionar, feature, hideout) {
+            const ctx = window.dash_clientside.callback_context;
+            const disparador = ctx.triggered.length ? ctx.triggered[0].prop_id : "";
+            let seleccionadas = ((hideout && hideout.seleccionadas) || []).slice();
+
+            if (disparador.startsWith("btn-deseleccionar")) {
+                seleccionadas = [];
+            } else if (feature && feature.properties) {
+                const id = feature.properties.id;
+                const posicion = seleccionadas.indexOf(id);
+                if (posicion === -1) {
+                    seleccionadas.push(id);
+                } else {
+                    seleccionadas.splice(posicion, 1);
+                }
+            } else {
+                throw window.dash_clientside.PreventUpdate;
+            }
+
+            const num = seleccionadas.length;
+            const info = num > 0
+                ? {
+                    namespace: "dash_mantine_components",
+                    type: "Alert",
+                    props: {children: "✅ " + num + " parcela(s) seleccionada(s)", color: "blue"}
+                }
+                : "0 parcelas seleccionadas";
+
+            return [Object.assign({}, hideout, {seleccionadas: seleccionadas}), seleccionadas, info, num === 0, num === 0];
+        }
+    }
+});
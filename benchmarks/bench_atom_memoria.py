@@ -0,0 +1,107 @@
+"""
+Benchmark: pico de memoria al descargar un ZIP del ATOM (en memoria + extractall vs. disco + /vsizip/)
+
+Cada camino se ejecuta en un proceso nuevo y se mide el pico de RSS
+(VmHWM, que se reinicia tras las importaciones) respecto al RSS de
+partida. Solo Linux: ru_maxrss no sirve porque se hereda a través de exec.
+
+Uso: python -m benchmarks.bench_atom_memoria
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+# Los procesos de medida (spawn) reimportan este módulo y heredan el directorio del padre
+if multiprocessing.current_process().name == "MainProcess":
+    directorio_cache = tempfile.mkdtemp()
+    os.environ["SIGPAC_CACHE_DIR"] = directorio_cache
+
+from benchmarks.servidor_falso import arrancar_ficheros, crear_gpkg_sintetico  # noqa: E402
+
+
+def _memoria_mb(campo: str) -> float:
+    """VmRSS o VmHWM del proceso en MB"""
+    with open("/proc/self/status") as f:
+        for linea in f:
+            if linea.startswith(campo + ":"):
+                return int(linea.split()[1]) / 1024
+    raise RuntimeError(f"{campo} no disponible")
+
+
+def camino_anterior(url):
+    """Camino original: response.content -> BytesIO -> extractall -> read_file"""
+    from io import BytesIO
+    import geopandas as gpd
+    from utils.http_client import peticion
+
+    respuesta = peticion("GET", url, timeout=(10, 120))
+    with zipfile.ZipFile(BytesIO(respuesta.response.content)) as z:
+        nombre = next(n for n in z.namelist() if n.endswith(".gpkg"))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            z.extractall(tmpdir)
+            return gpd.read_file(os.path.join(tmpdir, nombre))
+
+
+def camino_actual(url):
+    """Camino actual: descarga por trozos a disco y lectura con /vsizip/"""
+    from utils.sigpac_atom import _descargar_a_disco, procesar_zip
+
+    ruta = _descargar_a_disco(url)
+    try:
+        return procesar_zip(ruta, "gpkg")
+    finally:
+        os.remove(ruta)
+
+
+def _medir(camino, args, cola):
+    import geopandas  # noqa: F401 (la importación no cuenta en la medida)
+    import utils.sigpac_atom  # noqa: F401
+
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")  # reinicia VmHWM al RSS actual
+    base = _memoria_mb("VmRSS")
+    inicio = time.perf_counter()
+    gdf = camino(*args)
+    cola.put((len(gdf), time.perf_counter() - inicio, _memoria_mb("VmHWM") - base))
+
+
+def medir(camino, *args):
+    """Ejecuta camino(*args) en un proceso nuevo; devuelve (filas, segundos, pico de MB)"""
+    contexto = multiprocessing.get_context("spawn")
+    cola = contexto.Queue()
+    proceso = contexto.Process(target=_medir, args=(camino, args, cola))
+    proceso.start()
+    resultado = cola.get()
+    proceso.join()
+    return resultado
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directorio:
+        servidor, base = arrancar_ficheros(directorio)
+        print(f"{'recintos':>9} {'zip':>9} {'zip (MB)':>9} {'anterior (MB)':>14} {'actual (MB)':>12} {'anterior (s)':>13} {'actual (s)':>11}")
+        for n, compresion in ((50_000, zipfile.ZIP_DEFLATED), (200_000, zipfile.ZIP_DEFLATED), (200_000, zipfile.ZIP_STORED)):
+            gpkg = crear_gpkg_sintetico(os.path.join(directorio, "14051.gpkg"), n)
+            nombre_zip = f"14051_{n}_{compresion}.zip"
+            with zipfile.ZipFile(os.path.join(directorio, nombre_zip), "w", compresion) as z:
+                z.write(gpkg, "14051.gpkg")
+            os.remove(gpkg)
+            tamano = os.path.getsize(os.path.join(directorio, nombre_zip)) / 1024 ** 2
+            tipo = "deflate" if compresion == zipfile.ZIP_DEFLATED else "stored"
+
+            url = f"{base}/{nombre_zip}"
+            filas_a, t_a, rss_a = medir(camino_anterior, url)
+            filas_b, t_b, rss_b = medir(camino_actual, url)
+            assert filas_a == filas_b == n
+            print(f"{n:>9} {tipo:>9} {tamano:>9.1f} {rss_a:>14.1f} {rss_b:>12.1f} {t_a:>13.2f} {t_b:>11.2f}")
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(directorio_cache, ignore_errors=True)
@@ -0,0 +1,101 @@
+"""
+Benchmark: descarga de un ZIP del ATOM con un servidor que corta la conexión
+
+Comprueba que la descarga se reanuda con peticiones Range (en la misma
+llamada y en una llamada posterior), que el resultado es idéntico al
+original y que un cambio del fichero en el servidor obliga a empezar de cero.
+
+Uso: python -m benchmarks.bench_descarga_reanudable
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+directorio_cache = tempfile.mkdtemp()
+os.environ["SIGPAC_CACHE_DIR"] = directorio_cache
+
+from benchmarks.servidor_falso import arrancar_ficheros  # noqa: E402
+from utils import sigpac_atom  # noqa: E402
+from utils.http_client import TIMEOUT, ErrorServicio, Respuesta  # noqa: E402
+
+
+def _sha1(ruta: str) -> str:
+    with open(ruta, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _crear_zip(ruta: str, megas: int):
+    with zipfile.ZipFile(ruta, "w", zipfile.ZIP_STORED) as z:
+        z.writestr("14051.gpkg", os.urandom(megas * 1024 * 1024))
+
+
+def _descarga_caida(url: str):
+    """Descarga en la que el servicio deja de responder al intentar reanudar"""
+    peticion = sigpac_atom.peticion
+
+    def peticion_caida(metodo, url, **kwargs):
+        if "Range" in kwargs.get("headers", {}):
+            return Respuesta(TIMEOUT, detalle="Servicio caído")
+        return peticion(metodo, url, **kwargs)
+
+    sigpac_atom.peticion = peticion_caida
+    try:
+        sigpac_atom._descargar_a_disco(url)
+        raise AssertionError("la descarga debería haber fallado")
+    except ErrorServicio:
+        pass
+    finally:
+        sigpac_atom.peticion = peticion
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directorio:
+        original = os.path.join(directorio, "14051.zip")
+        _crear_zip(original, 40)
+        huella = _sha1(original)
+
+        print(f"{'corte cada':>11} {'peticiones':>11} {'segundos':>9} {'íntegro':>8}")
+        for cortar_tras in (None, 8 * 1024 ** 2, 2 * 1024 ** 2):
+            peticiones = []
+            servidor, base = arrancar_ficheros(directorio, peticiones=peticiones, cortar_tras=cortar_tras)
+            inicio = time.perf_counter()
+            ruta = sigpac_atom._descargar_a_disco(f"{base}/14051.zip")
+            segundos = time.perf_counter() - inicio
+            correcto = _sha1(ruta) == huella
+            os.remove(ruta)
+            servidor.shutdown()
+            etiqueta = "sin corte" if cortar_tras is None else f"{cortar_tras // 1024 ** 2} MB"
+            print(f"{etiqueta:>11} {len(peticiones):>11} {segundos:>9.2f} {'sí' if correcto else 'NO':>8}")
+            assert correcto
+
+        # FEGA deja de responder tras el primer corte: queda el .part y la siguiente llamada lo continúa
+        peticiones = []
+        servidor, base = arrancar_ficheros(directorio, peticiones=peticiones, cortar_tras=16 * 1024 ** 2)
+        url = f"{base}/14051.zip"
+        _descarga_caida(url)
+        ruta = sigpac_atom._descargar_a_disco(url)
+        assert _sha1(ruta) == huella
+        os.remove(ruta)
+        print(f"reanudación entre llamadas: {len(peticiones)} peticiones, íntegro")
+
+        # Si el fichero cambia en el servidor, If-Range hace que se descargue completo otra vez
+        peticiones.clear()
+        _descarga_caida(url)
+        _crear_zip(original, 40)
+        os.utime(original, (time.time() + 10, time.time() + 10))
+        huella = _sha1(original)
+        ruta = sigpac_atom._descargar_a_disco(url)
+        assert _sha1(ruta) == huella
+        os.remove(ruta)
+        print(f"fichero cambiado en el servidor: {len(peticiones)} peticiones, íntegro")
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(directorio_cache, ignore_errors=True)
@@ -0,0 +1,62 @@
+"""
+Benchmark: ensamblado del GeoDataFrame de recinfo (concat por código vs. una sola pasada)
+
+Uso: python -m benchmarks.bench_ensamblado  (el camino anterior tarda varios minutos con 10k)
+"""
+import json
+import time
+from io import BytesIO
+
+import geopandas as gpd
+import pandas as pd
+
+from utils.sigpac_api import _ensamblar_gdf, _parsear_recinfo
+from benchmarks.servidor_falso import geojson_recinto
+
+
+def ensamblado_anterior(respuestas):
+    """Camino original: read_file por respuesta y pd.concat en cada iteración"""
+    gdf_sigpac = None
+    for k, v, contenido in respuestas:
+        gdf_temp = gpd.read_file(BytesIO(contenido))
+        gdf_temp['id_entrada'] = k
+        gdf_temp['codigo_sigpac'] = v
+        if gdf_sigpac is None:
+            gdf_sigpac = gdf_temp
+        else:
+            gdf_sigpac = pd.concat([gdf_sigpac, gdf_temp], ignore_index=True)
+    return gdf_sigpac
+
+
+def ensamblado_actual(respuestas):
+    """Camino actual: parseo JSON de cada respuesta y un GeoDataFrame al final"""
+    resultados = []
+    for k, v, contenido in respuestas:
+        features, _crs = _parsear_recinfo(contenido)
+        resultados.append((k, v, features))
+    return _ensamblar_gdf(resultados)
+
+
+def main():
+    print(f"{'códigos':>8} {'anterior (s)':>13} {'actual (s)':>11} {'mejora':>7}")
+    for n in (1_000, 10_000):
+        respuestas = []
+        for i in range(n):
+            codigo = f"14:900:74:{i + 1}:4"
+            contenido = json.dumps(geojson_recinto(*codigo.split(":"))).encode()
+            respuestas.append((i + 1, codigo, contenido))
+
+        inicio = time.perf_counter()
+        gdf_nuevo = ensamblado_actual(respuestas)
+        t_actual = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        gdf_viejo = ensamblado_anterior(respuestas)
+        t_anterior = time.perf_counter() - inicio
+
+        assert len(gdf_nuevo) == len(gdf_viejo) == n
+        print(f"{n:>8} {t_anterior:>13.2f} {t_actual:>11.3f} {t_anterior / t_actual:>6.0f}x")
+
+
+if __name__ == "__main__":
+    main()
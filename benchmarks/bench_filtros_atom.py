@@ -0,0 +1,63 @@
+"""
+Benchmark: filtros del ATOM en pandas tras leer todo vs. WHERE y columnas en la lectura (Arrow)
+
+Uso: python -m benchmarks.bench_filtros_atom
+"""
+import os
+import tempfile
+
+from benchmarks.bench_atom_memoria import medir
+from benchmarks.servidor_falso import crear_gpkg_sintetico
+
+# (descripción, superficie_max_ha, pendiente_min_mil, uso_sigpac, columnas)
+ESCENARIOS = [
+    ("sin filtros", None, None, None, None),
+    ("OV, <= 2 ha", 2, None, "OV", None),
+    ("OV/VI, <= 5 ha, > 100", 5, 100, ["OV", "VI"], None),
+    ("OV, 3 columnas", None, None, "OV", ["uso_sigpac", "pendiente_media"]),
+]
+
+
+def camino_anterior(ruta, superficie_max_ha, pendiente_min_mil, uso_sigpac, columnas):
+    """Camino original: read_file completo y filtros en pandas con .copy()"""
+    import geopandas as gpd
+
+    gdf = gpd.read_file(ruta)
+    if 'dn_surface' in gdf.columns:
+        gdf['superficie_ha'] = gdf['dn_surface'] / 10000
+    if superficie_max_ha and 'superficie_ha' in gdf.columns:
+        gdf = gdf[gdf['superficie_ha'] <= superficie_max_ha].copy()
+    if pendiente_min_mil and 'pendiente_media' in gdf.columns:
+        gdf = gdf[gdf['pendiente_media'] > pendiente_min_mil].copy()
+    if uso_sigpac and 'uso_sigpac' in gdf.columns:
+        if isinstance(uso_sigpac, str):
+            gdf = gdf[gdf['uso_sigpac'] == uso_sigpac].copy()
+        elif isinstance(uso_sigpac, list):
+            gdf = gdf[gdf['uso_sigpac'].isin(uso_sigpac)].copy()
+    return gdf
+
+
+def camino_actual(ruta, superficie_max_ha, pendiente_min_mil, uso_sigpac, columnas):
+    """Camino actual: WHERE y proyección de columnas en la lectura"""
+    from utils.sigpac_atom import leer_capa
+
+    gdf = leer_capa(ruta, superficie_max_ha, pendiente_min_mil, uso_sigpac, columnas)
+    gdf['superficie_ha'] = gdf['dn_surface'] / 10000
+    return gdf
+
+
+def main():
+    n = 500_000
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = crear_gpkg_sintetico(os.path.join(directorio, "14051.gpkg"), n)
+        print(f"{n} recintos, {os.path.getsize(ruta) / 1024 ** 2:.0f} MB")
+        print(f"{'escenario':<24} {'filas':>7} {'anterior (s)':>13} {'actual (s)':>11} {'anterior (MB)':>14} {'actual (MB)':>12}")
+        for descripcion, *filtros in ESCENARIOS:
+            filas_a, t_a, rss_a = medir(camino_anterior, ruta, *filtros)
+            filas_b, t_b, rss_b = medir(camino_actual, ruta, *filtros)
+            assert filas_a == filas_b
+            print(f"{descripcion:<24} {filas_b:>7} {t_a:>13.2f} {t_b:>11.2f} {rss_a:>14.1f} {rss_b:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Comprobación del cliente HTTP contra un servidor inestable local
+
+Reintentos, un fallo del circuito por petición (no por intento), apertura
+tras UMBRAL_FALLOS peticiones fallidas, petición de prueba sin reintentos,
+liberación de la prueba si lanza una excepción y circuito compartido con
+otro proceso (como los de los callbacks en segundo plano). Termina con un error si
+algo no se cumple.
+
+Uso: python -m benchmarks.bench_http_client
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+directorio_cache = tempfile.mkdtemp()
+os.environ["SIGPAC_CACHE_DIR"] = directorio_cache
+
+from benchmarks.servidor_falso import arrancar_inestable  # noqa: E402
+from utils import http_client  # noqa: E402
+from utils.http_client import ERROR_REMOTO, OK, TIMEOUT, peticion  # noqa: E402
+
+TIEMPO_APERTURA = 0.3
+
+
+def _reiniciar(host):
+    """Circuito cerrado para el host, con un tiempo de apertura corto"""
+    interruptor = http_client.Interruptor(host, tiempo_apertura=TIEMPO_APERTURA)
+    interruptor.registrar_exito()
+    http_client._interruptores[host] = interruptor
+
+
+def _fallar_en_otro_proceso(url, veces):
+    for _ in range(veces):
+        peticion("GET", f"{url}/error", reintentos=0)
+
+
+def main():
+    http_client.ESPERA_BASE = 0.01
+    peticiones = []
+    servidor, url = arrancar_inestable(latencia=1.0, peticiones=peticiones)
+    host = url.split("//", 1)[1]
+    umbral = http_client.UMBRAL_FALLOS
+
+    # Un 502 aislado se reintenta y no cuenta como fallo
+    _reiniciar(host)
+    respuesta = peticion("GET", f"{url}/alterno")
+    assert respuesta.estado == OK and respuesta.intentos == 2, respuesta
+    assert http_client.estadisticas()[host] == {"estado": "cerrado", "fallos": 0}
+    print("502 aislado: reintentado, circuito cerrado")
+
+    # Una petición que agota los reintentos es un solo fallo
+    _reiniciar(host)
+    peticiones.clear()
+    respuesta = peticion("GET", f"{url}/error", reintentos=3)
+    assert respuesta.estado == ERROR_REMOTO and len(peticiones) == 4
+    assert http_client.estadisticas()[host] == {"estado": "cerrado", "fallos": 1}
+    print(f"4 intentos con 502: 1 fallo (umbral {umbral}), circuito cerrado")
+
+    # UMBRAL_FALLOS peticiones fallidas lo abren y la siguiente no llega al servidor
+    for _ in range(umbral - 1):
+        peticion("GET", f"{url}/error", reintentos=1)
+    assert http_client.estadisticas()[host]["estado"] == "abierto"
+    peticiones.clear()
+    respuesta = peticion("GET", f"{url}/ok")
+    assert respuesta.estado == ERROR_REMOTO and not peticiones
+    print(f"{umbral} peticiones fallidas: circuito abierto, sin llamadas al host")
+
+    # La petición de prueba no se reintenta: si falla, se vuelve a abrir
+    time.sleep(TIEMPO_APERTURA)
+    respuesta = peticion("GET", f"{url}/error", reintentos=3)
+    assert respuesta.estado == ERROR_REMOTO and peticiones == ["/error"]
+    assert http_client.estadisticas()[host]["estado"] == "abierto"
+    print("prueba fallida: un solo intento, circuito abierto de nuevo")
+
+    # Una excepción en la prueba la libera: la siguiente puede probar
+    time.sleep(TIEMPO_APERTURA)
+    obtener_sesion = http_client.obtener_sesion
+    http_client.obtener_sesion = lambda: (_ for _ in ()).throw(RuntimeError("fallo inesperado"))
+    try:
+        peticion("GET", f"{url}/ok")
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("se esperaba RuntimeError")
+    finally:
+        http_client.obtener_sesion = obtener_sesion
+    respuesta = peticion("GET", f"{url}/ok")
+    assert respuesta.estado == OK
+    assert http_client.estadisticas()[host] == {"estado": "cerrado", "fallos": 0}
+    print("prueba con excepción: liberada, la siguiente cierra el circuito")
+
+    # Tiempo de espera agotado
+    _reiniciar(host)
+    respuesta = peticion("GET", f"{url}/lento", reintentos=0, timeout=0.2)
+    assert respuesta.estado == TIMEOUT
+    print("host lento: timeout")
+
+    # Lo que abre otro proceso (p. ej. una descarga en segundo plano) lo ve este
+    _reiniciar(host)
+    proceso = multiprocessing.get_context("fork").Process(target=_fallar_en_otro_proceso, args=(url, umbral))
+    proceso.start()
+    proceso.join()
+    assert http_client.estadisticas()[host]["estado"] == "abierto"
+    peticiones.clear()
+    assert peticion("GET", f"{url}/ok").estado == ERROR_REMOTO and not peticiones
+    print("circuito abierto por otro proceso: visto también aquí")
+
+    servidor.shutdown()
+    print("OK")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(directorio_cache, ignore_errors=True)
@@ -0,0 +1,107 @@
+"""
+Benchmark: consultas por rectángulo sobre la caché de datasets con el índice espacial
+
+Compara leer el municipio entero y filtrar con el índice persistido (STRtree
+y lectura por grupos de filas), y comprueba que solo se va a la API OGC
+cuando el rectángulo sale de los municipios descargados.
+
+Uso: python -m benchmarks.bench_indice_espacial
+"""
+import os
+import shutil
+import tempfile
+import time
+
+directorio_cache = tempfile.mkdtemp()
+os.environ["SIGPAC_CACHE_DIR"] = directorio_cache
+
+import geopandas as gpd  # noqa: E402
+import shapely  # noqa: E402
+
+from benchmarks.servidor_falso import crear_gpkg_sintetico  # noqa: E402
+from utils import indice_espacial  # noqa: E402
+from utils.cache_datasets import obtener_cache_datasets  # noqa: E402
+
+# (descripción, bbox) sobre la rejilla de crear_gpkg_sintetico (0.002º por recinto)
+CONSULTAS = [
+    ("1 km x 1 km", [-4.80, 37.80, -4.789, 37.809]),
+    ("5 km x 5 km", [-4.80, 37.80, -4.745, 37.845]),
+    ("20 km x 20 km", [-4.85, 37.75, -4.63, 37.93]),
+]
+
+
+def _leer_todo(ruta, bbox):
+    """Camino sin índice: leer el municipio completo y filtrar"""
+    gdf = gpd.read_parquet(ruta)
+    return gdf[gdf.intersects(shapely.box(*bbox))]
+
+
+def _mejor_tiempo(funcion, *args, repeticiones=3):
+    """Resultado y mejor tiempo de varias ejecuciones"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        tiempos.append(time.perf_counter() - inicio)
+    return resultado, min(tiempos)
+
+
+def main():
+    n = 200_000
+    gpkg = crear_gpkg_sintetico(os.path.join(directorio_cache, "14051.gpkg"), n)
+    cache = obtener_cache_datasets()
+    gdf = gpd.read_file(gpkg)
+    # Recintos contiguos, como en el SIGPAC, para que la cobertura sea el municipio entero
+    minx, miny = shapely.bounds(gdf.geometry.values)[:, :2].round(6).T
+    gdf.geometry = shapely.box(minx, miny, (minx + 0.002).round(6), (miny + 0.002).round(6))
+    ruta = cache.guardar(gdf, "2024", "14", "051", "gpkg", "20240101")
+    print(f"{n} recintos en la caché ({os.path.getsize(ruta) / 1024 ** 2:.0f} MB)")
+
+    inicio = time.perf_counter()
+    indice_espacial.obtener_indice_espacial().consultar(CONSULTAS[0][1])
+    print(f"creación del índice: {time.perf_counter() - inicio:.2f} s "
+          f"({os.path.getsize(ruta + indice_espacial.SUFIJO_INDICE) / 1024 ** 2:.1f} MB)")
+
+    inicio = time.perf_counter()
+    indice_espacial.IndiceEspacial().consultar(CONSULTAS[0][1])
+    print(f"carga del índice persistido: {time.perf_counter() - inicio:.3f} s")
+
+    print(f"{'consulta':<15} {'recintos':>9} {'sin índice (ms)':>16} {'con índice (ms)':>16}")
+    for descripcion, bbox in CONSULTAS:
+        esperado, t_todo = _mejor_tiempo(_leer_todo, ruta, bbox)
+        (gdf, sin_cubrir), t_indice = _mejor_tiempo(indice_espacial.obtener_indice_espacial().consultar, bbox)
+
+        assert sin_cubrir.is_empty and len(gdf) == len(esperado)
+        print(f"{descripcion:<15} {len(gdf):>9} {t_todo * 1000:>16.1f} {t_indice * 1000:>16.1f}")
+
+    # Rectángulo que sale del municipio: la API solo recibe la parte sin cubrir
+    pedidos = []
+
+    def api_falsa(bbox, *args, **kwargs):
+        pedidos.append(bbox)
+        return None, {'recibidos': 0, 'coincidentes': 0, 'recortado': False}
+
+    indice_espacial.descargar_por_teselas = api_falsa
+    _gdf, estado = indice_espacial.descargar_area(CONSULTAS[0][1])
+    assert estado['locales'] and not pedidos
+    _gdf, estado = indice_espacial.descargar_area([-5.0, 37.8, -4.89, 37.9])
+    assert pedidos and pedidos[0][2] < -4.899
+    print(f"rectángulo fuera del municipio: API consultada solo para {[round(c, 3) for c in pedidos[0]]}")
+
+    # Los ficheros del ATOM vienen en UTM: la consulta en lon/lat se transforma a su CRS
+    ruta_utm = cache.guardar(gpd.read_parquet(ruta).to_crs("EPSG:25830"), "2025", "14", "051", "gpkg", "20250101")
+    for descripcion, bbox in CONSULTAS:
+        esperado = _leer_todo(ruta, bbox)
+        encontrado, sin_cubrir = indice_espacial.IndiceEspacial().consultar(bbox, campana="2025")
+        assert encontrado.crs == "EPSG:4326"
+        assert sin_cubrir.area <= indice_espacial.TOLERANCIA_COBERTURA * shapely.box(*bbox).area
+        # Los recintos del borde pueden entrar o salir por la reproyección
+        assert abs(len(encontrado) - len(esperado)) <= 0.05 * len(esperado)
+    print(f"fichero en EPSG:25830 ({os.path.getsize(ruta_utm) / 1024 ** 2:.0f} MB): mismas consultas resueltas sin ir a la API")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(directorio_cache, ignore_errors=True)
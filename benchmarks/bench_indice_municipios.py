@@ -0,0 +1,70 @@
+"""
+Benchmark: municipios que toca un rectángulo con el índice de extensiones
+
+Compara el índice en memoria (numpy) con leer el bbox de los metadatos de
+cada GeoParquet de la caché en cada consulta, y mide tamaño y carga del .npz.
+
+Uso: python -m benchmarks.bench_indice_municipios
+"""
+import os
+import shutil
+import tempfile
+import time
+
+directorio_cache = tempfile.mkdtemp()
+os.environ["SIGPAC_CACHE_DIR"] = directorio_cache
+
+import geopandas as gpd  # noqa: E402
+import numpy as np  # noqa: E402
+import shapely  # noqa: E402
+
+from utils import indice_municipios  # noqa: E402
+from utils.cache_datasets import obtener_cache_datasets  # noqa: E402
+
+BBOX = [-4.80, 37.80, -4.70, 37.90]
+
+
+def main():
+    # ~8.100 municipios en una rejilla de 90 x 90 celdas de 0.1º sobre la península
+    rng = np.random.default_rng(0)
+    n = 8100
+    x = -9.3 + (np.arange(n) % 90) * 0.1
+    y = 36.0 + (np.arange(n) // 90) * 0.07
+    codigos = (np.arange(n) // 200 + 1) * 1000 + np.arange(n) % 200 + 1
+    indice = indice_municipios.IndiceMunicipios(codigos, np.column_stack([x, y, x + 0.1 + rng.uniform(0, 0.05, n), y + 0.07]))
+    indice.guardar()
+    print(f"{len(indice)} municipios, {os.path.getsize(indice_municipios.RUTA_INDICE_MUNICIPIOS) / 1024:.0f} KB")
+
+    inicio = time.perf_counter()
+    cargado = indice_municipios.IndiceMunicipios.cargar()
+    print(f"carga del .npz: {(time.perf_counter() - inicio) * 1000:.2f} ms")
+
+    repeticiones = 10_000
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        candidatos = cargado.candidatos(BBOX)
+    print(f"consulta con el índice: {(time.perf_counter() - inicio) / repeticiones * 1e6:.1f} µs ({len(candidatos)} candidatos)")
+
+    # Sin índice: abrir los metadatos de cada municipio descargado (aquí 200)
+    cache = obtener_cache_datasets()
+    gdf = gpd.GeoDataFrame({"dn_surface": [1.0]}, geometry=[shapely.box(0, 0, 1, 1)], crs="EPSG:4258")
+    for i in range(200):
+        gdf.geometry = [shapely.box(x[i], y[i], x[i] + 0.1, y[i] + 0.07)]
+        cache.guardar(gdf, "2024", f"{codigos[i] // 1000:02d}", f"{codigos[i] % 1000:03d}", "gpkg", "20240101")
+    inicio = time.perf_counter()
+    desde_cache = indice_municipios.desde_cache(cache)
+    print(f"recorrer los metadatos de {len(desde_cache)} ficheros de la caché: {(time.perf_counter() - inicio) * 1000:.1f} ms")
+    assert desde_cache.candidatos([x[0], y[0], x[0] + 0.01, y[0] + 0.01]) == [("01", "001")]
+
+    # Los ficheros del ATOM vienen en UTM: el bbox de los metadatos se pasa a lon/lat
+    gdf.geometry = [shapely.box(-4.80, 37.80, -4.70, 37.90)]
+    cache.guardar(gdf.to_crs("EPSG:25830"), "2024", "99", "001", "gpkg", "20240101")
+    assert ("99", "001") in indice_municipios.desde_cache(cache).candidatos([-4.75, 37.85, -4.74, 37.86])
+    print("bbox de un fichero en EPSG:25830 indexado en lon/lat")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(directorio_cache, ignore_errors=True)
@@ -0,0 +1,62 @@
+"""
+Benchmark: rectángulos de la API OGC con más recintos que una página
+
+Compara la petición única anterior (limit=5000, el resto se perdía), las
+páginas una a una y las páginas en paralelo, y comprueba el aviso de
+recorte con un máximo de recintos.
+
+Uso: python -m benchmarks.bench_paginacion_ogc
+"""
+import os
+import shutil
+import tempfile
+import time
+
+directorio_cache = tempfile.mkdtemp()
+os.environ["SIGPAC_CACHE_DIR"] = directorio_cache
+
+from benchmarks.servidor_falso import arrancar_ogc  # noqa: E402
+from utils import sigpac_api  # noqa: E402
+
+BBOX = [-4.9, 37.7, -4.6, 38.0]
+
+
+def peticion_unica(bbox):
+    """Camino anterior: una sola petición con limit=5000"""
+    respuesta = sigpac_api.peticion("GET", sigpac_api.URL_OGC_RECINTOS, params={
+        'f': 'json', 'limit': 5000, 'bbox': ",".join(map(str, bbox))
+    }, timeout=(10, 60))
+    return len(respuesta.response.json()['features'])
+
+
+def main():
+    n = 12_000
+    peticiones = []
+    servidor, sigpac_api.URL_OGC_RECINTOS = arrancar_ogc(n, latencia=0.2, max_pagina=1000, peticiones=peticiones)
+
+    print(f"{'camino':<22} {'recintos':>9} {'peticiones':>11} {'segundos':>9} {'recortado':>10}")
+    inicio = time.perf_counter()
+    recibidos = peticion_unica(BBOX)
+    print(f"{'petición única':<22} {recibidos:>9} {len(peticiones):>11} {time.perf_counter() - inicio:>9.2f} {'(sin aviso)':>10}")
+
+    for descripcion, concurrencia, maximo in (
+        ("páginas una a una", 1, sigpac_api.MAX_RECINTOS_BBOX),
+        ("páginas en paralelo", 8, sigpac_api.MAX_RECINTOS_BBOX),
+        ("máximo 5000", 8, 5000),
+    ):
+        peticiones.clear()
+        inicio = time.perf_counter()
+        gdf, estado = sigpac_api.descargar_por_bbox_con_estado(BBOX, max_recintos=maximo, max_concurrencia=concurrencia)
+        segundos = time.perf_counter() - inicio
+        assert len(gdf) == min(n, maximo) and estado['recortado'] == (maximo < n)
+        assert not gdf.duplicated(['poligono', 'parcela']).any()
+        print(f"{descripcion:<22} {len(gdf):>9} {len(peticiones):>11} {segundos:>9.2f} {'sí' if estado['recortado'] else 'no':>10}")
+
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(directorio_cache, ignore_errors=True)
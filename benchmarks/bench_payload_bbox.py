@@ -0,0 +1,87 @@
+"""
+Benchmark: salida de mostrar_parcelas con popups generados en el servidor vs. en el navegador
+
+Mide el tiempo del callback y el tamaño de la respuesta (JSON, y
+comprimida con gzip, si un proxy la comprime) para 5.000 y 50.000
+parcelas.
+
+Uso: python -m benchmarks.bench_payload_bbox
+"""
+import gzip
+import os
+import shutil
+import tempfile
+import time
+
+directorio_cache = tempfile.mkdtemp()
+os.environ["SIGPAC_CACHE_DIR"] = directorio_cache
+
+import geopandas as gpd  # noqa: E402
+import pandas as pd  # noqa: E402
+from plotly.io.json import to_json_plotly  # noqa: E402
+
+from benchmarks.servidor_falso import parcelas_sinteticas  # noqa: E402
+from utils.resultados import guardar_resultado  # noqa: E402
+
+
+def popups_servidor(gdf_json):
+    """Camino anterior: GeoJSON en store-gdf-bbox y HTML del popup de cada parcela construido en Python"""
+    from pages.page2_bbox import NOMBRES_BONITOS
+
+    gdf = gpd.read_file(gdf_json)
+    features = []
+    for idx, row in gdf.iterrows():
+        popup_html = "<div style='font-family: Arial, sans-serif; font-size: 12px; line-height: 1.5;'>"
+        popup_html += "<div style='background-color: #2d6a4f; color: white; padding: 6px; margin-bottom: 8px; border-radius: 4px;'>"
+        popup_html += f"<b style='font-size: 13px;'>Parcela #{idx}</b></div>"
+        for col in gdf.columns:
+            if col in ('geometry', 'id_parcela'):
+                continue
+            valor = row[col]
+            if valor is None or (isinstance(valor, str) and valor.strip() == '') or (isinstance(valor, float) and pd.isna(valor)):
+                continue
+            if col in ['dn_surface', 'superficie'] and isinstance(valor, (int, float)):
+                valor_formateado = f"{valor:.2f} ha"
+            elif isinstance(valor, float):
+                valor_formateado = f"{valor:.2f}"
+            else:
+                valor_formateado = str(valor)
+            label = NOMBRES_BONITOS.get(col, col.replace('_', ' ').title())
+            popup_html += f"<div style='margin-bottom: 3px;'><b>{label}:</b> {valor_formateado}</div>"
+        popup_html += "<hr style='margin: 8px 0; border: none; border-top: 1px solid #ddd;'>"
+        popup_html += "<div style='text-align: center;'><small style='color: #999; font-size: 10px;'>Haz clic para seleccionar o deseleccionar</small></div></div>"
+        features.append({
+            "type": "Feature",
+            "geometry": row.geometry.__geo_interface__,
+            "properties": {"id": str(idx), "popup": popup_html},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def popups_navegador(id_resultado):
+    """Camino actual: mostrar_parcelas lee el resultado guardado y solo envía los atributos"""
+    from pages.page2_bbox import mostrar_parcelas
+
+    return mostrar_parcelas(id_resultado)[0]
+
+
+def main():
+    import dash
+    dash.Dash(__name__, use_pages=True, pages_folder="")  # permite importar las páginas
+    print(f"{'parcelas':>9} {'camino':<11} {'segundos':>9} {'JSON (MB)':>10} {'gzip (MB)':>10}")
+    for n in (5_000, 50_000):
+        gdf = parcelas_sinteticas(n)
+        entradas = {"servidor": gdf.to_json(), "navegador": guardar_resultado(gdf)}
+        for descripcion, camino in (("servidor", popups_servidor), ("navegador", popups_navegador)):
+            inicio = time.perf_counter()
+            salida = camino(entradas[descripcion])
+            segundos = time.perf_counter() - inicio
+            cuerpo = to_json_plotly(salida).encode()
+            print(f"{n:>9} {descripcion:<11} {segundos:>9.2f} {len(cuerpo) / 1024 ** 2:>10.1f} {len(gzip.compress(cuerpo, 6)) / 1024 ** 2:>10.1f}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(directorio_cache, ignore_errors=True)
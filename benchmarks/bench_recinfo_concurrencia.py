@@ -0,0 +1,48 @@
+"""
+Benchmark: rendimiento de descargar_por_codigos según el nivel de concurrencia
+
+Cada nivel empieza con la caché de recinfo vacía, en un directorio
+temporal para no tocar la de la aplicación.
+
+Uso: python -m benchmarks.bench_recinfo_concurrencia [num_codigos] [latencia_s]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+directorio_cache = tempfile.mkdtemp()
+os.environ["SIGPAC_CACHE_DIR"] = directorio_cache
+
+from utils import sigpac_api  # noqa: E402
+from benchmarks.servidor_falso import arrancar_recinfo  # noqa: E402
+
+
+def main():
+    num_codigos = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    latencia = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+
+    servidor, url_base = arrancar_recinfo(latencia)
+    sigpac_api.URL_BASE = url_base
+
+    dict_parcelas = {i + 1: f"14:900:74:{i + 1}:4" for i in range(num_codigos)}
+
+    print(f"{num_codigos} códigos, latencia simulada {latencia * 1000:.0f} ms")
+    print(f"{'concurrencia':>12} {'segundos':>10} {'códigos/s':>10}")
+    for concurrencia in (1, 2, 4, 8, 16, 32):
+        sigpac_api.obtener_cache_recinfo().limpiar()
+        inicio = time.perf_counter()
+        gdf = sigpac_api.descargar_por_codigos(dict_parcelas, max_concurrencia=concurrencia)
+        duracion = time.perf_counter() - inicio
+        assert gdf is not None and list(gdf['id_entrada']) == list(dict_parcelas)
+        print(f"{concurrencia:>12} {duracion:>10.2f} {num_codigos / duracion:>10.1f}")
+
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(directorio_cache, ignore_errors=True)
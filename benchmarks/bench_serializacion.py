@@ -0,0 +1,47 @@
+"""
+Benchmark: serialización de resultados, GeoJSON vs. Arrow IPC
+
+Tiempo de escritura y lectura y tamaño de gdf.to_json() + gpd.read_file()
+(el camino anterior de los dcc.Store) frente a utils.serializacion, con y
+sin compresión, para 1.000, 10.000 y 100.000 recintos.
+
+Uso: python -m benchmarks.bench_serializacion
+"""
+import time
+
+import geopandas as gpd
+
+from benchmarks.servidor_falso import parcelas_sinteticas
+from utils.serializacion import deserializar, serializar
+
+CAMINOS = [
+    ("GeoJSON", lambda gdf: gdf.to_json().encode(), lambda datos: gpd.read_file(datos.decode())),
+    ("Arrow IPC", lambda gdf: serializar(gdf, compresion=None), deserializar),
+    ("Arrow IPC zstd", serializar, deserializar),
+]
+
+
+def _mejor_tiempo(funcion, *args, repeticiones=3):
+    """Resultado y mejor tiempo de varias ejecuciones"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        tiempos.append(time.perf_counter() - inicio)
+    return resultado, min(tiempos)
+
+
+def main():
+    print(f"{'recintos':>9} {'formato':<15} {'escritura (s)':>14} {'lectura (s)':>12} {'tamaño (MB)':>12} {'tipos':>6}")
+    for n in (1_000, 10_000, 100_000):
+        gdf = parcelas_sinteticas(n)
+        for descripcion, escribir, leer in CAMINOS:
+            datos, t_escritura = _mejor_tiempo(escribir, gdf)
+            leido, t_lectura = _mejor_tiempo(leer, datos)
+            assert len(leido) == n and leido.geometry.equals(gdf.geometry)
+            tipos = "igual" if leido.dtypes.to_dict() == gdf.dtypes.to_dict() else "cambia"
+            print(f"{n:>9} {descripcion:<15} {t_escritura:>14.3f} {t_lectura:>12.3f} {len(datos) / 1024 ** 2:>12.2f} {tipos:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Benchmark: rectángulo grande de la API OGC entero vs. por teselas (con caché)
+
+El servidor falso tarda más cuantos más recintos tiene el bbox pedido,
+como el servicio real. Se mide la consulta entera paginada, la consulta
+por teselas, la misma consulta otra vez (teselas en caché) y otra que se
+solapa a medias.
+
+Uso: python -m benchmarks.bench_teselas_ogc
+"""
+import os
+import shutil
+import tempfile
+import time
+
+directorio_cache = tempfile.mkdtemp()
+os.environ["SIGPAC_CACHE_DIR"] = directorio_cache
+
+from benchmarks.servidor_falso import arrancar_ogc  # noqa: E402
+from utils import sigpac_api, teselas_ogc  # noqa: E402
+
+BBOX = [-4.8, 37.8, -4.65, 37.95]
+SOLAPADO = [-4.725, 37.8, -4.575, 37.95]
+
+
+def main():
+    n = 40_000
+    peticiones = []
+    servidor, url = arrancar_ogc(n, latencia=0.05, max_pagina=1000, peticiones=peticiones, coste_recinto=50e-6)
+    sigpac_api.URL_OGC_RECINTOS = teselas_ogc.URL_OGC_RECINTOS = url
+
+    print(f"{'consulta':<26} {'recintos':>9} {'peticiones':>11} {'teselas':>8} {'segundos':>9}")
+    inicio = time.perf_counter()
+    esperado, _ = sigpac_api.descargar_por_bbox_con_estado(BBOX)
+    print(f"{'entera, paginada':<26} {len(esperado):>9} {len(peticiones):>11} {'-':>8} {time.perf_counter() - inicio:>9.2f}")
+
+    for descripcion, bbox in (("por teselas", BBOX), ("por teselas, en caché", BBOX), ("solapada a medias", SOLAPADO)):
+        peticiones.clear()
+        inicio = time.perf_counter()
+        gdf, estado = teselas_ogc.descargar_por_teselas(bbox)
+        segundos = time.perf_counter() - inicio
+        assert not gdf.duplicated(['poligono', 'parcela']).any() and not estado['recortado']
+        if bbox is BBOX:
+            assert len(gdf) == len(esperado)
+        print(f"{descripcion:<26} {len(gdf):>9} {len(peticiones):>11} {estado['teselas']:>8} {segundos:>9.2f}")
+
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(directorio_cache, ignore_errors=True)
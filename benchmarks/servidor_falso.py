@@ -0,0 +1,356 @@
+"""
+Servidor local que imita los servicios SIGPAC para los benchmarks
+"""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def geojson_recinto(pr, mu, po, pa, re) -> dict:
+    """GeoJSON con la misma forma que una respuesta de recinfo"""
+    x = -4.8 + (int(pa) % 1000) * 0.001
+    y = 37.8 + (int(re) % 1000) * 0.001
+    return {
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[[x, y], [x + 0.001, y], [x + 0.001, y + 0.001], [x, y + 0.001], [x, y]]]
+            },
+            "properties": {
+                "provincia": int(pr), "municipio": int(mu), "agregado": 0, "zona": 0,
+                "poligono": int(po), "parcela": int(pa), "recinto": int(re),
+                "superficie": 1.2345, "pendiente_media": 35.0, "coef_regadio": 0.0,
+                "uso_sigpac": "OV", "incidencias": None, "region": "0401",
+            }
+        }]
+    }
+
+
+class _ManejadorRecinfo(BaseHTTPRequestHandler):
+    latencia = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latencia)
+        partes = self.path.rstrip("/").split("/")
+        try:
+            pr, mu, _ag, _zo, po, pa = partes[-7:-1]
+            re = partes[-1].split(".")[0]
+            cuerpo = json.dumps(geojson_recinto(pr, mu, po, pa, re)).encode()
+        except ValueError:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/geo+json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def arrancar_recinfo(latencia: float = 0.05):
+    """Arranca el servidor falso de recinfo y devuelve (servidor, url_base)"""
+    manejador = type("Manejador", (_ManejadorRecinfo,), {"latencia": latencia})
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    puerto = servidor.server_address[1]
+    url_base = f"http://127.0.0.1:{puerto}/recinfo/{{pr}}/{{mu}}/{{ag}}/{{zo}}/{{po}}/{{pa}}/{{re}}.geojson"
+    return servidor, url_base
+
+
+class _ManejadorInestable(BaseHTTPRequestHandler):
+    latencia = 0.0
+    peticiones = None
+    _lock = threading.Lock()
+
+    def do_GET(self):
+        with self._lock:
+            self.peticiones.append(self.path)
+            n = sum(1 for p in self.peticiones if p == self.path)
+        if self.path == "/ok":
+            codigo = 200
+        elif self.path == "/alterno":
+            codigo = 502 if n % 2 else 200  # falla la 1ª, 3ª, 5ª...
+        elif self.path == "/lento":
+            time.sleep(self.latencia)
+            codigo = 200
+        elif self.path == "/error":
+            codigo = 502
+        else:
+            codigo = 404
+        cuerpo = b"{}"
+        self.send_response(codigo)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def arrancar_inestable(latencia: float = 1.0, peticiones: list = None):
+    """
+    Servidor que falla a propósito; devuelve (servidor, url_base)
+
+    Rutas: /ok (200), /alterno (502 y 200 alternos), /error (siempre 502),
+    /lento (200 tras `latencia` segundos); el resto, 404. Cada ruta pedida
+    se añade a `peticiones`.
+    """
+    manejador = type("Manejador", (_ManejadorInestable,), {
+        "latencia": latencia, "peticiones": peticiones if peticiones is not None else [], "_lock": threading.Lock(),
+    })
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+class _ManejadorFicheros(BaseHTTPRequestHandler):
+    directorio = "."
+    latencia = 0.0
+    peticiones = None
+    cortar_tras = None
+
+    def _ruta(self):
+        from urllib.parse import unquote
+        import os
+        return os.path.join(self.directorio, unquote(self.path.split("?")[0]).lstrip("/"))
+
+    def _cabeceras(self):
+        """Envía las cabeceras y devuelve (ruta, inicio, fin) de lo que hay que enviar"""
+        import os
+        time.sleep(self.latencia)
+        if self.peticiones is not None:
+            self.peticiones.append((self.command, self.path))
+        ruta = self._ruta()
+        if not os.path.isfile(ruta):
+            self.send_error(404)
+            return None
+        tamano = os.path.getsize(ruta)
+        etag = f'"{tamano}-{int(os.path.getmtime(ruta))}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return None
+
+        inicio, fin = 0, tamano - 1
+        rango = self.headers.get("Range", "")
+        if rango.startswith("bytes=") and self.headers.get("If-Range", etag) == etag:
+            desde, _, hasta = rango[len("bytes="):].partition("-")
+            inicio = int(desde)
+            fin = int(hasta) if hasta else tamano - 1
+            if inicio >= tamano:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{tamano}")
+                self.end_headers()
+                return None
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {inicio}-{fin}/{tamano}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/atom+xml" if ruta.endswith(".xml") else "application/zip")
+        self.send_header("Content-Length", str(fin - inicio + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        return ruta, inicio, fin
+
+    def do_HEAD(self):
+        self._cabeceras()
+
+    def do_GET(self):
+        envio = self._cabeceras()
+        if envio is None:
+            return
+        ruta, inicio, fin = envio
+        pendiente = fin - inicio + 1
+        # Corta la conexión tras `cortar_tras` bytes para simular caídas de red
+        cortar = self.cortar_tras is not None and pendiente > self.cortar_tras
+        limite = self.cortar_tras if cortar else pendiente
+        with open(ruta, "rb") as f:
+            f.seek(inicio)
+            while limite > 0:
+                bloque = f.read(min(1024 * 1024, limite))
+                if not bloque:
+                    break
+                self.wfile.write(bloque)
+                limite -= len(bloque)
+        if cortar:
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+
+    def log_message(self, *args):
+        pass
+
+
+def arrancar_ficheros(directorio: str, latencia: float = 0.0, peticiones: list = None, cortar_tras: int = None):
+    """
+    Sirve un directorio como si fuera el ATOM de FEGA; devuelve (servidor, url_base)
+
+    Admite HEAD, peticiones condicionales (ETag) y Range. Con `cortar_tras`
+    cada respuesta se corta después de enviar ese número de bytes.
+    """
+    manejador = type("Manejador", (_ManejadorFicheros,), {
+        "directorio": directorio, "latencia": latencia, "peticiones": peticiones, "cortar_tras": cortar_tras,
+    })
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+def crear_gpkg_sintetico(ruta: str, num_recintos: int, provincia: int = 14, municipio: int = 51):
+    """GeoPackage con recintos cuadrados y los atributos de los ficheros ATOM"""
+    import geopandas as gpd
+    import numpy as np
+    import shapely
+
+    rng = np.random.default_rng(0)
+    lado = int(np.ceil(np.sqrt(num_recintos)))
+    i = np.arange(num_recintos)
+    x = -4.9 + (i % lado) * 0.002
+    y = 37.7 + (i // lado) * 0.002
+    geometrias = shapely.box(x, y, x + 0.0018, y + 0.0018)
+
+    gdf = gpd.GeoDataFrame({
+        "provincia": provincia,
+        "municipio": municipio,
+        "agregado": 0,
+        "zona": 0,
+        "poligono": i // 500 + 1,
+        "parcela": i % 500 + 1,
+        "recinto": 1,
+        "dn_surface": rng.uniform(500, 200000, num_recintos).round(2),
+        "pendiente_media": rng.integers(0, 400, num_recintos),
+        "coef_regadio": rng.choice([0.0, 100.0], num_recintos),
+        "uso_sigpac": rng.choice(["OV", "TA", "VI", "PA", "FO", "CA"], num_recintos),
+        "incidencias": rng.choice(["", "12,117", "199"], num_recintos),
+        "region": "0401",
+        "geometry": geometrias,
+    }, crs="EPSG:4258")
+    gdf.to_file(ruta, driver="GPKG", layer="recinto")
+    return ruta
+
+
+def parcelas_sinteticas(n: int):
+    """Parcelas como las que guarda descargar_bbox (esquema de la API OGC)"""
+    import geopandas as gpd
+    import numpy as np
+    import shapely
+
+    rng = np.random.default_rng(0)
+    lado = int(np.ceil(np.sqrt(n)))
+    i = np.arange(n)
+    x = -4.8 + (i % lado) * 0.001
+    y = 37.8 + (i // lado) * 0.001
+    gdf = gpd.GeoDataFrame({
+        "provincia": 14, "municipio": 51, "agregado": 0, "zona": 0,
+        "poligono": i // 500 + 1, "parcela": i % 500 + 1, "recinto": 1,
+        "superficie": rng.uniform(0.05, 20, n).round(4),
+        "pendiente_media": rng.integers(0, 400, n).astype(float),
+        "coef_regadio": rng.choice([0.0, 100.0], n),
+        "uso_sigpac": rng.choice(["OV", "TA", "VI", "PA"], n),
+        "incidencias": rng.choice([None, "12,117"], n),
+        "region": "0401",
+        "geometry": shapely.box(x, y, x + 0.0009, y + 0.0009),
+    }, crs="EPSG:4326")
+    gdf['id_parcela'] = range(n)
+    return gdf
+
+
+class _ManejadorOgc(BaseHTTPRequestHandler):
+    limites = None
+    latencia = 0.0
+    coste_recinto = 0.0
+    max_pagina = 1000
+    peticiones = None
+
+    def _feature(self, i: int) -> dict:
+        x0, y0, x1, y1 = self.limites[i].tolist()
+        return {
+            "type": "Feature",
+            "id": int(i),
+            "geometry": {"type": "Polygon", "coordinates": [[[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]]},
+            "properties": {
+                "provincia": 14, "municipio": 51, "agregado": 0, "zona": 0,
+                "poligono": int(i) // 1000 + 1, "parcela": int(i) % 1000 + 1, "recinto": 1,
+                "superficie": 1.2345, "pendiente_media": 35.0, "coef_regadio": 0.0,
+                "uso_sigpac": "OV", "incidencias": None, "region": "0401",
+            },
+        }
+
+    def do_GET(self):
+        from urllib.parse import parse_qs, urlencode, urlparse
+        import numpy as np
+
+        if self.peticiones is not None:
+            self.peticiones.append(self.path)
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        limite = min(int(params.get("limit", 10)), self.max_pagina)
+        offset = int(params.get("offset", 0))
+
+        limites = self.limites
+        if "bbox" in params:
+            min_x, min_y, max_x, max_y = (float(c) for c in params["bbox"].split(","))
+            seleccion = np.flatnonzero(
+                (limites[:, 0] <= max_x) & (limites[:, 2] >= min_x) & (limites[:, 1] <= max_y) & (limites[:, 3] >= min_y)
+            )
+        else:
+            seleccion = np.arange(len(limites))
+
+        # Como en el servicio real, contar los recintos del bbox cuesta más cuanto más grande es
+        time.sleep(self.latencia + self.coste_recinto * len(seleccion))
+        pagina = seleccion[offset:offset + limite]
+        enlaces = []
+        if offset + limite < len(seleccion):
+            siguiente = dict(params, offset=offset + limite, limit=limite)
+            enlaces.append({"rel": "next", "type": "application/geo+json", "href": f"http://{self.headers['Host']}{url.path}?{urlencode(siguiente)}"})
+
+        cuerpo = json.dumps({
+            "type": "FeatureCollection",
+            "features": [self._feature(i) for i in pagina],
+            "numberMatched": len(seleccion),
+            "numberReturned": len(pagina),
+            "links": enlaces,
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/geo+json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def arrancar_ogc(num_recintos: int, latencia: float = 0.0, max_pagina: int = 1000, peticiones: list = None, coste_recinto: float = 0.0):
+    """
+    Arranca una API OGC falsa de recintos y devuelve (servidor, url_items)
+
+    Los recintos son cuadrados de 0.001º en una rejilla desde (-4.8, 37.8).
+    Filtra por bbox, pagina con limit/offset (como mucho `max_pagina`) y
+    devuelve numberMatched y enlaces next. Cada respuesta tarda `latencia`
+    más `coste_recinto` por recinto del bbox.
+    """
+    import numpy as np
+
+    lado = int(np.ceil(np.sqrt(num_recintos)))
+    i = np.arange(num_recintos)
+    x = -4.8 + (i % lado) * 0.001
+    y = 37.8 + (i // lado) * 0.001
+    manejador = type("Manejador", (_ManejadorOgc,), {
+        "limites": np.column_stack([x, y, x + 0.001, y + 0.001]).round(6),
+        "latencia": latencia, "max_pagina": max_pagina, "peticiones": peticiones, "coste_recinto": coste_recinto,
+    })
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}/ogcapi/collections/recintos/items"
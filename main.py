@@ -1,17 +1,25 @@
 """
 SIGPAC Dash App - Responsive Version
 """
+import os
+
 import dash
-from dash import Dash, html, dcc
+import diskcache
+from dash import Dash, DiskcacheManager, html, dcc
 import dash_mantine_components as dmc
 from dash_iconify import DashIconify
 
+from utils.cache_disco import DIR_CACHE
+
+# Callbacks en segundo plano (descargas largas con progreso), compartidos entre workers
+background_callback_manager = DiskcacheManager(diskcache.Cache(os.path.join(DIR_CACHE, "callbacks")))
 
 app = Dash(
     __name__,
     use_pages=True,
     suppress_callback_exceptions=True,
-    title="SIGPAC Parcelas"
+    title="SIGPAC Parcelas",
+    background_callback_manager=background_callback_manager
 )
 
 # Layout responsive
@@ -223,7 +231,39 @@ app.layout = dmc.MantineProvider(
 server = app.server
 
 
-import os
+@server.route("/metricas")
+def metricas():
+    """
+    Estadísticas para monitorización
+
+    Los contadores de las cachés y del limitador y el estado de los
+    circuitos se comparten entre todos los workers y los procesos de los
+    callbacks en segundo plano; memo_resultados es solo de este worker.
+    """
+    from flask import jsonify
+    from utils import http_client
+    from utils.cache_datasets import obtener_cache_datasets
+    from utils.limitador import obtener_limitador
+    from utils.resultados import obtener_cache_resultados, obtener_memo_resultados
+    from utils.sigpac_api import obtener_cache_recinfo
+    from utils.sigpac_atom import obtener_caches_atom
+    from utils.teselas_ogc import obtener_cache_teselas
+
+    cache_fechas, cache_404 = obtener_caches_atom()
+
+    return jsonify({
+        "pid": os.getpid(),
+        "cache_recinfo": obtener_cache_recinfo().estadisticas(),
+        "atom_fechas": cache_fechas.estadisticas(),
+        "atom_404": cache_404.estadisticas(),
+        "datasets_atom": obtener_cache_datasets().estadisticas(),
+        "teselas_ogc": obtener_cache_teselas().estadisticas(),
+        "resultados": obtener_cache_resultados().estadisticas(),
+        "memo_resultados": obtener_memo_resultados().estadisticas(),
+        "circuitos": http_client.estadisticas(),
+        "limitador": obtener_limitador().estadisticas(),
+    })
+
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8050))
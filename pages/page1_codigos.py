@@ -7,14 +7,23 @@ from dash import html, dcc, callback, Input, Output, State, no_update
 import dash_mantine_components as dmc
 import dash_leaflet as dl
 import base64
-import geopandas as gpd
+import os
+import pandas as pd
 
-from utils.sigpac_api import descargar_por_codigos, calcular_estadisticas
+from utils.sigpac_api import iterar_descarga_por_codigos, calcular_estadisticas, normalizar_codigos
+from utils.importar_codigos import MAX_BYTES_SUBIDA, guardar_subida, leer_codigos_por_lotes, contar_filas
 from utils.geo_utils import gdf_to_geojson, calcular_centro_zoom, exportar_geopackage, exportar_shapefile
+from utils.resultados import MENSAJE_CADUCADO, guardar_resultado, obtener_resultado
 
 # Registrar página
 dash.register_page(__name__, path="/", name="Códigos SIGPAC")
 
+# Parcelas como máximo en el mapa provisional mientras dura la descarga. Cada
+# aviso de progreso lleva el mapa entero (Dash solo entrega el último), así
+# que la vista previa se limita y se simplifica (~1 m) para que pese poco
+MAX_FEATURES_PARCIALES = 500
+TOLERANCIA_PARCIALES = 1e-5
+
 # =============================================================================
 # LAYOUT RESPONSIVE
 # =============================================================================
@@ -70,6 +79,48 @@ layout = dmc.Container(
                             mb="md"
                         ),
                         
+                        dmc.Divider(label="o desde un fichero CSV/XLSX", labelPosition="center", mb="md"),
+                        
+                        dcc.Upload(
+                            id="upload-codigos",
+                            accept=".csv,.txt,.xlsx,.xlsm",
+                            max_size=MAX_BYTES_SUBIDA,
+                            style={
+                                "border": "1px dashed #adb5bd",
+                                "borderRadius": "6px",
+                                "padding": "14px",
+                                "textAlign": "center",
+                                "cursor": "pointer",
+                                "fontSize": "14px",
+                                "color": "#666",
+                                "marginBottom": "8px"
+                            },
+                            children=html.Div([
+                                "Arrastra o ", html.B("selecciona un fichero"),
+                                html.Div(f"Máximo {MAX_BYTES_SUBIDA // (1024 * 1024)} MB", style={"fontSize": "12px", "marginTop": "4px"})
+                            ])
+                        ),
+                        html.Div(id="nombre-fichero", style={"fontSize": "13px", "marginBottom": "8px"}),
+                        
+                        dmc.TextInput(
+                            id="input-columnas",
+                            label="Columnas (opcional)",
+                            description="Una columna con PR:MU:PO:PA:RE o cinco separadas por comas",
+                            placeholder="provincia,municipio,poligono,parcela,recinto",
+                            mb="sm"
+                        ),
+                        
+                        dmc.Button(
+                            "Descargar fichero",
+                            id="btn-descargar-fichero",
+                            fullWidth=True,
+                            color="green",
+                            variant="light",
+                            disabled=True,
+                            mb="md"
+                        ),
+                        
+                        html.Div(id="progreso-descarga"),
                         html.Div(id="status-msg")
                     ]
                 ),
@@ -163,35 +214,237 @@ def activar_loading(n):
 @callback(
     Output("store-gdf", "data"),
     Output("status-msg", "children"),
-    Output("loading-overlay", "visible"),
     Output("store-loading", "data", allow_duplicate=True),
     Input("store-loading", "data"),
     State("input-codigos", "value"),
+    background=True,
+    progress=[
+        Output("progreso-descarga", "children"),
+        Output("mapa-resultados", "children"),
+        Output("loading-overlay", "visible"),
+    ],
+    running=[(Output("btn-descargar", "disabled"), True, False)],
     prevent_initial_call=True
 )
-def descargar(loading, codigos_text):
+def descargar(set_progress, loading, codigos_text):
+    """Descarga en segundo plano, pintando las parcelas en el mapa según llegan"""
     if not loading:
-        return no_update, no_update, no_update, no_update
-        
+        return no_update, no_update, no_update
+    
     if not codigos_text:
-        return None, dmc.Alert("Introduce códigos", color="yellow"), False, False
+        set_progress((None, None, False))
+        return None, dmc.Alert("Introduce códigos", color="yellow"), False
     
     lineas = [l.strip() for l in codigos_text.strip().split("\n") if l.strip()]
     if not lineas:
-        return None, dmc.Alert("No hay códigos válidos", color="yellow"), False, False
+        set_progress((None, None, False))
+        return None, dmc.Alert("No hay códigos válidos", color="yellow"), False
     
     dict_parcelas = {i+1: linea for i, linea in enumerate(lineas)}
     
+    # Validación previa: las líneas mal formadas no llegan a pedirse
+    codigos, invalidos = normalizar_codigos(dict_parcelas)
+    if codigos.empty:
+        set_progress((None, None, False))
+        return None, html.Div([dmc.Alert("No hay códigos válidos", color="yellow"), _aviso_codigos_invalidos(invalidos)]), False
+    
     try:
-        gdf = descargar_por_codigos(dict_parcelas)
+        store, status = _descargar_lotes(set_progress, [dict_parcelas], len(lineas))
+        return store, status, False
+    
+    except Exception as e:
+        set_progress((None, None, False))
+        return None, dmc.Alert(f"Error: {str(e)}", color="red"), False
+
+
+@callback(
+    Output("nombre-fichero", "children"),
+    Output("btn-descargar-fichero", "disabled"),
+    Input("upload-codigos", "filename"),
+    prevent_initial_call=True
+)
+def mostrar_fichero(nombre):
+    """Muestra el fichero elegido y habilita su descarga"""
+    if not nombre:
+        return None, True
+    return f"📄 {nombre}", False
+
+
+@callback(
+    Output("store-gdf", "data", allow_duplicate=True),
+    Output("status-msg", "children", allow_duplicate=True),
+    Input("btn-descargar-fichero", "n_clicks"),
+    State("upload-codigos", "contents"),
+    State("upload-codigos", "filename"),
+    State("input-columnas", "value"),
+    background=True,
+    progress=[
+        Output("progreso-descarga", "children"),
+        Output("mapa-resultados", "children"),
+        Output("loading-overlay", "visible"),
+    ],
+    running=[
+        (Output("btn-descargar-fichero", "disabled"), True, False),
+        (Output("btn-descargar", "disabled"), True, False),
+    ],
+    prevent_initial_call=True
+)
+def descargar_fichero(set_progress, n, contenido, nombre, columnas):
+    """Descarga los códigos de un CSV/XLSX leyéndolo por lotes"""
+    if not contenido or not nombre:
+        return no_update, no_update
+    
+    if not nombre.lower().endswith((".csv", ".txt", ".xlsx", ".xlsm")):
+        return no_update, dmc.Alert("Formato no admitido: usa CSV o XLSX", color="yellow")
+    
+    set_progress((None, None, True))
+    ruta = guardar_subida(contenido, nombre)
+    del contenido
+    
+    try:
+        lotes = leer_codigos_por_lotes(ruta, columnas or None)
+        return _descargar_lotes(set_progress, lotes, contar_filas(ruta))
+    
+    except Exception as e:
+        set_progress((None, None, False))
+        return None, dmc.Alert(f"Error: {str(e)}", color="red")
+    
+    finally:
+        os.remove(ruta)
+
+
+def _descargar_lotes(set_progress, lotes, total_filas=None):
+    """
+    Descarga lotes de códigos ({id_entrada: código}) informando del progreso
+    
+    Devuelve los valores de store-gdf y status-msg.
+    """
+    partes = []
+    estados = {}
+    invalidos = []
+    num_repetidos = 0
+    vistos = set()  # códigos normalizados ya pedidos en lotes anteriores
+    
+    features_parciales = []
+    centro, zoom = None, None
+    mapa_parcial = None
+    filas_previas = 0
+    fallos_previos = 0
+    
+    for dict_parcelas in lotes:
+        codigos, invalidos_lote = normalizar_codigos(dict_parcelas)
+        invalidos.extend(invalidos_lote)
         
-        if gdf is None or len(gdf) == 0:
-            return None, dmc.Alert("No se encontraron parcelas", color="red"), False, False
+        # Los repetidos de lotes anteriores no se vuelven a descargar ni a añadir
+        repetidos = codigos['codigo'].isin(vistos)
+        nuevos = codigos[~repetidos]
+        num_repetidos += int(repetidos.sum()) + len(nuevos) - nuevos['codigo'].nunique()
+        vistos.update(nuevos['codigo'])
         
-        return gdf.to_json(), dmc.Alert(f"✅ {len(gdf)} parcelas descargadas", color="green"), False, False
+        for progreso in iterar_descarga_por_codigos({k: dict_parcelas[k] for k in nuevos.index}):
+            if progreso.lote is not None and len(features_parciales) < MAX_FEATURES_PARCIALES:
+                # El mapa se centra con el primer lote y se mantiene para los siguientes
+                if centro is None:
+                    centro, zoom = calcular_centro_zoom(progreso.lote)
+                lote = progreso.lote.iloc[:MAX_FEATURES_PARCIALES - len(features_parciales)]
+                lote = lote[['geometry']].to_crs('EPSG:4326').simplify(TOLERANCIA_PARCIALES).to_frame('geometry')
+                features_parciales.extend(gdf_to_geojson(lote)["features"])
+                mapa_parcial = _crear_mapa({"type": "FeatureCollection", "features": features_parciales}, centro, zoom)
+            
+            # Filas ya procesadas: lotes anteriores más la parte hecha del actual
+            filas = filas_previas + (len(dict_parcelas) * progreso.hechos // progreso.total if progreso.total else len(dict_parcelas))
+            barra = _barra_progreso(filas, total_filas, fallos_previos + progreso.fallos)
+            set_progress((barra, mapa_parcial, mapa_parcial is None))
+            
+            if progreso.terminado:
+                if progreso.gdf is not None:
+                    partes.append(progreso.gdf)
+                estados.update(progreso.estados)
+                fallos_previos += progreso.fallos
+        
+        filas_previas += len(dict_parcelas)
     
-    except Exception as e:
-        return None, dmc.Alert(f"Error: {str(e)}", color="red"), False, False
+    set_progress((None, mapa_parcial, False))
+    
+    aviso_estados = _aviso_estados(estados)
+    aviso_invalidos = _aviso_codigos_invalidos(invalidos)
+    
+    if not partes:
+        return None, html.Div([dmc.Alert("No se encontraron parcelas", color="red"), aviso_estados, aviso_invalidos])
+    
+    # Una sola concatenación con los resultados de todos los lotes
+    gdf = pd.concat(partes, ignore_index=True) if len(partes) > 1 else partes[0]
+    
+    mensaje = f"✅ {len(gdf)} parcelas descargadas"
+    if num_repetidos:
+        mensaje += f" ({num_repetidos} códigos repetidos descargados una sola vez)"
+    
+    return guardar_resultado(gdf), html.Div([dmc.Alert(mensaje, color="green"), aviso_estados, aviso_invalidos])
+
+
+def _barra_progreso(filas, total_filas, fallos):
+    """Barra con los códigos procesados hasta el momento"""
+    texto = f"{filas} de {total_filas} códigos procesados" if total_filas else f"{filas} códigos procesados"
+    if fallos:
+        texto += f" · {fallos} fallido(s)"
+    
+    return html.Div(
+        style={"marginBottom": "10px"},
+        children=[
+            dmc.Progress(value=min(100, 100 * filas / total_filas) if total_filas else 100, color="green", size="lg", animated=True, striped=True),
+            html.Div(texto, style={"fontSize": "12px", "color": "#666", "marginTop": "4px"})
+        ]
+    )
+
+
+# Texto de cada resultado de descarga distinto de "ok"
+TEXTOS_ESTADO = {
+    "no_encontrado": "no encontrados en SIGPAC",
+    "error_remoto": "con error del servicio SIGPAC",
+    "timeout": "sin respuesta (tiempo agotado)",
+}
+
+
+def _aviso_estados(estados):
+    """Alerta con los códigos que no se pudieron descargar, agrupados por motivo"""
+    fallidos = {}
+    for id_entrada, estado in estados.items():
+        if estado != "ok":
+            fallidos.setdefault(estado, []).append(str(id_entrada))
+    
+    if not fallidos:
+        return None
+    
+    items = [
+        html.Li(f"{len(ids)} código(s) {TEXTOS_ESTADO.get(estado, estado)} (líneas {', '.join(ids[:20])}{'...' if len(ids) > 20 else ''})")
+        for estado, ids in fallidos.items()
+    ]
+    return dmc.Alert(
+        html.Ul(items, style={"margin": 0, "paddingLeft": "18px"}),
+        title="Códigos no descargados",
+        color="red" if set(fallidos) - {"no_encontrado"} else "yellow",
+        mt="sm"
+    )
+
+
+def _aviso_codigos_invalidos(invalidos, max_lineas=10):
+    """Alerta con las líneas descartadas y el motivo"""
+    if not invalidos:
+        return None
+    
+    items = [
+        html.Li(f"Línea {inv['id_entrada']}: \"{inv['linea']}\" - {inv['motivo']}")
+        for inv in invalidos[:max_lineas]
+    ]
+    if len(invalidos) > max_lineas:
+        items.append(html.Li(f"... y {len(invalidos) - max_lineas} más"))
+    
+    return dmc.Alert(
+        html.Ul(items, style={"margin": 0, "paddingLeft": "18px"}),
+        title=f"{len(invalidos)} línea(s) no válida(s)",
+        color="orange",
+        mt="sm"
+    )
 
 
 @callback(
@@ -201,11 +454,13 @@ def descargar(loading, codigos_text):
     Input("store-gdf", "data"),
     prevent_initial_call=True
 )
-def mostrar_resultados(gdf_json):
-    if not gdf_json:
+def mostrar_resultados(id_resultado):
+    if not id_resultado:
         return None, None, {"display": "none"}
     
-    gdf = gpd.read_file(gdf_json)
+    gdf = obtener_resultado(id_resultado)
+    if gdf is None:
+        return dmc.Alert(MENSAJE_CADUCADO, color="yellow"), None, {"display": "none"}
     stats = calcular_estadisticas(gdf)
     
     # Stats cards con clase responsive
@@ -232,7 +487,14 @@ def mostrar_resultados(gdf_json):
     centro, zoom = calcular_centro_zoom(gdf)
     geojson = gdf_to_geojson(gdf)
     
-    mapa = dl.Map(
+    mapa = _crear_mapa(geojson, centro, zoom)
+    
+    return stats_cards, mapa, {"marginTop": "20px", "display": "block"}
+
+
+def _crear_mapa(geojson, centro, zoom):
+    """Mapa satelital con la capa de parcelas"""
+    return dl.Map(
         center=centro,
         zoom=zoom,
         className="leaflet-map-responsive",
@@ -266,37 +528,41 @@ def mostrar_resultados(gdf_json):
             )
         ]
     )
-    
-    return stats_cards, mapa, {"marginTop": "20px", "display": "block"}
 
 
 @callback(
     Output("download-gpkg", "data"),
+    Output("status-msg", "children", allow_duplicate=True),
     Input("btn-gpkg", "n_clicks"),
     State("store-gdf", "data"),
     prevent_initial_call=True
 )
-def descargar_gpkg(n, gdf_json):
-    if not gdf_json:
-        return no_update
+def descargar_gpkg(n, id_resultado):
+    if not id_resultado:
+        return no_update, no_update
     
-    gdf = gpd.read_file(gdf_json)
+    gdf = obtener_resultado(id_resultado)
+    if gdf is None:
+        return no_update, dmc.Alert(MENSAJE_CADUCADO, color="yellow")
     contenido, nombre = exportar_geopackage(gdf)
     
-    return dict(content=base64.b64encode(contenido).decode(), filename=nombre, base64=True)
+    return dict(content=base64.b64encode(contenido).decode(), filename=nombre, base64=True), no_update
 
 
 @callback(
     Output("download-shp", "data"),
+    Output("status-msg", "children", allow_duplicate=True),
     Input("btn-shp", "n_clicks"),
     State("store-gdf", "data"),
     prevent_initial_call=True
 )
-def descargar_shp(n, gdf_json):
-    if not gdf_json:
-        return no_update
+def descargar_shp(n, id_resultado):
+    if not id_resultado:
+        return no_update, no_update
     
-    gdf = gpd.read_file(gdf_json)
+    gdf = obtener_resultado(id_resultado)
+    if gdf is None:
+        return no_update, dmc.Alert(MENSAJE_CADUCADO, color="yellow")
     contenido, nombre = exportar_shapefile(gdf)
     
-    return dict(content=base64.b64encode(contenido).decode(), filename=nombre, base64=True)
\ No newline at end of file
+    return dict(content=base64.b64encode(contenido).decode(), filename=nombre, base64=True), no_update
\ No newline at end of file
@@ -3,19 +3,45 @@ Página 2: Área en Mapa (BBOX) - RESPONSIVE
 Todo en un archivo
 """
 import dash
-from dash import html, dcc, callback, Input, Output, State, no_update
+from dash import html, dcc, callback, clientside_callback, ClientsideFunction, Input, Output, State, no_update
 import dash_mantine_components as dmc
 import dash_leaflet as dl
 import base64
-import geopandas as gpd
-import json
-import requests
+import pandas as pd
 
-from utils.geo_utils import gdf_to_geojson, calcular_centro_zoom, exportar_geopackage, exportar_shapefile
+from utils.http_client import ErrorServicio
+from utils.indice_espacial import descargar_area
+from utils.geo_utils import exportar_geopackage, exportar_shapefile
+from utils.resultados import MENSAJE_CADUCADO, guardar_resultado, obtener_resultado
 
 # Registrar página
 dash.register_page(__name__, path="/bbox", name="Área en Mapa")
 
+# Etiquetas legibles de los atributos para los popups (se envían una vez en hideout)
+NOMBRES_BONITOS = {
+    'dn_oid': 'Código SIGPAC',
+    'dn_surface': 'Superficie',
+    'superficie': 'Superficie',
+    'provincia': 'Provincia',
+    'municipio': 'Municipio',
+    'agregado': 'Agregado',
+    'zona': 'Zona',
+    'poligono': 'Polígono',
+    'parcela': 'Parcela',
+    'recinto': 'Recinto',
+    'uso_sigpac': 'Uso SIGPAC',
+    'coef_regadio': 'Coef. Regadío',
+    'pendiente_media': 'Pendiente',
+    'dn_pk': 'ID',
+    'incidencias': 'Incidencias',
+    'coef_barbecho': 'Coef. Barbecho'
+}
+
+# Unidades que se añaden al valor en el popup
+UNIDADES = {'dn_surface': 'ha', 'superficie': 'ha'}
+
+HIDEOUT_INICIAL = {"seleccionadas": [], "etiquetas": NOMBRES_BONITOS, "unidades": UNIDADES}
+
 # =============================================================================
 # LAYOUT RESPONSIVE
 # =============================================================================
@@ -176,8 +202,15 @@ layout = dmc.Container(
                                         position="topleft"
                                     )
                                 ]),
-                                # Capa de parcelas (se añade dinámicamente)
-                                html.Div(id="capa-parcelas")
+                                # Capa única de parcelas: el color sale de hideout.seleccionadas (assets/parcelas_bbox.js)
+                                dl.GeoJSON(
+                                    id="capa-parcelas",
+                                    data=None,
+                                    style={"variable": "sigpacBbox.estiloParcela"},
+                                    hoverStyle={"variable": "sigpacBbox.estiloHover"},
+                                    onEachFeature={"variable": "sigpacBbox.popupParcela"},
+                                    hideout=HIDEOUT_INICIAL
+                                )
                             ]
                         )
                     ]
@@ -245,29 +278,16 @@ def capturar_bbox(geojson):
     prevent_initial_call=True
 )
 def descargar_bbox(n, bbox, sup_max):
-    """Descarga parcelas del bbox usando API SIGPAC"""
+    """Parcelas del bbox: de los municipios ya descargados del ATOM y, para el resto del área, de la API SIGPAC"""
     if not bbox:
         return None, dmc.Alert("No hay área seleccionada", color="yellow")
     
     try:
-        min_lon, min_lat, max_lon, max_lat = bbox
-        
-        base_url = "https://sigpac-hubcloud.es/ogcapi/collections/recintos/items"
-        params = {
-            'f': 'json',
-            'limit': 5000,
-            'bbox': f"{min_lon},{min_lat},{max_lon},{max_lat}"
-        }
-        
-        response = requests.get(base_url, params=params, timeout=60)
-        response.raise_for_status()
-        data = response.json()
+        gdf, estado = descargar_area(bbox)
         
-        if 'features' not in data or len(data['features']) == 0:
+        if gdf is None or len(gdf) == 0:
             return None, dmc.Alert("No se encontraron parcelas en el área", color="yellow")
         
-        gdf = gpd.GeoDataFrame.from_features(data['features'], crs="EPSG:4326")
-        
         if sup_max and 'superficie' in gdf.columns:
             gdf = gdf[gdf['superficie'] <= sup_max].copy()
         
@@ -276,7 +296,18 @@ def descargar_bbox(n, bbox, sup_max):
         
         gdf['id_parcela'] = range(len(gdf))
         
-        return gdf.to_json(), dmc.Alert(f"✅ {len(gdf)} parcelas descargadas. Haz clic en el mapa para seleccionarlas", color="green")
+        origen = "obtenidas de la copia local" if not estado['remotos'] else "descargadas"
+        if estado['recortado']:
+            return guardar_resultado(gdf), dmc.Alert(
+                f"⚠️ {len(gdf)} parcelas {origen}, pero el área tiene más de las que se pueden descargar de una vez. "
+                "Dibuja un área más pequeña para verlas todas",
+                color="orange"
+            )
+        return guardar_resultado(gdf), dmc.Alert(f"✅ {len(gdf)} parcelas {origen}. Haz clic en el mapa para seleccionarlas", color="green")
+    
+    except ErrorServicio as e:
+        mensaje = "El servicio SIGPAC no respondió a tiempo" if e.estado == "timeout" else "Error del servicio SIGPAC"
+        return None, dmc.Alert(f"{mensaje}: {e.detalle}", color="red")
     
     except Exception as e:
         return None, dmc.Alert(f"Error: {str(e)}", color="red")
@@ -285,204 +316,92 @@ def descargar_bbox(n, bbox, sup_max):
 
 
 @callback(
-    Output("capa-parcelas", "children"),
+    Output("capa-parcelas", "data"),
+    Output("capa-parcelas", "hideout"),
+    Output("store-seleccionadas", "data"),
+    Output("info-seleccion", "children"),
+    Output("btn-gpkg-bbox", "disabled"),
+    Output("btn-shp-bbox", "disabled"),
     Output("seccion-seleccion", "style"),
     Input("store-gdf-bbox", "data"),
-    Input("store-seleccionadas", "data"),
     prevent_initial_call=True
 )
-def mostrar_parcelas(gdf_json, seleccionadas):
-    """Muestra las parcelas en el mapa con colores según selección y popups con TODOS los atributos"""
-    if not gdf_json:
-        return None, {"display": "none"}
+def mostrar_parcelas(id_resultado):
+    """Muestra las parcelas en una sola capa GeoJSON; los popups se crean en el navegador con sus atributos"""
+    if not id_resultado:
+        return None, HIDEOUT_INICIAL, [], "", True, True, {"display": "none"}
     
-    import pandas as pd
-    gdf = gpd.read_file(gdf_json, layer='recinto' if '.gpkg' in str(gdf_json) else None)
+    gdf = obtener_resultado(id_resultado)
+    if gdf is None:
+        return None, HIDEOUT_INICIAL, [], dmc.Alert(MENSAJE_CADUCADO, color="yellow"), True, True, {"display": "block"}
     
-    capas = []
+    # Solo los atributos y el id; los nulos no se envían
+    ids = gdf['id_parcela'] if 'id_parcela' in gdf.columns else pd.Series(gdf.index, index=gdf.index)
+    capa = gdf.drop(columns=['id_parcela'], errors='ignore').assign(id=ids.astype(str))
+    datos = capa.to_geo_dict(na='drop', drop_id=True)
     
-    for idx, row in gdf.iterrows():
-        color = "#00ff00" if str(idx) in seleccionadas else "#3388ff"
-        opacity = 0.7 if str(idx) in seleccionadas else 0.4
-        
-        # Crear contenido del popup con TODOS los atributos de la parcela
-        atributos_excluir = ['geometry', 'id_parcela']
-        
-        # Mapeo de nombres a etiquetas legibles
-        nombres_bonitos = {
-            'dn_oid': 'Código SIGPAC',
-            'dn_surface': 'Superficie',
-            'superficie': 'Superficie',
-            'provincia': 'Provincia',
-            'municipio': 'Municipio',
-            'agregado': 'Agregado',
-            'zona': 'Zona',
-            'poligono': 'Polígono',
-            'parcela': 'Parcela',
-            'recinto': 'Recinto',
-            'uso_sigpac': 'Uso SIGPAC',
-            'coef_regadio': 'Coef. Regadío',
-            'pendiente_media': 'Pendiente',
-            'dn_pk': 'ID',
-            'incidencias': 'Incidencias',
-            'coef_barbecho': 'Coef. Barbecho'
-        }
-        
-        # Construir HTML del popup
-        popup_html = f"<div style='font-family: Arial, sans-serif; font-size: 12px; line-height: 1.5;'>"
-        popup_html += f"<div style='background-color: #2d6a4f; color: white; padding: 6px; margin-bottom: 8px; border-radius: 4px;'>"
-        popup_html += f"<b style='font-size: 13px;'>Parcela #{idx}</b>"
-        popup_html += f"</div>"
-        
-        # Añadir todos los atributos
-        for col in gdf.columns:
-            if col not in atributos_excluir and col != 'geometry':
-                valor = row[col]
-                
-                # Saltar valores nulos, vacíos o nan
-                if valor is None:
-                    continue
-                if isinstance(valor, str) and valor.strip() == '':
-                    continue
-                if isinstance(valor, float) and pd.isna(valor):
-                    continue
-                
-                # Formatear valor
-                if col in ['dn_surface', 'superficie'] and isinstance(valor, (int, float)):
-                    valor_formateado = f"{valor:.2f} ha"
-                elif isinstance(valor, float):
-                    valor_formateado = f"{valor:.2f}"
-                else:
-                    valor_formateado = str(valor)
-                
-                # Obtener nombre bonito
-                label = nombres_bonitos.get(col, col.replace('_', ' ').title())
-                
-                popup_html += f"<div style='margin-bottom: 3px;'><b>{label}:</b> {valor_formateado}</div>"
-        
-        # Estado de selección
-        popup_html += f"<hr style='margin: 8px 0; border: none; border-top: 1px solid #ddd;'>"
-        popup_html += f"<div style='text-align: center;'>"
-        
-        if str(idx) in seleccionadas:
-            popup_html += f"<span style='color: #2e7d32; font-weight: bold;'>✅ Seleccionada</span>"
-        else:
-            popup_html += f"<span style='color: #666; font-weight: bold;'>⬜ No seleccionada</span>"
-        
-        popup_html += f"<br><small style='color: #999; font-size: 10px;'>Haz clic para cambiar</small>"
-        popup_html += f"</div></div>"
-        
-        geojson_feature = {
-            "type": "Feature",
-            "geometry": row.geometry.__geo_interface__,
-            "properties": {
-                "id": str(idx),
-                "popup": popup_html
-            }
-        }
-        
-        capa = dl.GeoJSON(
-            data=geojson_feature,
-            id={"type": "parcela", "index": str(idx)},
-            style={
-                "fillColor": color,
-                "color": "#ffffff",
-                "weight": 2,
-                "fillOpacity": opacity
-            },
-            hoverStyle={
-                "fillColor": "#ffff00",
-                "fillOpacity": 0.8,
-                "weight": 3
-            },
-            # Configuración del popup para que persista
-            hideout=dict(autoClose=False, closeOnClick=True)
-        )
-        capas.append(capa)
-    
-    return capas, {"display": "block"}
+    # Datos nuevos: la selección anterior ya no vale
+    return datos, HIDEOUT_INICIAL, [], "0 parcelas seleccionadas", True, True, {"display": "block"}
 
 
-@callback(
-    Output("store-seleccionadas", "data"),
-    Output("info-seleccion", "children"),
-    Output("btn-gpkg-bbox", "disabled"),
-    Output("btn-shp-bbox", "disabled"),
-    Input({"type": "parcela", "index": dash.dependencies.ALL}, "n_clicks"),
+# La selección se gestiona en el navegador (assets/parcelas_bbox.js): un clic
+# solo cambia hideout; al servidor llega la lista de ids al exportar
+clientside_callback(
+    ClientsideFunction(namespace="bbox", function_name="alternarSeleccion"),
+    Output("capa-parcelas", "hideout", allow_duplicate=True),
+    Output("store-seleccionadas", "data", allow_duplicate=True),
+    Output("info-seleccion", "children", allow_duplicate=True),
+    Output("btn-gpkg-bbox", "disabled", allow_duplicate=True),
+    Output("btn-shp-bbox", "disabled", allow_duplicate=True),
+    Input("capa-parcelas", "n_clicks"),
     Input("btn-deseleccionar", "n_clicks"),
-    State("store-seleccionadas", "data"),
-    State({"type": "parcela", "index": dash.dependencies.ALL}, "id"),
+    State("capa-parcelas", "clickData"),
+    State("capa-parcelas", "hideout"),
     prevent_initial_call=True
 )
-def gestionar_seleccion(n_clicks_list, n_deselect, seleccionadas, ids_list):
-    """Gestiona la selección de parcelas por clic"""
-    ctx = dash.callback_context
-    
-    if not ctx.triggered:
-        return seleccionadas, "", True, True
-    
-    trigger_id = ctx.triggered[0]["prop_id"]
-    
-    if "btn-deseleccionar" in trigger_id:
-        return [], "0 parcelas seleccionadas", True, True
-    
-    if "parcela" in trigger_id:
-        import json
-        trigger_dict = json.loads(trigger_id.split(".")[0])
-        parcela_id = trigger_dict["index"]
-        
-        if seleccionadas is None:
-            seleccionadas = []
-        
-        if parcela_id in seleccionadas:
-            seleccionadas = [s for s in seleccionadas if s != parcela_id]
-        else:
-            seleccionadas = seleccionadas + [parcela_id]
-        
-        num_sel = len(seleccionadas)
-        info = dmc.Alert(f"✅ {num_sel} parcela(s) seleccionada(s)", color="blue") if num_sel > 0 else "0 parcelas seleccionadas"
-        disabled = num_sel == 0
-        
-        return seleccionadas, info, disabled, disabled
-    
-    return seleccionadas, "", True, True
 
 
 @callback(
     Output("download-gpkg-bbox", "data"),
+    Output("status-bbox", "children", allow_duplicate=True),
     Input("btn-gpkg-bbox", "n_clicks"),
     State("store-gdf-bbox", "data"),
     State("store-seleccionadas", "data"),
     prevent_initial_call=True
 )
-def descargar_gpkg_bbox(n, gdf_json, seleccionadas):
-    if not gdf_json or not seleccionadas:
-        return no_update
+def descargar_gpkg_bbox(n, id_resultado, seleccionadas):
+    if not id_resultado or not seleccionadas:
+        return no_update, no_update
     
-    gdf = gpd.read_file(gdf_json)
+    gdf = obtener_resultado(id_resultado)
+    if gdf is None:
+        return no_update, dmc.Alert(MENSAJE_CADUCADO, color="yellow")
     ids = [int(i) for i in seleccionadas]
     gdf_sel = gdf[gdf['id_parcela'].isin(ids)]
     
     contenido, nombre = exportar_geopackage(gdf_sel, "parcelas_bbox.gpkg")
     
-    return dict(content=base64.b64encode(contenido).decode(), filename=nombre, base64=True)
+    return dict(content=base64.b64encode(contenido).decode(), filename=nombre, base64=True), no_update
 
 
 @callback(
     Output("download-shp-bbox", "data"),
+    Output("status-bbox", "children", allow_duplicate=True),
     Input("btn-shp-bbox", "n_clicks"),
     State("store-gdf-bbox", "data"),
     State("store-seleccionadas", "data"),
     prevent_initial_call=True
 )
-def descargar_shp_bbox(n, gdf_json, seleccionadas):
-    if not gdf_json or not seleccionadas:
-        return no_update
+def descargar_shp_bbox(n, id_resultado, seleccionadas):
+    if not id_resultado or not seleccionadas:
+        return no_update, no_update
     
-    gdf = gpd.read_file(gdf_json)
+    gdf = obtener_resultado(id_resultado)
+    if gdf is None:
+        return no_update, dmc.Alert(MENSAJE_CADUCADO, color="yellow")
     ids = [int(i) for i in seleccionadas]
     gdf_sel = gdf[gdf['id_parcela'].isin(ids)]
     
     contenido, nombre = exportar_shapefile(gdf_sel, "parcelas_bbox")
     
-    return dict(content=base64.b64encode(contenido).decode(), filename=nombre, base64=True)
\ No newline at end of file
+    return dict(content=base64.b64encode(contenido).decode(), filename=nombre, base64=True), no_update
\ No newline at end of file
@@ -7,15 +7,22 @@ from dash import html, dcc, callback, Input, Output, State, no_update
 import dash_mantine_components as dmc
 import dash_leaflet as dl
 import base64
-import geopandas as gpd
 
+from utils.atom_provincia import iterar_descarga_provincia
+from utils.http_client import ErrorServicio
 from utils.sigpac_atom import descargar_sigpac
 from utils.geo_utils import gdf_to_geojson, calcular_centro_zoom, exportar_geopackage, exportar_shapefile
 from utils.municipios_data import MUNICIPIOS
+from utils.resultados import MENSAJE_CADUCADO, guardar_resultado, obtener_resultado
 
 # Registrar página
 dash.register_page(__name__, path="/atom", name="Descarga ATOM")
 
+# Recintos que se dibujan como máximo (una provincia pasa de 100.000) y
+# tolerancia de simplificación en grados; la exportación lleva todos
+MAX_FEATURES_MAPA = 5000
+TOLERANCIA_MAPA = 1e-5
+
 # Datos de provincias
 PROVINCIAS = [
     {"value": "01", "label": "01 - Araba/Álava"},
@@ -127,6 +134,12 @@ layout = dmc.Container(
                             mb="md"
                         ),
                         
+                        dmc.Checkbox(
+                            id="check-provincia-completa",
+                            label="Toda la provincia (todos los municipios)",
+                            mb="md"
+                        ),
+                        
                         dmc.NumberInput(
                             id="input-superficie",
                             label="Superficie máxima (ha)",
@@ -172,6 +185,7 @@ layout = dmc.Container(
                             mb="md"
                         ),
                         
+                        html.Div(id="progreso-atom"),
                         html.Div(id="status-atom")
                     ]
                 ),
@@ -258,13 +272,14 @@ def actualizar_municipios(provincia):
     Output("input-superficie", "value"),
     Output("input-pendiente", "value"),
     Output("select-usos", "value"),
+    Output("check-provincia-completa", "checked"),
     Output("store-gdf-atom", "data", allow_duplicate=True),
     Input("btn-limpiar-atom", "n_clicks"),
     prevent_initial_call=True
 )
 def limpiar_atom(n):
     """Limpia todos los campos y resultados"""
-    return None, None, None, None, None, None
+    return None, None, None, None, None, False, None
 
 
 # Callback para activar loading al presionar el botón
@@ -287,36 +302,83 @@ def activar_loading_atom(n):
     Input("store-loading-atom", "data"),
     State("select-provincia", "value"),
     State("select-municipio", "value"),
+    State("check-provincia-completa", "checked"),
     State("input-superficie", "value"),
     State("input-pendiente", "value"),
     State("select-usos", "value"),
+    background=True,
+    progress=[Output("progreso-atom", "children")],
+    running=[(Output("btn-descargar-atom", "disabled"), True, False)],
     prevent_initial_call=True
 )
-def descargar_atom(loading, provincia, municipio, superficie, pendiente, usos):
+def descargar_atom(set_progress, loading, provincia, municipio, provincia_completa, superficie, pendiente, usos):
     if not loading:
         return no_update, no_update, no_update, no_update
     
-    if not provincia or not municipio:
+    if not provincia or (not municipio and not provincia_completa):
         return None, dmc.Alert("Selecciona provincia y municipio", color="yellow"), False, False
     
+    filtros = dict(
+        superficie_max_ha=superficie if superficie else None,
+        pendiente_min_mil=pendiente if pendiente else None,
+        uso_sigpac=usos if usos else None
+    )
+    
     try:
-        gdf = descargar_sigpac(
-            provincia=int(provincia),
-            municipio=municipio,
-            superficie_max_ha=superficie if superficie else None,
-            pendiente_min_mil=pendiente if pendiente else None,
-            uso_sigpac=usos if usos else None
-        )
+        if provincia_completa:
+            return _descargar_provincia(set_progress, provincia, filtros)
+        
+        gdf = descargar_sigpac(provincia=int(provincia), municipio=municipio, **filtros)
         
         if gdf is None or len(gdf) == 0:
             return None, dmc.Alert("No se encontraron datos. Verifica provincia/municipio", color="red"), False, False
         
-        return gdf.to_json(), dmc.Alert(f"✅ {len(gdf)} parcelas descargadas desde ATOM", color="green"), False, False
+        return guardar_resultado(gdf), dmc.Alert(f"✅ {len(gdf)} parcelas descargadas desde ATOM", color="green"), False, False
+    
+    except ErrorServicio as e:
+        set_progress((None,))
+        mensaje = "FEGA no respondió a tiempo" if e.estado == "timeout" else "Error del servicio ATOM de FEGA"
+        return None, dmc.Alert(f"{mensaje}: {e.detalle}", color="red"), False, False
     
     except Exception as e:
+        set_progress((None,))
         return None, dmc.Alert(f"Error: {str(e)}", color="red"), False, False
 
 
+def _descargar_provincia(set_progress, provincia, filtros):
+    """Descarga todos los municipios de la provincia mostrando cuántos van"""
+    for progreso in iterar_descarga_provincia(provincia, **filtros):
+        texto = f"{progreso.hechos} de {progreso.total} municipios · {progreso.recintos} recintos"
+        if progreso.fallos:
+            texto += f" · {progreso.fallos} sin datos"
+        set_progress((html.Div(
+            style={"marginBottom": "10px"},
+            children=[
+                dmc.Progress(value=100 * progreso.hechos / progreso.total if progreso.total else 100, color="green", size="lg", animated=True, striped=True),
+                html.Div(texto, style={"fontSize": "12px", "color": "#666", "marginTop": "4px"})
+            ]
+        ),))
+    
+    set_progress((None,))
+    gdf = progreso.gdf
+    
+    sin_datos = sorted(m for m, estado in progreso.estados.items() if estado != "ok")
+    aviso = None
+    if sin_datos:
+        aviso = dmc.Alert(
+            f"{len(sin_datos)} municipio(s) sin descargar: {', '.join(sin_datos[:20])}"
+            + (" ..." if len(sin_datos) > 20 else "")
+            + ". Vuelve a descargar para reintentarlos (los ya descargados no se repiten).",
+            color="yellow"
+        )
+    
+    if gdf is None or len(gdf) == 0:
+        return None, html.Div([dmc.Alert("No se encontraron datos para la provincia con esos filtros", color="red"), aviso]), False, False
+    
+    mensaje = f"✅ {len(gdf)} parcelas de {progreso.total - len(sin_datos)} municipios descargadas desde ATOM"
+    return guardar_resultado(gdf), html.Div([dmc.Alert(mensaje, color="green"), aviso]), False, False
+
+
 @callback(
     Output("stats-atom", "children"),
     Output("mapa-atom", "children"),
@@ -324,11 +386,13 @@ def descargar_atom(loading, provincia, municipio, superficie, pendiente, usos):
     Input("store-gdf-atom", "data"),
     prevent_initial_call=True
 )
-def mostrar_resultados_atom(gdf_json):
-    if not gdf_json:
+def mostrar_resultados_atom(id_resultado):
+    if not id_resultado:
         return None, None, {"display": "none"}
     
-    gdf = gpd.read_file(gdf_json)
+    gdf = obtener_resultado(id_resultado)
+    if gdf is None:
+        return dmc.Alert(MENSAJE_CADUCADO, color="yellow"), None, {"display": "none"}
     
     # Calcular estadísticas
     num_parcelas = len(gdf)
@@ -361,9 +425,20 @@ def mostrar_resultados_atom(gdf_json):
         ]
     )
     
-    # Mapa
-    centro, zoom = calcular_centro_zoom(gdf)
-    geojson = gdf_to_geojson(gdf)
+    # Mapa: una muestra repartida por toda la zona si hay demasiados recintos
+    if num_parcelas > MAX_FEATURES_MAPA:
+        dibujados = gdf.sample(MAX_FEATURES_MAPA, random_state=0).sort_index()
+        aviso_mapa = html.Div(
+            f"El mapa muestra {MAX_FEATURES_MAPA} de {num_parcelas} recintos; las descargas incluyen todos",
+            style={"fontSize": "12px", "color": "#666", "marginTop": "8px"}
+        )
+        stats_cards = html.Div([stats_cards, aviso_mapa])
+    else:
+        dibujados = gdf
+    dibujados = dibujados.to_crs('EPSG:4326')
+    dibujados = dibujados.set_geometry(dibujados.simplify(TOLERANCIA_MAPA))
+    centro, zoom = calcular_centro_zoom(dibujados)
+    geojson = gdf_to_geojson(dibujados)
     
     mapa = dl.Map(
         center=centro,
@@ -405,31 +480,37 @@ def mostrar_resultados_atom(gdf_json):
 
 @callback(
     Output("download-gpkg-atom", "data"),
+    Output("status-atom", "children", allow_duplicate=True),
     Input("btn-gpkg-atom", "n_clicks"),
     State("store-gdf-atom", "data"),
     prevent_initial_call=True
 )
-def descargar_gpkg_atom(n, gdf_json):
-    if not gdf_json:
-        return no_update
+def descargar_gpkg_atom(n, id_resultado):
+    if not id_resultado:
+        return no_update, no_update
     
-    gdf = gpd.read_file(gdf_json)
+    gdf = obtener_resultado(id_resultado)
+    if gdf is None:
+        return no_update, dmc.Alert(MENSAJE_CADUCADO, color="yellow")
     contenido, nombre = exportar_geopackage(gdf, "parcelas_atom.gpkg")
     
-    return dict(content=base64.b64encode(contenido).decode(), filename=nombre, base64=True)
+    return dict(content=base64.b64encode(contenido).decode(), filename=nombre, base64=True), no_update
 
 
 @callback(
     Output("download-shp-atom", "data"),
+    Output("status-atom", "children", allow_duplicate=True),
     Input("btn-shp-atom", "n_clicks"),
     State("store-gdf-atom", "data"),
     prevent_initial_call=True
 )
-def descargar_shp_atom(n, gdf_json):
-    if not gdf_json:
-        return no_update
+def descargar_shp_atom(n, id_resultado):
+    if not id_resultado:
+        return no_update, no_update
     
-    gdf = gpd.read_file(gdf_json)
+    gdf = obtener_resultado(id_resultado)
+    if gdf is None:
+        return no_update, dmc.Alert(MENSAJE_CADUCADO, color="yellow")
     contenido, nombre = exportar_shapefile(gdf, "parcelas_atom")
     
-    return dict(content=base64.b64encode(contenido).decode(), filename=nombre, base64=True)
\ No newline at end of file
+    return dict(content=base64.b64encode(contenido).decode(), filename=nombre, base64=True), no_update
\ No newline at end of file
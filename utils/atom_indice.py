@@ -0,0 +1,254 @@
+"""
+Índice de ficheros del servicio ATOM de FEGA
+
+Lee los feeds ATOM de una campaña (feed de servicio -> feeds de datos por
+provincia -> ficheros por municipio) y construye un índice compacto
+provincia -> municipio -> formato -> {url, tamano, actualizado}. El índice
+se guarda en disco y se revalida con peticiones condicionales
+(ETag / Last-Modified), de modo que normalmente cuesta una petición 304.
+"""
+import json
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+from utils.cache_disco import DIR_CACHE, CacheDisco
+from utils.http_client import ErrorServicio, peticion
+
+# Feed de servicio de recintos de cada campaña
+URL_FEED_ATOM = os.environ.get("SIGPAC_URL_FEED_ATOM", "https://www.fega.gob.es/atom/{campana}/rec_{campana}.xml")
+
+# Tiempo durante el que el índice se usa sin revalidar
+TTL_INDICE = float(os.environ.get("SIGPAC_TTL_INDICE_ATOM", 3600))
+
+# Tras un fallo al leer los feeds no se vuelve a intentar durante este tiempo
+TTL_FALLO_INDICE = float(os.environ.get("SIGPAC_TTL_FALLO_INDICE_ATOM", 300))
+
+NS = {"atom": "http://www.w3.org/2005/Atom"}
+
+# 14051_rec_2024_20250215_gpkg.zip
+PATRON_ARCHIVO = re.compile(r"(\d{2})(\d{3})_rec_(\d{4})_(\d{8})_(\w+)\.zip$", re.IGNORECASE)
+
+_indices: Dict[str, dict] = {}
+_revalidaciones: Dict[str, threading.Lock] = {}
+_lock = threading.Lock()
+_cache_fallos = None
+
+
+def _ruta_indice(campana: str) -> str:
+    return os.path.join(DIR_CACHE, f"atom_indice_{campana}.json")
+
+
+def obtener_cache_fallos() -> CacheDisco:
+    """Campañas cuyo feed falló hace menos de TTL_FALLO_INDICE (compartida por todos los procesos)"""
+    global _cache_fallos
+    with _lock:
+        if _cache_fallos is None:
+            _cache_fallos = CacheDisco("atom_indice_fallos", ttl=TTL_FALLO_INDICE)
+    return _cache_fallos
+
+
+def _leer_feed(url: str, validadores: Optional[dict]) -> Tuple[Optional[bytes], dict]:
+    """
+    Descarga un feed con petición condicional
+
+    Devuelve (contenido, validadores); contenido es None si no ha cambiado
+    (304). Lanza ErrorServicio si no se pudo leer.
+    """
+    cabeceras = {}
+    if validadores:
+        if validadores.get("etag"):
+            cabeceras["If-None-Match"] = validadores["etag"]
+        if validadores.get("last_modified"):
+            cabeceras["If-Modified-Since"] = validadores["last_modified"]
+
+    respuesta = peticion("GET", url, headers=cabeceras, timeout=(10, 60))
+    if not respuesta.ok:
+        raise ErrorServicio(respuesta.estado, f"No se pudo leer el feed ATOM {url}: {respuesta.detalle}")
+
+    if respuesta.response.status_code == 304:
+        return None, validadores
+
+    nuevos = {
+        "etag": respuesta.response.headers.get("ETag"),
+        "last_modified": respuesta.response.headers.get("Last-Modified"),
+    }
+    return respuesta.response.content, nuevos
+
+
+def _analizar_feed(contenido: bytes, url_feed: str) -> Tuple[List[dict], List[str]]:
+    """
+    Separa las entradas de un feed en ficheros ZIP y enlaces a otros feeds
+
+    Solo son feeds los enlaces alternate/related de tipo Atom; los
+    describedby de INSPIRE apuntan a los metadatos ISO (.xml) y se ignoran.
+    """
+    raiz = ET.fromstring(contenido)
+    archivos = []
+    subfeeds = []
+
+    for entrada in raiz.iterfind("atom:entry", NS):
+        actualizado = entrada.findtext("atom:updated", default="", namespaces=NS)
+        for enlace in entrada.iterfind("atom:link", NS):
+            href = enlace.get("href")
+            if not href:
+                continue
+            href = urljoin(url_feed, href)
+            tipo = enlace.get("type", "")
+
+            if "atom+xml" in tipo:
+                if enlace.get("rel", "alternate") in ("alternate", "related") and href != url_feed:
+                    subfeeds.append(href)
+                continue
+
+            coincidencia = PATRON_ARCHIVO.search(href)
+            if coincidencia:
+                prov, mun, _campana, fecha, formato = coincidencia.groups()
+                archivos.append({
+                    "provincia": prov,
+                    "municipio": mun,
+                    "formato": formato.lower(),
+                    "url": href,
+                    "tamano": int(enlace.get("length")) if (enlace.get("length") or "").isdigit() else None,
+                    "actualizado": actualizado,
+                    "fecha": fecha,
+                })
+
+    return archivos, subfeeds
+
+
+def _construir_indice(campana: str, anterior: Optional[dict]) -> dict:
+    """
+    Lee el feed de servicio y los de cada provincia, reutilizando los que no han cambiado
+
+    Solo lanza ErrorServicio o ParseError si falla el feed de servicio; un
+    feed de provincia que falla conserva sus entradas de `anterior`.
+    """
+    url_servicio = URL_FEED_ATOM.format(campana=campana)
+    feeds_anteriores = (anterior or {}).get("feeds", {})
+
+    # Las provincias pueden publicar ficheros nuevos sin que cambie el feed
+    # de servicio, así que sus feeds se revalidan siempre (normalmente 304)
+    previo_servicio = feeds_anteriores.get(url_servicio, {})
+    contenido, validadores = _leer_feed(url_servicio, previo_servicio.get("validadores"))
+    if contenido is None:
+        feeds = {url_servicio: previo_servicio}
+    else:
+        archivos, subfeeds = _analizar_feed(contenido, url_servicio)
+        feeds = {url_servicio: {"validadores": validadores, "archivos": archivos, "subfeeds": subfeeds}}
+
+    def leer_subfeed(url):
+        """Feed de una provincia; si falla se conserva lo que se tenía (o nada)"""
+        previo = feeds_anteriores.get(url)
+        try:
+            contenido_sub, validadores_sub = _leer_feed(url, (previo or {}).get("validadores"))
+            if contenido_sub is None:
+                return url, previo
+            archivos_sub, _ = _analizar_feed(contenido_sub, url)
+        except (ErrorServicio, ET.ParseError):
+            return url, previo
+        return url, {"validadores": validadores_sub, "archivos": archivos_sub}
+
+    # Un feed de provincia caído no invalida el índice de las demás
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for url, feed in pool.map(leer_subfeed, dict.fromkeys(feeds[url_servicio]["subfeeds"])):
+            if feed is not None:
+                feeds[url] = feed
+
+    # provincia -> municipio -> formato -> fichero (el más reciente si hay varios)
+    indice: Dict[str, Dict[str, Dict[str, dict]]] = {}
+    for feed in feeds.values():
+        for archivo in feed["archivos"]:
+            por_formato = indice.setdefault(archivo["provincia"], {}).setdefault(archivo["municipio"], {})
+            previo = por_formato.get(archivo["formato"])
+            if previo is None or archivo["fecha"] > previo["fecha"]:
+                por_formato[archivo["formato"]] = {k: archivo[k] for k in ("url", "tamano", "actualizado", "fecha")}
+
+    return {"campana": campana, "revisado": time.time(), "feeds": feeds, "indice": indice}
+
+
+def _guardar(campana: str, datos: dict):
+    """Escritura atómica del índice (otro worker puede estar leyéndolo)"""
+    ruta = _ruta_indice(campana)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(datos, f, separators=(",", ":"))
+    os.replace(temporal, ruta)
+
+
+def _leer_guardado(campana: str) -> Optional[dict]:
+    try:
+        with open(_ruta_indice(campana), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _vigente(datos: Optional[dict]) -> bool:
+    return datos is not None and time.time() - datos.get("revisado", 0) < TTL_INDICE
+
+
+def obtener_indice(campana: str, forzar: bool = False) -> Optional[dict]:
+    """
+    Índice provincia -> municipio -> formato -> {url, tamano, actualizado, fecha}
+
+    Usa la copia en memoria o en disco mientras tenga menos de TTL_INDICE
+    segundos; después la revalida contra FEGA. Si el feed no está
+    disponible se devuelve la última copia conocida (o None) y no se
+    vuelve a intentar hasta pasados TTL_FALLO_INDICE segundos.
+
+    La revalidación se hace fuera del bloqueo del módulo: un solo hilo por
+    campaña va a FEGA y, si ya hay una copia, los demás la usan mientras.
+    """
+    with _lock:
+        datos = _indices.get(campana)
+        revalidacion = _revalidaciones.setdefault(campana, threading.Lock())
+    if datos is None:
+        datos = _leer_guardado(campana)
+
+    if not forzar and _vigente(datos):
+        with _lock:
+            _indices.setdefault(campana, datos)
+        return datos["indice"]
+
+    anterior = datos["indice"] if datos is not None else None
+    if not forzar and obtener_cache_fallos().obtener(campana) is not None:
+        return anterior
+
+    # Sin copia (o forzando) se espera a la revalidación en curso; con copia, se usa esa
+    if not revalidacion.acquire(blocking=datos is None or forzar):
+        return anterior
+    try:
+        with _lock:
+            actual = _indices.get(campana)
+        if not forzar and actual is not datos and _vigente(actual):
+            return actual["indice"]
+
+        try:
+            nuevos = _construir_indice(campana, datos)
+            _guardar(campana, nuevos)
+        except (ErrorServicio, ET.ParseError):
+            obtener_cache_fallos().guardar(campana, b"")
+            if datos is None:
+                return None
+            nuevos = datos
+
+        with _lock:
+            _indices[campana] = nuevos
+        return nuevos["indice"]
+    finally:
+        revalidacion.release()
+
+
+def buscar_archivo(provincia: str, municipio: str, campana: str, formato: str = "gpkg") -> Optional[dict]:
+    """Fichero ATOM de un municipio ({url, tamano, actualizado, fecha}) o None si no está en el índice"""
+    indice = obtener_indice(campana)
+    if not indice:
+        return None
+    return indice.get(str(provincia).zfill(2), {}).get(str(municipio).zfill(3), {}).get(formato.lower())
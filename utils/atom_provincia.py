@@ -0,0 +1,190 @@
+"""
+Descarga ATOM de una provincia completa
+
+Los ZIP de los municipios se descargan en paralelo (hilos) y se convierten
+en procesos aparte al GeoParquet de la caché de datasets. Los municipios
+que ya están en la caché no se vuelven a descargar, así que una descarga
+interrumpida se reanuda donde se quedó.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Union
+
+import geopandas as gpd
+import pandas as pd
+
+from utils.atom_indice import buscar_archivo, obtener_indice
+from utils.cache_datasets import CacheDatasets, leer_parquet, obtener_cache_datasets
+from utils.http_client import ERROR_REMOTO, NO_ENCONTRADO, OK, ErrorServicio
+from utils.municipios_data import MUNICIPIOS
+from utils.sigpac_atom import descargar_zip_municipio, filtros_parquet, procesar_zip
+
+# Descargas simultáneas de FEGA y procesos para leer los ZIP
+MAX_DESCARGAS = int(os.environ.get("SIGPAC_ATOM_MAX_DESCARGAS", 4))
+MAX_PROCESOS = int(os.environ.get("SIGPAC_ATOM_MAX_PROCESOS", min(4, os.cpu_count() or 1)))
+
+
+@dataclass
+class ProgresoProvincia:
+    """Avance de una descarga de provincia"""
+    hechos: int
+    total: int
+    fallos: int
+    recintos: int = 0
+    terminado: bool = False
+    gdf: Optional[gpd.GeoDataFrame] = None
+    estados: Dict[str, str] = field(default_factory=dict)
+
+
+def municipios_provincia(provincia: Union[int, str], campana: str, formato: str = "gpkg") -> List[str]:
+    """Códigos de municipio de la provincia: los publicados en el feed o, sin índice, los conocidos"""
+    cod_prov = str(provincia).zfill(2)
+    indice = obtener_indice(campana) or {}
+    publicados = [mun for mun, formatos in indice.get(cod_prov, {}).items() if formato in formatos]
+    if publicados:
+        return sorted(publicados)
+    return sorted(m["value"] for m in MUNICIPIOS.get(cod_prov, []))
+
+
+def _convertir_zip(ruta_zip: str, formato: str, destino: Optional[tuple], filtros: tuple) -> Union[str, gpd.GeoDataFrame, None]:
+    """
+    Lee el ZIP de un municipio en un proceso aparte
+
+    Con `destino` (directorio, max_bytes, campana, provincia, municipio,
+    version) lo guarda completo en la caché de datasets y devuelve la ruta;
+    sin caché devuelve el GeoDataFrame ya filtrado.
+    """
+    if destino is None:
+        return procesar_zip(ruta_zip, formato, *filtros)
+
+    gdf = procesar_zip(ruta_zip, formato)
+    if gdf is None:
+        return None
+    directorio, max_bytes, campana, cod_prov, cod_mun, version = destino
+    return CacheDatasets(directorio, max_bytes).guardar(gdf, campana, cod_prov, cod_mun, formato, version)
+
+
+def _municipio(
+    cod_prov: str,
+    cod_mun: str,
+    campana: str,
+    formato: str,
+    filtros: tuple,
+    columnas: Optional[List[str]],
+    procesos: ProcessPoolExecutor
+) -> Optional[gpd.GeoDataFrame]:
+    """Recintos filtrados de un municipio, desde la caché o descargándolo"""
+    cache = obtener_cache_datasets()
+    archivo = buscar_archivo(cod_prov, cod_mun, campana, formato)
+    version = archivo["fecha"] if archivo is not None else None
+    filtros_arrow = filtros_parquet(*filtros)
+
+    gdf = cache.leer(campana, cod_prov, cod_mun, formato, version, columnas, filtros_arrow)
+    if gdf is not None:
+        return gdf
+
+    def descargar_y_convertir(destino_cache: bool):
+        descarga = descargar_zip_municipio(archivo, cod_prov, cod_mun, campana, formato)
+        if descarga is None:
+            return None
+        ruta_zip, version_zip = descarga
+        destino = (cache.directorio, cache.max_bytes, campana, cod_prov, cod_mun, version_zip) if destino_cache else None
+        try:
+            return procesos.submit(_convertir_zip, ruta_zip, formato, destino, filtros).result()
+        finally:
+            os.remove(ruta_zip)
+
+    if not cache.max_bytes:
+        return descargar_y_convertir(False)
+
+    with cache.bloqueo(campana, cod_prov, cod_mun, formato):
+        gdf = cache.leer(campana, cod_prov, cod_mun, formato, version, columnas, filtros_arrow)
+        if gdf is None:
+            ruta = descargar_y_convertir(True)
+            gdf = leer_parquet(ruta, columnas, filtros_arrow) if ruta else None
+    return gdf
+
+
+def iterar_descarga_provincia(
+    provincia: Union[int, str],
+    superficie_max_ha: Optional[float] = None,
+    pendiente_min_mil: Optional[int] = None,
+    uso_sigpac: Optional[Union[str, List[str]]] = None,
+    campana: str = "2024",
+    formato: str = "gpkg",
+    columnas: Optional[List[str]] = None,
+    max_descargas: int = MAX_DESCARGAS,
+    max_procesos: int = MAX_PROCESOS,
+    intervalo: float = 0.5
+) -> Iterator[ProgresoProvincia]:
+    """
+    Descarga todos los municipios de una provincia emitiendo el progreso
+
+    Aplica los mismos filtros que descargar_sigpac. Emite un
+    ProgresoProvincia como mucho cada `intervalo` segundos; el último tiene
+    terminado=True, el GeoDataFrame de toda la provincia (`gdf`, en orden
+    de municipio) y el resultado de cada municipio (`estados`: ok,
+    no_encontrado, error_remoto o timeout).
+    """
+    cod_prov = str(provincia).zfill(2)
+    formato = formato.lower()
+    filtros = (superficie_max_ha, pendiente_min_mil, uso_sigpac)
+    municipios = municipios_provincia(cod_prov, campana, formato)
+
+    total = len(municipios)
+    partes = {}
+    estados = {}
+    fallos = 0
+    recintos = 0
+    ultimo_aviso = float("-inf")
+
+    # spawn: los workers de gunicorn y los callbacks en segundo plano tienen hilos
+    procesos = ProcessPoolExecutor(max_workers=max(1, max_procesos), mp_context=multiprocessing.get_context("spawn"))
+    hilos = ThreadPoolExecutor(max_workers=max(1, max_descargas))
+    try:
+        futuros = {
+            hilos.submit(_municipio, cod_prov, cod_mun, campana, formato, filtros, columnas, procesos): cod_mun
+            for cod_mun in municipios
+        }
+        for futuro in as_completed(futuros):
+            cod_mun = futuros[futuro]
+            try:
+                gdf = futuro.result()
+            except ErrorServicio as e:
+                estados[cod_mun] = e.estado
+            except Exception:
+                estados[cod_mun] = ERROR_REMOTO
+            else:
+                estados[cod_mun] = OK if gdf is not None else NO_ENCONTRADO
+                if gdf is not None and len(gdf) > 0:
+                    partes[cod_mun] = gdf
+                    recintos += len(gdf)
+
+            if estados[cod_mun] != OK:
+                fallos += 1
+
+            if len(estados) < total and time.monotonic() - ultimo_aviso >= intervalo:
+                yield ProgresoProvincia(len(estados), total, fallos, recintos)
+                ultimo_aviso = time.monotonic()
+    finally:
+        # Si se abandona la descarga no se empiezan los municipios pendientes
+        hilos.shutdown(wait=False, cancel_futures=True)
+        procesos.shutdown(wait=False, cancel_futures=True)
+
+    gdf = None
+    if partes:
+        gdf = pd.concat([partes[m] for m in municipios if m in partes], ignore_index=True)
+        if 'dn_surface' in gdf.columns:
+            gdf['superficie_ha'] = gdf['dn_surface'] / 10000
+
+    yield ProgresoProvincia(total, total, fallos, recintos, terminado=True, gdf=gdf, estados=estados)
+
+
+def descargar_provincia(provincia: Union[int, str], **kwargs) -> Optional[gpd.GeoDataFrame]:
+    """Descarga todos los municipios de una provincia (mismos argumentos que iterar_descarga_provincia)"""
+    for progreso in iterar_descarga_provincia(provincia, **kwargs):
+        if progreso.terminado:
+            return progreso.gdf
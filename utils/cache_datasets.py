@@ -0,0 +1,368 @@
+"""
+Caché local de municipios del ATOM en GeoParquet, compartida entre procesos
+
+Cada municipio se guarda completo (sin filtros) en una partición
+campana=AAAA/provincia=PP/municipio=MMM; el nombre del fichero lleva el
+formato y la fecha de publicación de FEGA, que hace de versión.
+"""
+import contextlib
+import glob
+import os
+import threading
+from typing import List, Optional, Tuple
+
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+from utils.cache_disco import DIR_CACHE
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo bloqueo entre hilos
+    fcntl = None
+
+DIR_DATASETS = os.environ.get("SIGPAC_DATASETS_DIR", os.path.join(DIR_CACHE, "datasets"))
+
+# Tamaño máximo total (0 desactiva la caché)
+MAX_BYTES_DATASETS = int(os.environ.get("SIGPAC_DATASETS_MAX_BYTES", 5 * 1024 ** 3))
+
+# Filas por grupo del Parquet: el índice espacial lee solo los grupos que necesita
+FILAS_POR_GRUPO = 8192
+
+
+class CacheDatasets:
+    """
+    Ficheros GeoParquet por campaña, provincia y municipio.
+
+    Las escrituras son atómicas (temporal + os.replace) y cada municipio
+    tiene un fichero de bloqueo para que solo un worker lo descargue y
+    escriba; los demás esperan y leen su copia. Si se supera max_bytes se
+    borran los ficheros usados hace más tiempo, con su bloqueo y sus
+    ficheros auxiliares. El tamaño total se lleva en el estado compartido
+    para no recorrer el directorio en cada escritura.
+    """
+
+    def __init__(self, directorio: Optional[str] = None, max_bytes: int = MAX_BYTES_DATASETS):
+        self.directorio = directorio or DIR_DATASETS
+        self.max_bytes = max_bytes
+
+    def _contar(self, atributo: str, n: int = 1):
+        """Suma al contador compartido por todos los procesos (workers y callbacks en segundo plano)"""
+        from utils.estado_compartido import obtener_estado_compartido
+        if n:
+            obtener_estado_compartido().sumar("datasets", **{atributo: n})
+
+    def _total(self) -> float:
+        """Tamaño total de la caché; se calcula recorriendo el directorio solo la primera vez"""
+        from utils.estado_compartido import obtener_estado_compartido
+        estado = obtener_estado_compartido()
+        total = estado.contadores(f"datasets:{self.directorio}").get("bytes")
+        if total is None:
+            total = sum(tamano for _, tamano, _ in self._ficheros())
+            estado.iniciar(f"datasets:{self.directorio}", bytes=total)
+        return total
+
+    def _sumar_bytes(self, n: int):
+        from utils.estado_compartido import obtener_estado_compartido
+        if n:
+            obtener_estado_compartido().sumar(f"datasets:{self.directorio}", bytes=n)
+
+    def _particion(self, campana: str, provincia: str, municipio: str) -> str:
+        return os.path.join(self.directorio, f"campana={campana}", f"provincia={provincia}", f"municipio={municipio}")
+
+    def _buscar(self, particion: str, formato: str) -> Optional[Tuple[str, str]]:
+        """Fichero más reciente de la partición y su versión"""
+        ficheros = sorted(glob.glob(os.path.join(particion, f"recintos_{formato}_*.parquet")))
+        if not ficheros:
+            return None
+        ruta = ficheros[-1]
+        version = os.path.basename(ruta)[len(f"recintos_{formato}_"):-len(".parquet")]
+        return ruta, version
+
+    def ruta_valida(self, campana: str, provincia: str, municipio: str, formato: str = "gpkg", version: Optional[str] = None) -> Optional[str]:
+        """Ruta de la copia del municipio si existe (y es de `version`, si se indica)"""
+        if not self.max_bytes:
+            return None
+        encontrado = self._buscar(self._particion(campana, provincia, municipio), formato)
+        if encontrado is None or (version is not None and encontrado[1] != version):
+            return None
+        return encontrado[0]
+
+    def bloqueo(self, campana: str, provincia: str, municipio: str, formato: str = "gpkg"):
+        """Bloqueo exclusivo de un municipio entre hilos y procesos"""
+        particion = self._particion(campana, provincia, municipio)
+        os.makedirs(particion, exist_ok=True)
+        return bloqueo_fichero(os.path.join(particion, f".{formato}.lock"))
+
+    def leer(
+        self,
+        campana: str,
+        provincia: str,
+        municipio: str,
+        formato: str = "gpkg",
+        version: Optional[str] = None,
+        columnas: Optional[List[str]] = None,
+        filtros: Optional[List[tuple]] = None
+    ) -> Optional[gpd.GeoDataFrame]:
+        """
+        Lee un municipio de la caché
+
+        Si se indica `version` (fecha de publicación de FEGA) solo vale una
+        copia de esa versión. `filtros` son tuplas (columna, operador,
+        valor) de pyarrow que se aplican al leer; las de columnas que no
+        existen se ignoran. Devuelve None si no hay copia válida.
+        """
+        ruta = self.ruta_valida(campana, provincia, municipio, formato, version)
+        if ruta is None:
+            self._contar("fallos")
+            return None
+
+        try:
+            gdf = leer_parquet(ruta, columnas, filtros)
+            os.utime(ruta)  # para la expulsión por último uso
+        except OSError:
+            # Expulsado o reemplazado por otro worker mientras se leía
+            self._contar("fallos")
+            return None
+
+        self._contar("aciertos")
+        return gdf
+
+    def guardar(self, gdf: gpd.GeoDataFrame, campana: str, provincia: str, municipio: str, formato: str, version: str) -> Optional[str]:
+        """Guarda un municipio completo, sustituye las versiones anteriores y devuelve la ruta"""
+        if not self.max_bytes:
+            return None
+
+        particion = self._particion(campana, provincia, municipio)
+        os.makedirs(particion, exist_ok=True)
+        ruta = os.path.join(particion, f"recintos_{formato}_{version}.parquet")
+        temporal = os.path.join(particion, f".recintos_{formato}_{version}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+        self._total()  # inicializa el total antes de empezar a sumarle
+        try:
+            gdf.to_parquet(temporal, index=False, row_group_size=FILAS_POR_GRUPO)
+            diferencia = os.path.getsize(temporal) - _tamano(ruta)
+            os.replace(temporal, ruta)
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+        self._contar("escrituras")
+
+        for anterior in glob.glob(os.path.join(particion, f"recintos_{formato}_*.parquet")):
+            if anterior != ruta:
+                diferencia -= _borrar(anterior)
+        self._sumar_bytes(diferencia)
+
+        self._expulsar(conservar=ruta)
+        return ruta
+
+    def _ficheros(self) -> List[Tuple[str, int, float]]:
+        """(ruta, tamaño, último uso) de todos los ficheros de la caché"""
+        ficheros = []
+        for ruta in glob.glob(os.path.join(self.directorio, "campana=*", "provincia=*", "municipio=*", "*.parquet")):
+            try:
+                estado = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            ficheros.append((ruta, estado.st_size, estado.st_mtime))
+        return ficheros
+
+    def _expulsar(self, conservar: Optional[str] = None):
+        """
+        Borra ficheros por orden de último uso hasta quedar bajo max_bytes
+
+        Solo se recorre el directorio cuando el total pasa de max_bytes, y
+        entonces se corrige el total con lo que hay en disco. Se saltan los
+        municipios cuyo bloqueo tiene otro worker (descargándolos).
+        """
+        if self._total() <= self.max_bytes:
+            return
+
+        ficheros = self._ficheros()
+        total = sum(tamano for _, tamano, _ in ficheros)
+        expulsados = 0
+        for ruta, tamano, _ in sorted(ficheros, key=lambda f: f[2]):
+            if total <= self.max_bytes:
+                break
+            if ruta == conservar:
+                continue
+            formato = os.path.basename(ruta).split("_")[1]
+            with bloqueo_para_borrar(os.path.join(os.path.dirname(ruta), f".{formato}.lock")) as libre:
+                if not libre:
+                    continue
+                if _borrar(ruta):
+                    expulsados += 1
+                total -= tamano
+                # Índices espaciales del fichero (.indice.npz y su bloqueo)
+                for auxiliar in glob.glob(glob.escape(ruta) + ".*"):
+                    if auxiliar.endswith(".lock"):
+                        with bloqueo_para_borrar(auxiliar):
+                            pass
+                    else:
+                        _borrar(auxiliar)
+            _borrar_directorios_vacios(os.path.dirname(ruta), self.directorio)
+
+        # Lo que sumen otros procesos entre el recorrido y aquí se pierde
+        # hasta el siguiente recorrido; solo retrasa un poco la expulsión
+        from utils.estado_compartido import obtener_estado_compartido
+        obtener_estado_compartido().fijar(f"datasets:{self.directorio}", bytes=total)
+        self._contar("expulsiones", expulsados)
+
+    def estadisticas(self) -> dict:
+        """Contadores de todos los procesos y ocupación de la caché"""
+        from utils.estado_compartido import obtener_estado_compartido
+        contadores = obtener_estado_compartido().contadores("datasets")
+        aciertos = int(contadores.get('aciertos', 0))
+        fallos = int(contadores.get('fallos', 0))
+        ficheros = self._ficheros()
+        consultas = aciertos + fallos
+        return {
+            'aciertos': aciertos,
+            'fallos': fallos,
+            'tasa_aciertos': aciertos / consultas if consultas else 0.0,
+            'escrituras': int(contadores.get('escrituras', 0)),
+            'expulsiones': int(contadores.get('expulsiones', 0)),
+            'ficheros': len(ficheros),
+            'bytes': sum(tamano for _, tamano, _ in ficheros),
+        }
+
+
+_locks_hilos = {}
+_lock_locks = threading.Lock()
+
+
+@contextlib.contextmanager
+def bloqueo_fichero(ruta: str):
+    """
+    Bloqueo exclusivo entre hilos y procesos con un fichero de bloqueo (flock)
+
+    La expulsión puede borrar el fichero mientras otro espera: tras obtener
+    el bloqueo se comprueba que sigue siendo el de la ruta y si no se abre
+    de nuevo.
+    """
+    with _lock_locks:
+        lock_hilo = _locks_hilos.setdefault(ruta, threading.Lock())
+
+    with lock_hilo:
+        if fcntl is None:
+            yield
+            return
+        f = _abrir_bloqueado(ruta, esperar=True)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+
+@contextlib.contextmanager
+def bloqueo_para_borrar(ruta: str):
+    """
+    Obtiene el bloqueo sin esperar y borra su fichero al terminar
+
+    Devuelve False (y no borra nada) si otro hilo o proceso lo tiene.
+    """
+    with _lock_locks:
+        lock_hilo = _locks_hilos.setdefault(ruta, threading.Lock())
+
+    if not lock_hilo.acquire(blocking=False):
+        yield False
+        return
+    try:
+        if fcntl is None:
+            yield True
+            _borrar(ruta)
+            return
+        if not os.path.exists(ruta):
+            yield True
+            return
+        f = _abrir_bloqueado(ruta, esperar=False)
+        if f is None:
+            yield False
+            return
+        try:
+            yield True
+            # Se borra antes de soltarlo: quien esperaba en este fichero lo volverá a abrir
+            _borrar(ruta)
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+    finally:
+        lock_hilo.release()
+
+
+def _abrir_bloqueado(ruta: str, esperar: bool):
+    """Abre y bloquea el fichero de la ruta; None si esperar=False y está bloqueado"""
+    while True:
+        try:
+            f = open(ruta, "a")
+        except FileNotFoundError:
+            # Partición borrada por la expulsión
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            continue
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        try:
+            if os.stat(ruta).st_ino == os.fstat(f.fileno()).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+
+def _tamano(ruta: str) -> int:
+    try:
+        return os.path.getsize(ruta)
+    except FileNotFoundError:
+        return 0
+
+
+def _borrar(ruta: str) -> int:
+    """Borra el fichero y devuelve su tamaño (0 si ya no estaba)"""
+    tamano = _tamano(ruta)
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        return 0
+    return tamano
+
+
+def _borrar_directorios_vacios(directorio: str, raiz: str):
+    """Borra el directorio y sus padres vacíos hasta la raíz de la caché"""
+    raiz = os.path.abspath(raiz)
+    directorio = os.path.abspath(directorio)
+    while directorio != raiz and directorio.startswith(raiz + os.sep):
+        try:
+            os.rmdir(directorio)
+        except OSError:
+            return
+        directorio = os.path.dirname(directorio)
+
+
+def leer_parquet(ruta: str, columnas: Optional[List[str]] = None, filtros: Optional[List[tuple]] = None) -> gpd.GeoDataFrame:
+    """Lee un GeoParquet leyendo solo las columnas pedidas y las filas que cumplen los filtros"""
+    campos = pq.read_schema(ruta).names
+    filtros = [f for f in (filtros or []) if f[0] in campos] or None
+
+    if columnas is not None:
+        # dn_surface hace falta para calcular superficie_ha
+        columnas = [c for c in campos if c in columnas or c in ('dn_surface', 'geometry')]
+
+    return gpd.read_parquet(ruta, columns=columnas, filters=filtros)
+
+
+_cache = None
+_lock_cache = threading.Lock()
+
+
+def obtener_cache_datasets() -> CacheDatasets:
+    """Caché de datasets del proceso"""
+    global _cache
+    with _lock_cache:
+        if _cache is None:
+            _cache = CacheDatasets()
+    return _cache
@@ -0,0 +1,177 @@
+"""
+Caché persistente en disco (SQLite) compartida entre procesos
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Optional
+
+# Directorio raíz de las cachés locales
+DIR_CACHE = os.environ.get("SIGPAC_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sigpac-dash-app"))
+
+
+class CacheDisco:
+    """
+    Caché clave/valor en un fichero SQLite con TTL, límite de tamaño (LRU)
+    e invalidación por campaña.
+
+    SQLite en modo WAL permite que varios workers de gunicorn lean y
+    escriban el mismo fichero a la vez; cada hilo usa su propia conexión.
+    """
+
+    def __init__(self, nombre: str, ttl: Optional[float] = None, max_bytes: Optional[int] = None, directorio: Optional[str] = None):
+        self.nombre = nombre
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.ruta = os.path.join(directorio or DIR_CACHE, f"{nombre}.sqlite")
+        self._local = threading.local()
+
+    def _conexion(self) -> sqlite3.Connection:
+        """Conexión SQLite del hilo actual (se reabre tras un fork)"""
+        con = getattr(self._local, "con", None)
+        if con is not None and self._local.pid == os.getpid():
+            return con
+
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        con = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS entradas ("
+            " clave TEXT PRIMARY KEY, campana TEXT, valor BLOB,"
+            " tamano INTEGER, creado REAL, accedido REAL)"
+        )
+        con.execute("CREATE INDEX IF NOT EXISTS idx_accedido ON entradas (accedido)")
+        # El INSERT OR REPLACE solo dispara el trigger de borrado con recursive_triggers
+        con.execute("PRAGMA recursive_triggers=ON")
+        self._crear_total(con)
+        self._local.con = con
+        self._local.pid = os.getpid()
+        return con
+
+    def _crear_total(self, con: sqlite3.Connection):
+        """
+        Tabla con el tamaño total de las entradas, mantenida por triggers
+
+        Así comprobar max_bytes en cada escritura no recorre la tabla. Se
+        inicializa una sola vez con la suma de lo que ya haya guardado.
+        """
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            con.execute("CREATE TABLE IF NOT EXISTS total (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER)")
+            if con.execute("SELECT 1 FROM total").fetchone() is None:
+                con.execute("INSERT INTO total (id, bytes) SELECT 0, COALESCE(SUM(tamano), 0) FROM entradas")
+            con.execute(
+                "CREATE TRIGGER IF NOT EXISTS total_insertar AFTER INSERT ON entradas"
+                " BEGIN UPDATE total SET bytes = bytes + NEW.tamano; END"
+            )
+            con.execute(
+                "CREATE TRIGGER IF NOT EXISTS total_borrar AFTER DELETE ON entradas"
+                " BEGIN UPDATE total SET bytes = bytes - OLD.tamano; END"
+            )
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+
+    def _contar(self, atributo: str, n: int = 1):
+        """Suma al contador compartido por todos los procesos (workers y callbacks en segundo plano)"""
+        from utils.estado_compartido import obtener_estado_compartido
+        if n:
+            obtener_estado_compartido().sumar(f"cache:{self.nombre}", **{atributo: n})
+
+    def obtener(self, clave: str, campana: Optional[str] = None, contar_fallos: bool = True) -> Optional[bytes]:
+        """
+        Devuelve el valor guardado o None si no existe, caducó o es de otra campaña
+
+        Con contar_fallos=False (consultas de tanteo) las ausencias no suman fallos.
+        """
+        con = self._conexion()
+        fila = con.execute("SELECT valor, campana, creado FROM entradas WHERE clave = ?", (clave,)).fetchone()
+
+        if fila is None:
+            if contar_fallos:
+                self._contar("fallos")
+            return None
+
+        valor, campana_guardada, creado = fila
+        caducado = self.ttl is not None and time.time() - creado > self.ttl
+        if caducado or (campana is not None and campana_guardada != campana):
+            con.execute("DELETE FROM entradas WHERE clave = ?", (clave,))
+            if contar_fallos:
+                self._contar("fallos")
+            return None
+
+        con.execute("UPDATE entradas SET accedido = ? WHERE clave = ?", (time.time(), clave))
+        self._contar("aciertos")
+        return valor
+
+    def guardar(self, clave: str, valor: bytes, campana: Optional[str] = None):
+        """Guarda un valor y expulsa las entradas menos usadas si se supera max_bytes"""
+        con = self._conexion()
+        ahora = time.time()
+        con.execute(
+            "INSERT OR REPLACE INTO entradas (clave, campana, valor, tamano, creado, accedido) VALUES (?, ?, ?, ?, ?, ?)",
+            (clave, campana, valor, len(valor), ahora, ahora)
+        )
+        self._contar("escrituras")
+
+        if self.max_bytes is not None:
+            self._expulsar(con)
+
+    def _expulsar(self, con: sqlite3.Connection):
+        """Elimina entradas por orden de último acceso hasta quedar bajo max_bytes"""
+        if con.execute("SELECT bytes FROM total").fetchone()[0] <= self.max_bytes:
+            return
+
+        expulsadas = 0
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            # Otro proceso puede haber expulsado entre la comprobación y el bloqueo
+            total = con.execute("SELECT bytes FROM total").fetchone()[0]
+            while total > self.max_bytes:
+                filas = con.execute("SELECT clave, tamano FROM entradas ORDER BY accedido LIMIT 100").fetchall()
+                if not filas:
+                    break
+                for clave, tamano in filas:
+                    if total <= self.max_bytes:
+                        break
+                    con.execute("DELETE FROM entradas WHERE clave = ?", (clave,))
+                    total -= tamano
+                    expulsadas += 1
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        self._contar("expulsiones", expulsadas)
+
+    def invalidar_campana(self, campana: str) -> int:
+        """Elimina las entradas de campañas distintas a la indicada"""
+        cursor = self._conexion().execute("DELETE FROM entradas WHERE campana IS NOT ?", (campana,))
+        return cursor.rowcount
+
+    def limpiar(self):
+        """Vacía la caché"""
+        self._conexion().execute("DELETE FROM entradas")
+
+    def estadisticas(self) -> dict:
+        """Contadores de todos los procesos y ocupación de la caché"""
+        from utils.estado_compartido import obtener_estado_compartido
+        contadores = obtener_estado_compartido().contadores(f"cache:{self.nombre}")
+        aciertos = int(contadores.get('aciertos', 0))
+        fallos = int(contadores.get('fallos', 0))
+        con = self._conexion()
+        num = con.execute("SELECT COUNT(*) FROM entradas").fetchone()[0]
+        total = con.execute("SELECT bytes FROM total").fetchone()[0]
+        consultas = aciertos + fallos
+        return {
+            'aciertos': aciertos,
+            'fallos': fallos,
+            'tasa_aciertos': aciertos / consultas if consultas else 0.0,
+            'escrituras': int(contadores.get('escrituras', 0)),
+            'expulsiones': int(contadores.get('expulsiones', 0)),
+            'entradas': num,
+            'bytes': total,
+        }
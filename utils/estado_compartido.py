@@ -0,0 +1,110 @@
+"""
+Contadores y estado compartidos entre procesos
+
+Los callbacks en segundo plano (DiskcacheManager) corren cada descarga en
+un proceso hijo que termina con ella. Lo que esos procesos cuentan
+(aciertos de las cachés, esperas del limitador) y el estado de los
+circuitos de cada host se guardan en el mismo SQLite que el limitador,
+para que /metricas vea el total de todos los procesos y un circuito
+abierto siga abierto en la descarga siguiente.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from utils.cache_disco import DIR_CACHE
+
+RUTA_ESTADO = os.path.join(DIR_CACHE, "limitador.sqlite")
+
+
+class EstadoCompartido:
+    """Contadores por grupo y tabla de circuitos en un fichero SQLite (una conexión por hilo)"""
+
+    def __init__(self, ruta: Optional[str] = None):
+        self.ruta = ruta or RUTA_ESTADO
+        self._local = threading.local()
+
+    def conexion(self) -> sqlite3.Connection:
+        """Conexión SQLite del hilo actual (se reabre tras un fork)"""
+        con = getattr(self._local, "con", None)
+        if con is not None and self._local.pid == os.getpid():
+            return con
+
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        con = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("CREATE TABLE IF NOT EXISTS contadores (grupo TEXT, clave TEXT, valor REAL, PRIMARY KEY (grupo, clave))")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS interruptores ("
+            " host TEXT PRIMARY KEY, fallos INTEGER, abierto_desde REAL, prueba_desde REAL)"
+        )
+        self._local.con = con
+        self._local.pid = os.getpid()
+        return con
+
+    @contextmanager
+    def transaccion(self):
+        """Transacción de escritura (BEGIN IMMEDIATE) sobre la conexión del hilo"""
+        con = self.conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            yield con
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    def sumar(self, grupo: str, **valores: float):
+        """Suma los valores a los contadores del grupo"""
+        with self.transaccion() as con:
+            con.executemany(
+                "INSERT INTO contadores (grupo, clave, valor) VALUES (?, ?, ?)"
+                " ON CONFLICT (grupo, clave) DO UPDATE SET valor = valor + excluded.valor",
+                [(grupo, clave, valor) for clave, valor in valores.items()]
+            )
+
+    def maximo(self, grupo: str, **valores: float):
+        """Guarda el mayor entre el valor actual y el indicado"""
+        with self.transaccion() as con:
+            con.executemany(
+                "INSERT INTO contadores (grupo, clave, valor) VALUES (?, ?, ?)"
+                " ON CONFLICT (grupo, clave) DO UPDATE SET valor = MAX(valor, excluded.valor)",
+                [(grupo, clave, valor) for clave, valor in valores.items()]
+            )
+
+    def fijar(self, grupo: str, **valores: float):
+        """Sustituye el valor de los contadores del grupo"""
+        with self.transaccion() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO contadores (grupo, clave, valor) VALUES (?, ?, ?)",
+                [(grupo, clave, valor) for clave, valor in valores.items()]
+            )
+
+    def iniciar(self, grupo: str, **valores: float):
+        """Crea los contadores que aún no existen con el valor indicado"""
+        with self.transaccion() as con:
+            con.executemany(
+                "INSERT OR IGNORE INTO contadores (grupo, clave, valor) VALUES (?, ?, ?)",
+                [(grupo, clave, valor) for clave, valor in valores.items()]
+            )
+
+    def contadores(self, grupo: str) -> Dict[str, float]:
+        """Contadores del grupo sumados en todos los procesos"""
+        filas = self.conexion().execute("SELECT clave, valor FROM contadores WHERE grupo = ?", (grupo,)).fetchall()
+        return dict(filas)
+
+
+_estado = None
+_lock_estado = threading.Lock()
+
+
+def obtener_estado_compartido() -> EstadoCompartido:
+    """Estado compartido del directorio de cachés"""
+    global _estado
+    with _lock_estado:
+        if _estado is None:
+            _estado = EstadoCompartido()
+    return _estado
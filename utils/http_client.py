@@ -0,0 +1,263 @@
+"""
+Cliente HTTP compartido para los servicios SIGPAC/FEGA
+
+Todas las llamadas salientes pasan por `peticion`, que respeta el límite
+de tasa compartido de cada host, reintenta los errores transitorios con
+espera exponencial aleatoria y corta las llamadas a un host mientras su
+circuito está abierto.
+"""
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.estado_compartido import obtener_estado_compartido
+from utils.limitador import obtener_limitador
+
+# Conexiones keep-alive por host (sigpac-hubcloud.es, fega.gob.es)
+TAMANO_POOL = int(os.environ.get("SIGPAC_TAMANO_POOL", 32))
+
+# Reintentos de errores transitorios
+REINTENTOS = int(os.environ.get("SIGPAC_REINTENTOS", 3))
+ESPERA_BASE = 0.5
+ESPERA_MAX = 8.0
+CODIGOS_TRANSITORIOS = {429, 500, 502, 503, 504}
+
+# Circuito por host: se abre tras UMBRAL_FALLOS fallos seguidos durante TIEMPO_APERTURA segundos
+UMBRAL_FALLOS = int(os.environ.get("SIGPAC_UMBRAL_FALLOS", 5))
+TIEMPO_APERTURA = float(os.environ.get("SIGPAC_TIEMPO_APERTURA", 30))
+
+# Resultado de cada petición
+OK = "ok"
+NO_ENCONTRADO = "no_encontrado"
+ERROR_REMOTO = "error_remoto"
+TIMEOUT = "timeout"
+
+# Tipo de paso que da el circuito a una petición
+PASO_NORMAL = "normal"
+PASO_PRUEBA = "prueba"
+
+_sesion = None
+_pid_sesion = None
+_lock = threading.Lock()
+
+
+@dataclass
+class Respuesta:
+    """Resultado de una petición: estado, respuesta HTTP (si la hay) y detalle del error"""
+    estado: str
+    response: Optional[requests.Response] = None
+    detalle: str = ""
+    intentos: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.estado == OK
+
+
+class ErrorServicio(Exception):
+    """El servicio remoto no respondió correctamente (error remoto o timeout)"""
+
+    def __init__(self, estado: str, detalle: str = ""):
+        self.estado = estado
+        self.detalle = detalle
+        super().__init__(detalle or estado)
+
+
+class Interruptor:
+    """
+    Circuit breaker de un host: cerrado, abierto o semiabierto (una petición de prueba)
+
+    El estado vive en el SQLite compartido (utils.estado_compartido), así
+    que lo comparten los workers y los procesos de los callbacks en segundo
+    plano. Una prueba que no llega a terminar (su proceso murió) caduca
+    tras tiempo_apertura.
+    """
+
+    def __init__(self, host: str, umbral_fallos: int = UMBRAL_FALLOS, tiempo_apertura: float = TIEMPO_APERTURA):
+        self.host = host
+        self.umbral_fallos = umbral_fallos
+        self.tiempo_apertura = tiempo_apertura
+
+    def _fila(self, con) -> tuple:
+        """(fallos, abierto_desde, prueba_desde) del host"""
+        fila = con.execute("SELECT fallos, abierto_desde, prueba_desde FROM interruptores WHERE host = ?", (self.host,)).fetchone()
+        return fila or (0, None, None)
+
+    def permitir(self) -> Optional[str]:
+        """Indica si se puede llamar al host ahora mismo: None, PASO_NORMAL o PASO_PRUEBA"""
+        estado = obtener_estado_compartido()
+        if self._fila(estado.conexion())[1] is None:
+            return PASO_NORMAL
+
+        with estado.transaccion() as con:
+            _fallos, abierto_desde, prueba_desde = self._fila(con)
+            ahora = time.time()
+            if abierto_desde is None:
+                return PASO_NORMAL
+            if ahora - abierto_desde < self.tiempo_apertura:
+                return None
+            if prueba_desde is not None and ahora - prueba_desde < self.tiempo_apertura:
+                return None
+            # Semiabierto: deja pasar una sola petición de prueba
+            con.execute("UPDATE interruptores SET prueba_desde = ? WHERE host = ?", (ahora, self.host))
+            return PASO_PRUEBA
+
+    def abierto(self) -> bool:
+        """El circuito está abierto o semiabierto (sin reservar la petición de prueba)"""
+        return self._fila(obtener_estado_compartido().conexion())[1] is not None
+
+    def registrar_exito(self):
+        obtener_estado_compartido().conexion().execute(
+            "INSERT INTO interruptores (host, fallos, abierto_desde, prueba_desde) VALUES (?, 0, NULL, NULL)"
+            " ON CONFLICT (host) DO UPDATE SET fallos = 0, abierto_desde = NULL, prueba_desde = NULL"
+            " WHERE fallos > 0 OR abierto_desde IS NOT NULL OR prueba_desde IS NOT NULL",
+            (self.host,)
+        )
+
+    def registrar_fallo(self):
+        with obtener_estado_compartido().transaccion() as con:
+            fallos, abierto_desde, prueba_desde = self._fila(con)
+            fallos += 1
+            if prueba_desde is not None or fallos >= self.umbral_fallos:
+                abierto_desde = time.time()
+            con.execute(
+                "INSERT OR REPLACE INTO interruptores (host, fallos, abierto_desde, prueba_desde) VALUES (?, ?, ?, NULL)",
+                (self.host, fallos, abierto_desde)
+            )
+
+    def liberar_prueba(self):
+        """La petición de prueba terminó sin resultado (p. ej. una excepción): otra puede intentarlo"""
+        obtener_estado_compartido().conexion().execute("UPDATE interruptores SET prueba_desde = NULL WHERE host = ?", (self.host,))
+
+    @property
+    def fallos(self) -> int:
+        return self._fila(obtener_estado_compartido().conexion())[0]
+
+    @property
+    def estado(self) -> str:
+        return _estado_circuito(self._fila(obtener_estado_compartido().conexion())[1], self.tiempo_apertura)
+
+
+def _estado_circuito(abierto_desde: Optional[float], tiempo_apertura: float) -> str:
+    if abierto_desde is None:
+        return "cerrado"
+    if time.time() - abierto_desde < tiempo_apertura:
+        return "abierto"
+    return "semiabierto"
+
+
+_interruptores: Dict[str, Interruptor] = {}
+
+
+def obtener_interruptor(host: str) -> Interruptor:
+    """Interruptor del host (el estado es común a todos los procesos)"""
+    with _lock:
+        if host not in _interruptores:
+            _interruptores[host] = Interruptor(host)
+        return _interruptores[host]
+
+
+def obtener_sesion() -> requests.Session:
+    """Devuelve la sesión HTTP del proceso, con pool de conexiones reutilizables"""
+    global _sesion, _pid_sesion
+
+    # Cada worker de gunicorn necesita su propia sesión (no se comparten sockets tras fork)
+    if _sesion is not None and _pid_sesion == os.getpid():
+        return _sesion
+
+    with _lock:
+        if _sesion is None or _pid_sesion != os.getpid():
+            sesion = requests.Session()
+            adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=TAMANO_POOL)
+            sesion.mount("https://", adaptador)
+            sesion.mount("http://", adaptador)
+            _sesion = sesion
+            _pid_sesion = os.getpid()
+
+    return _sesion
+
+
+def _espera(intento: int, response: Optional[requests.Response] = None) -> float:
+    """Espera antes del siguiente intento: Retry-After o exponencial con jitter completo"""
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        return min(float(response.headers["Retry-After"]), ESPERA_MAX)
+    return random.uniform(0, min(ESPERA_MAX, ESPERA_BASE * 2 ** intento))
+
+
+def peticion(metodo: str, url: str, reintentos: int = REINTENTOS, **kwargs) -> Respuesta:
+    """
+    Hace una petición HTTP con reintentos, circuit breaker y límite de tasa por host
+
+    Los argumentos extra (params, timeout, stream, headers...) se pasan a
+    requests. Nunca lanza excepciones de red: el resultado se indica en
+    Respuesta.estado (ok, no_encontrado, error_remoto o timeout).
+    """
+    host = urlparse(url).netloc
+    interruptor = obtener_interruptor(host)
+    paso = interruptor.permitir()
+    if paso is None:
+        return Respuesta(ERROR_REMOTO, detalle=f"Servicio no disponible ({host}), se reintentará más tarde")
+
+    # Cada petición cuenta como un solo fallo para el circuito, tras agotar
+    # sus reintentos; la de prueba no se reintenta y vuelve a abrirlo
+    prueba = paso == PASO_PRUEBA
+    ultimo = Respuesta(ERROR_REMOTO)
+    resuelta = False
+    try:
+        for intento in range(reintentos + 1):
+            if intento > 0 and interruptor.abierto():
+                # Otras peticiones abrieron el circuito mientras esperábamos
+                return ultimo
+
+            # Presupuesto compartido con el resto de workers (cada reintento también consume)
+            obtener_limitador().adquirir(host)
+
+            response = None
+            try:
+                response = obtener_sesion().request(metodo, url, **kwargs)
+            except requests.Timeout as e:
+                ultimo = Respuesta(TIMEOUT, detalle=f"Tiempo de espera agotado: {e}", intentos=intento + 1)
+            except requests.RequestException as e:
+                ultimo = Respuesta(ERROR_REMOTO, detalle=f"Error de conexión: {e}", intentos=intento + 1)
+            else:
+                if response.status_code < 400:
+                    interruptor.registrar_exito()
+                    resuelta = True
+                    return Respuesta(OK, response, intentos=intento + 1)
+                if response.status_code == 404:
+                    interruptor.registrar_exito()
+                    resuelta = True
+                    return Respuesta(NO_ENCONTRADO, response, detalle="No encontrado", intentos=intento + 1)
+
+                ultimo = Respuesta(ERROR_REMOTO, response, detalle=f"HTTP {response.status_code}", intentos=intento + 1)
+                if response.status_code not in CODIGOS_TRANSITORIOS:
+                    # Error del cliente: el host responde, no tiene sentido reintentar
+                    interruptor.registrar_exito()
+                    resuelta = True
+                    return ultimo
+
+            if prueba or intento == reintentos:
+                break
+            if response is not None:
+                response.close()
+            time.sleep(_espera(intento, response))
+
+        interruptor.registrar_fallo()
+        resuelta = True
+        return ultimo
+    finally:
+        if prueba and not resuelta:
+            interruptor.liberar_prueba()
+
+
+def estadisticas() -> dict:
+    """Estado de los circuitos de cada host, compartido por todos los procesos"""
+    filas = obtener_estado_compartido().conexion().execute("SELECT host, fallos, abierto_desde FROM interruptores").fetchall()
+    return {host: {"estado": _estado_circuito(abierto_desde, TIEMPO_APERTURA), "fallos": fallos} for host, fallos, abierto_desde in filas}
@@ -0,0 +1,176 @@
+"""
+Importación de códigos SIGPAC desde ficheros CSV/XLSX por lotes
+"""
+import base64
+import csv
+import os
+import tempfile
+from typing import Dict, Iterator, List, Optional
+
+# Filas por lote que se pasan a la descarga
+TAMANO_LOTE = 2000
+
+# Tamaño máximo del fichero subido (20 MB, ~1 millón de códigos). dcc.Upload
+# manda el fichero entero en base64 dentro de la petición del callback
+MAX_BYTES_SUBIDA = int(os.environ.get("SIGPAC_MAX_BYTES_SUBIDA", 20 * 1024 * 1024))
+
+# Nombres de columna reconocidos automáticamente (en minúsculas)
+COLUMNAS_CODIGO = ["codigo_sigpac", "codigo", "código", "cod_sigpac", "sigpac"]
+COLUMNAS_PARTES = {
+    "pr": ["provincia", "pr", "prov"],
+    "mu": ["municipio", "mu", "mun"],
+    "po": ["poligono", "polígono", "po", "pol"],
+    "pa": ["parcela", "pa", "par"],
+    "re": ["recinto", "re", "rec"],
+}
+
+
+def guardar_subida(contenido: str, nombre: str) -> str:
+    """
+    Decodifica el contenido base64 de un dcc.Upload a un fichero temporal
+
+    Se decodifica por trozos para no tener a la vez el texto base64 y el
+    fichero completo en memoria. Devuelve la ruta del fichero (hay que
+    borrarlo al terminar).
+    """
+    _, _, datos = contenido.partition(",")
+    extension = os.path.splitext(nombre)[1].lower()
+
+    descriptor, ruta = tempfile.mkstemp(suffix=extension)
+    trozo = 4 * 256 * 1024
+    with os.fdopen(descriptor, "wb") as f:
+        for inicio in range(0, len(datos), trozo):
+            f.write(base64.b64decode(datos[inicio:inicio + trozo]))
+    return ruta
+
+
+def _resolver_columnas(cabecera: List[str], columnas: Optional[str]) -> List[int]:
+    """
+    Índices de las columnas con el código: una (PR:MU:PO:PA:RE) o cinco (PR, MU, PO, PA, RE)
+
+    `columnas` es el mapeo indicado por el usuario: un nombre de columna o
+    cinco separados por comas. Si no se indica se detecta por el nombre.
+    """
+    nombres = [str(c).strip().lower() for c in cabecera]
+
+    if columnas:
+        pedidas = [c.strip().lower() for c in columnas.split(",") if c.strip()]
+        if len(pedidas) not in (1, 5):
+            raise ValueError("Indica una columna con el código completo o cinco columnas PR,MU,PO,PA,RE")
+        faltan = [c for c in pedidas if c not in nombres]
+        if faltan:
+            raise ValueError(f"Columnas no encontradas en el fichero: {', '.join(faltan)}")
+        return [nombres.index(c) for c in pedidas]
+
+    for candidata in COLUMNAS_CODIGO:
+        if candidata in nombres:
+            return [nombres.index(candidata)]
+
+    indices = []
+    for alternativas in COLUMNAS_PARTES.values():
+        encontrada = next((a for a in alternativas if a in nombres), None)
+        if encontrada is None:
+            break
+        indices.append(nombres.index(encontrada))
+    if len(indices) == 5:
+        return indices
+
+    # Sin cabecera reconocible: código completo en la primera columna o
+    # repartido en las cinco primeras
+    if ":" not in nombres[0] and len(nombres) >= 5:
+        return list(range(5))
+    return [0]
+
+
+def _filas_csv(ruta: str) -> Iterator[List[str]]:
+    """Filas de un CSV (separador detectado con las primeras líneas)"""
+    with open(ruta, newline="", encoding="utf-8-sig", errors="replace") as f:
+        muestra = f.read(64 * 1024)
+        f.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=",;\t|")
+        except csv.Error:
+            dialecto = csv.excel
+        yield from csv.reader(f, dialecto)
+
+
+def _filas_xlsx(ruta: str) -> Iterator[list]:
+    """Filas de la primera hoja de un XLSX en modo solo lectura (sin cargar el libro)"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Para importar ficheros XLSX hay que instalar openpyxl")
+
+    libro = load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        yield from libro.worksheets[0].iter_rows(values_only=True)
+    finally:
+        libro.close()
+
+
+def _a_texto(valor) -> str:
+    """Celda a texto (los números de Excel llegan como float: 14.0 -> "14")"""
+    if valor is None:
+        return ""
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor).strip()
+
+
+def leer_codigos_por_lotes(ruta: str, columnas: Optional[str] = None, tamano_lote: int = TAMANO_LOTE) -> Iterator[Dict[int, str]]:
+    """
+    Lee un CSV/XLSX de códigos por lotes de `tamano_lote` filas
+
+    Cada lote es un dict {id_entrada: "PR:MU:PO:PA:RE"} como el que
+    espera la descarga por códigos; id_entrada es el número de fila de
+    datos (empezando en 1). La memoria usada no depende del tamaño del
+    fichero.
+    """
+    if ruta.lower().endswith((".xlsx", ".xlsm")):
+        filas = _filas_xlsx(ruta)
+    else:
+        filas = _filas_csv(ruta)
+
+    cabecera = next(filas, None)
+    if cabecera is None:
+        return
+
+    indices = _resolver_columnas(cabecera, columnas)
+
+    # Si la primera fila ya es un código (fichero sin cabecera) se incluye como dato
+    id_entrada = 1
+    lote = {}
+    primera = [_a_texto(cabecera[i]) if i < len(cabecera) else "" for i in indices]
+    if any(c[:1].isdigit() for c in primera):
+        lote[id_entrada] = ":".join(primera)
+        id_entrada += 1
+
+    for fila in filas:
+        partes = [_a_texto(fila[i]) if i < len(fila) else "" for i in indices]
+        if any(partes):
+            lote[id_entrada] = ":".join(partes)
+        id_entrada += 1
+        if len(lote) >= tamano_lote:
+            yield lote
+            lote = {}
+
+    if lote:
+        yield lote
+
+
+def contar_filas(ruta: str) -> Optional[int]:
+    """Número aproximado de filas de datos, para mostrar el progreso"""
+    if ruta.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            return None
+        libro = load_workbook(ruta, read_only=True)
+        try:
+            filas = libro.worksheets[0].max_row
+        finally:
+            libro.close()
+        return max(0, filas - 1) if filas else None
+
+    with open(ruta, "rb") as f:
+        return max(0, sum(bloque.count(b"\n") for bloque in iter(lambda: f.read(1024 * 1024), b"")) - 1)
@@ -0,0 +1,351 @@
+"""
+Índice espacial local de los municipios de la caché de datasets
+
+Cada GeoParquet de la caché lleva al lado un índice persistido
+(`recintos_..._VERSION.parquet.indice.npz`) con el rectángulo de cada
+recinto y la cobertura del municipio (la unión de sus recintos). Con él
+las consultas por rectángulo o polígono se resuelven con un STRtree y se
+leen solo los grupos de filas del Parquet que contienen candidatos; la API
+OGC solo se consulta para la parte del área que no cubre ningún municipio
+descargado.
+"""
+import contextlib
+import functools
+import glob
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import shapely
+from pyproj import CRS, Transformer
+from shapely import STRtree
+from shapely.geometry.base import BaseGeometry
+
+from utils.cache_datasets import CacheDatasets, bloqueo_fichero, obtener_cache_datasets
+from utils.indice_municipios import obtener_indice_municipios
+from utils.sigpac_api import CLAVE_RECINTO
+from utils.teselas_ogc import descargar_por_teselas
+
+SUFIJO_INDICE = ".indice.npz"
+
+# CRS de las consultas y de lo que devuelve el índice (lon/lat)
+CRS_CONSULTA = CRS.from_epsg(4326)
+
+# Fracción del área consultada que puede quedar sin cubrir sin ir a la API
+# (huecos entre recintos y redondeos de la cobertura)
+TOLERANCIA_COBERTURA = 1e-4
+
+
+@dataclass
+class IndiceMunicipio:
+    """STRtree de los recintos de un fichero de la caché y su cobertura"""
+    ruta: str
+    arbol: STRtree
+    cobertura: BaseGeometry
+    inicio_grupos: np.ndarray
+    columna: str
+    crs: CRS
+
+
+def _ruta_indice(ruta: str) -> str:
+    return ruta + SUFIJO_INDICE
+
+
+def _crear_indice(ruta: str) -> Tuple[np.ndarray, BaseGeometry]:
+    """Rectángulos de los recintos (n x 4) y cobertura del municipio a partir del Parquet"""
+    geometrias = shapely.from_wkb(pq.read_table(ruta, columns=['geometry']).column('geometry').to_numpy(zero_copy_only=False))
+    limites = shapely.bounds(geometrias)
+    validas = geometrias[~shapely.is_empty(geometrias)]
+    try:
+        # Los recintos teselan el municipio: la unión de coberturas es mucho más rápida
+        cobertura = shapely.coverage_union_all(validas)
+    except shapely.errors.GEOSException:
+        cobertura = shapely.union_all(shapely.make_valid(validas))
+    return limites, cobertura
+
+
+def _cargar_indice(ruta: str) -> Tuple[np.ndarray, BaseGeometry]:
+    """Lee el índice persistido del fichero o lo crea y lo guarda (una vez entre procesos)"""
+    ruta_indice = _ruta_indice(ruta)
+    with contextlib.suppress(OSError, ValueError, KeyError):
+        with np.load(ruta_indice) as datos:
+            return datos['limites'], shapely.from_wkb(datos['cobertura'].tobytes())
+
+    with bloqueo_fichero(ruta_indice + ".lock"):
+        with contextlib.suppress(OSError, ValueError, KeyError):
+            with np.load(ruta_indice) as datos:
+                return datos['limites'], shapely.from_wkb(datos['cobertura'].tobytes())
+
+        limites, cobertura = _crear_indice(ruta)
+        temporal = f"{ruta_indice}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporal, "wb") as f:
+                np.savez(f, limites=limites, cobertura=np.frombuffer(shapely.to_wkb(cobertura), dtype=np.uint8))
+            os.replace(temporal, ruta_indice)
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+    return limites, cobertura
+
+
+def _leer_filas(indice: IndiceMunicipio, filas: np.ndarray) -> gpd.GeoDataFrame:
+    """Lee del Parquet solo los grupos de filas que contienen `filas` (índices ordenados)"""
+    inicio_grupos = indice.inicio_grupos
+    grupos = np.unique(np.searchsorted(inicio_grupos, filas, side='right') - 1)
+    tabla = pq.ParquetFile(indice.ruta).read_row_groups(grupos.tolist())
+
+    # Posición de cada fila dentro de la tabla formada por los grupos leídos
+    tamanos = np.diff(inicio_grupos)[grupos]
+    desplazamiento = np.repeat(inicio_grupos[grupos] - np.concatenate([[0], np.cumsum(tamanos)[:-1]]), tamanos)
+    leidas = np.arange(len(desplazamiento)) + desplazamiento
+    df = tabla.take(np.flatnonzero(np.isin(leidas, filas))).to_pandas()
+    return gpd.GeoDataFrame(df.drop(columns=indice.columna), geometry=shapely.from_wkb(df[indice.columna]), crs=indice.crs)
+
+
+@functools.lru_cache(maxsize=32)
+def _transformadores(crs: CRS) -> Optional[Tuple[Transformer, Transformer]]:
+    """Transformaciones lon/lat -> crs y vuelta; None si las coordenadas no cambian (CRS84, ETRS89)"""
+    ida = Transformer.from_crs(CRS_CONSULTA, crs, always_xy=True)
+    if ida.name == "noop":
+        return None
+    return ida, Transformer.from_crs(crs, CRS_CONSULTA, always_xy=True)
+
+
+def _transformar(geometria: BaseGeometry, transformador: Transformer) -> BaseGeometry:
+    return shapely.transform(geometria, lambda xy: np.column_stack(transformador.transform(xy[:, 0], xy[:, 1])))
+
+
+def _encaminar(ficheros: List[str], bbox: Tuple[float, float, float, float]) -> List[str]:
+    """
+    Ficheros de los municipios que el índice de extensiones da como candidatos
+
+    Los municipios que el índice aún no conoce se revisan siempre; así no
+    hace falta cargar la cobertura de toda la caché para cada consulta.
+    """
+    extensiones = obtener_indice_municipios()
+    if not len(extensiones):
+        return ficheros
+
+    candidatos = set(extensiones.candidatos(bbox))
+    seleccion = []
+    for ruta in ficheros:
+        particion = dict(p.split("=", 1) for p in ruta.split(os.sep)[-3:-1])
+        municipio = (particion['provincia'], particion['municipio'])
+        if municipio in candidatos or municipio not in extensiones:
+            seleccion.append(ruta)
+    return seleccion
+
+
+class IndiceEspacial:
+    """
+    Consultas espaciales sobre los municipios de la caché de datasets
+
+    Los índices de cada fichero se cargan una vez por proceso y se
+    descartan cuando el fichero desaparece (expulsado o sustituido por una
+    versión más nueva).
+    """
+
+    def __init__(self, cache: Optional[CacheDatasets] = None):
+        self.cache = cache or obtener_cache_datasets()
+        self._lock = threading.Lock()
+        self._indices: Dict[str, IndiceMunicipio] = {}
+
+    def _ficheros(self, campana: Optional[str], formato: str) -> List[str]:
+        """Ficheros de la campaña (por defecto la más reciente de la caché), uno por municipio"""
+        if campana is None:
+            campanas = sorted(glob.glob(os.path.join(self.cache.directorio, "campana=*")))
+            if not campanas:
+                return []
+            campana = os.path.basename(campanas[-1]).split("=", 1)[1]
+
+        ficheros = {}
+        patron = os.path.join(self.cache.directorio, f"campana={campana}", "provincia=*", "municipio=*", f"recintos_{formato}_*.parquet")
+        for ruta in sorted(glob.glob(patron)):
+            ficheros[os.path.dirname(ruta)] = ruta  # la versión más reciente del municipio
+        return list(ficheros.values())
+
+    def _indice(self, ruta: str) -> Optional[IndiceMunicipio]:
+        with self._lock:
+            indice = self._indices.get(ruta)
+        if indice is not None:
+            return indice
+
+        try:
+            limites, cobertura = _cargar_indice(ruta)
+            metadatos = pq.read_metadata(ruta)
+        except OSError:
+            return None  # expulsado mientras se cargaba
+        filas_grupos = [metadatos.row_group(i).num_rows for i in range(metadatos.num_row_groups)]
+        geo = json.loads(metadatos.metadata[b'geo'])
+        columna = geo['primary_column']
+        indice = IndiceMunicipio(
+            ruta=ruta,
+            arbol=STRtree(shapely.box(*limites.T)),
+            cobertura=cobertura,
+            inicio_grupos=np.concatenate([[0], np.cumsum(filas_grupos)]),
+            columna=columna,
+            crs=CRS.from_user_input(geo['columns'][columna].get('crs', "OGC:CRS84")),
+        )
+        shapely.prepare(indice.cobertura)
+        with self._lock:
+            self._indices[ruta] = indice
+        return indice
+
+    def _limpiar(self, vigentes: List[str]):
+        """Olvida los índices de ficheros que ya no están y borra sus .npz"""
+        vigentes = set(vigentes)
+        with self._lock:
+            for ruta in [r for r in self._indices if r not in vigentes]:
+                del self._indices[ruta]
+        for ruta_indice in glob.glob(os.path.join(self.cache.directorio, "campana=*", "provincia=*", "municipio=*", "*" + SUFIJO_INDICE)):
+            if not os.path.exists(ruta_indice[:-len(SUFIJO_INDICE)]):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(ruta_indice)
+
+    def consultar(
+        self,
+        area: Union[List[float], BaseGeometry],
+        campana: Optional[str] = None,
+        formato: str = "gpkg"
+    ) -> Tuple[Optional[gpd.GeoDataFrame], BaseGeometry]:
+        """
+        Recintos de la caché que intersecan un rectángulo [min_lon, min_lat, max_lon, max_lat] o un polígono
+
+        El área está en lon/lat; cada fichero se consulta en su propio CRS
+        (los del ATOM vienen en UTM) y lo encontrado se devuelve en lon/lat.
+
+        Retorna:
+        --------
+        (gdf, sin_cubrir)
+            gdf: recintos encontrados en EPSG:4326 (None si no hay ninguno)
+            sin_cubrir: parte del área que no cubre ningún municipio de la caché
+        """
+        consulta = shapely.box(*area) if not isinstance(area, BaseGeometry) else area
+        # Densificada para que los lados sigan siendo fieles al cambiar de CRS
+        minx, miny, maxx, maxy = consulta.bounds
+        densa = shapely.segmentize(consulta, max(maxx - minx, maxy - miny, 1e-9) / 64)
+        ficheros = self._ficheros(campana, formato)
+        self._limpiar(ficheros)
+
+        partes = []
+        coberturas = []
+        for ruta in _encaminar(ficheros, consulta.bounds):
+            indice = self._indice(ruta)
+            if indice is None:
+                continue
+            transformadores = _transformadores(indice.crs)
+            local = _transformar(densa, transformadores[0]) if transformadores else consulta
+            if not indice.cobertura.intersects(local):
+                continue
+            if transformadores:
+                coberturas.append(_transformar(indice.cobertura.intersection(local), transformadores[1]))
+            else:
+                coberturas.append(indice.cobertura)
+
+            filas = np.sort(indice.arbol.query(local))
+            if len(filas) == 0:
+                continue
+            try:
+                gdf = _leer_filas(indice, filas)
+            except OSError:
+                coberturas.pop()  # expulsado entre el índice y la lectura
+                continue
+            gdf = gdf[gdf.intersects(local)]
+            if len(gdf) > 0:
+                partes.append(gdf.to_crs(CRS_CONSULTA) if transformadores else gdf.set_crs(CRS_CONSULTA, allow_override=True))
+
+        sin_cubrir = consulta
+        for cobertura in coberturas:
+            sin_cubrir = sin_cubrir.difference(cobertura)
+            if sin_cubrir.is_empty:
+                break
+
+        gdf = pd.concat(partes, ignore_index=True) if partes else None
+        return gdf, sin_cubrir
+
+
+_indice_espacial = None
+_lock_indice = threading.Lock()
+
+
+def obtener_indice_espacial() -> IndiceEspacial:
+    """Índice espacial del proceso"""
+    global _indice_espacial
+    with _lock_indice:
+        if _indice_espacial is None:
+            _indice_espacial = IndiceEspacial()
+    return _indice_espacial
+
+
+def _como_api(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Recintos de la caché con el esquema de la API OGC (superficie en ha, EPSG:4326)"""
+    if 'dn_surface' in gdf.columns:
+        gdf['superficie'] = gdf['dn_surface'] / 10000
+        gdf = gdf.drop(columns='dn_surface')
+    return gdf.to_crs("EPSG:4326")
+
+
+def _claves(gdf: gpd.GeoDataFrame) -> pd.DataFrame:
+    """Claves provincia...recinto como enteros nullable (las vacías quedan como <NA>)"""
+    return gdf[CLAVE_RECINTO].apply(pd.to_numeric, errors='coerce').astype('Int64')
+
+
+def _quitar_locales(remoto: gpd.GeoDataFrame, local: Optional[gpd.GeoDataFrame]) -> gpd.GeoDataFrame:
+    """
+    Recintos remotos que no están ya entre los locales (misma clave provincia...recinto)
+
+    Si a alguno le faltan columnas de la clave o no son enteras no se
+    descarta ninguno; los recintos remotos con la clave incompleta se
+    conservan.
+    """
+    if local is None or not all(c in gdf.columns for gdf in (local, remoto) for c in CLAVE_RECINTO):
+        return remoto
+    try:
+        claves_locales = pd.MultiIndex.from_frame(_claves(local).dropna())
+        claves_remotas = pd.MultiIndex.from_frame(_claves(remoto))
+    except (TypeError, ValueError):
+        return remoto
+    return remoto[~claves_remotas.isin(claves_locales)]
+
+
+def descargar_area(bbox: List[float], campana: Optional[str] = None) -> Tuple[Optional[gpd.GeoDataFrame], dict]:
+    """
+    Recintos de un rectángulo: de la caché local y de la API OGC solo lo que falta
+
+    Los recintos que llegan de la API y ya están en la caché (misma clave
+    provincia...recinto) se descartan. Lanza ErrorServicio si hay que ir a
+    la API y falla.
+
+    Retorna:
+    --------
+    (gdf, estado)
+        gdf: GeoDataFrame en EPSG:4326 o None
+        estado: {'locales', 'remotos' (recintos de cada origen),
+        'recortado' (la API tenía más recintos de los descargados)}
+    """
+    local, sin_cubrir = obtener_indice_espacial().consultar(bbox, campana)
+    consulta = shapely.box(*bbox)
+    if local is not None:
+        local = _como_api(local)
+    estado = {'locales': len(local) if local is not None else 0, 'remotos': 0, 'recortado': False}
+
+    remoto = None
+    if not sin_cubrir.is_empty and sin_cubrir.area > TOLERANCIA_COBERTURA * consulta.area:
+        remoto, estado_api = descargar_por_teselas(list(sin_cubrir.bounds))
+        estado['recortado'] = estado_api['recortado']
+        if remoto is not None:
+            remoto = _quitar_locales(remoto[remoto.intersects(sin_cubrir)], local)
+            estado['remotos'] = len(remoto)
+
+    partes = [gdf for gdf in (local, remoto) if gdf is not None and len(gdf) > 0]
+    if not partes:
+        return None, estado
+    if len(partes) == 1:
+        return partes[0], estado
+    return gpd.GeoDataFrame(pd.concat(partes, ignore_index=True), crs="EPSG:4326"), estado
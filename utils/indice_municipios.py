@@ -0,0 +1,205 @@
+"""
+Índice de extensiones de municipio: qué municipios toca un rectángulo
+
+Guarda en un .npz el código (PPMMM) y el rectángulo envolvente de cada
+municipio, obtenidos de los ficheros ATOM de la caché de datasets (los
+metadatos GeoParquet ya traen el bbox) o de un fichero de límites
+municipales. Con ~8.000 municipios ocupa menos de 300 KB y una consulta
+recorre dos arrays de numpy.
+
+Uso:
+    python -m utils.indice_municipios
+    python -m utils.indice_municipios --limites municipios.gpkg --campo-codigo codigo_ine
+"""
+import argparse
+import functools
+import glob
+import json
+import os
+import sys
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pyarrow.parquet as pq
+from pyproj import CRS, Transformer
+
+from utils.cache_datasets import CacheDatasets, obtener_cache_datasets
+from utils.cache_disco import DIR_CACHE
+
+RUTA_INDICE_MUNICIPIOS = os.environ.get("SIGPAC_INDICE_MUNICIPIOS", os.path.join(DIR_CACHE, "indice_municipios.npz"))
+
+
+class IndiceMunicipios:
+    """Códigos PPMMM (int32) y rectángulos [min_lon, min_lat, max_lon, max_lat] (float64) de los municipios"""
+
+    def __init__(self, codigos: Optional[np.ndarray] = None, limites: Optional[np.ndarray] = None):
+        self.codigos = np.asarray(codigos if codigos is not None else [], dtype=np.int32)
+        self.limites = np.asarray(limites if limites is not None else np.empty((0, 4)), dtype=np.float64).reshape(-1, 4)
+
+    def __len__(self) -> int:
+        return len(self.codigos)
+
+    def __contains__(self, municipio: Tuple[str, str]) -> bool:
+        provincia, mun = municipio
+        return bool(np.any(self.codigos == int(provincia) * 1000 + int(mun)))
+
+    def candidatos(self, bbox: List[float]) -> List[Tuple[str, str]]:
+        """Municipios (provincia, municipio) cuyo rectángulo corta a `bbox`"""
+        min_lon, min_lat, max_lon, max_lat = bbox
+        limites = self.limites
+        corta = (limites[:, 0] <= max_lon) & (limites[:, 2] >= min_lon) & (limites[:, 1] <= max_lat) & (limites[:, 3] >= min_lat)
+        return [(f"{c // 1000:02d}", f"{c % 1000:03d}") for c in self.codigos[corta].tolist()]
+
+    def combinar(self, otro: "IndiceMunicipios") -> "IndiceMunicipios":
+        """Índice con los municipios de ambos; los de `otro` sustituyen a los repetidos"""
+        propios = ~np.isin(self.codigos, otro.codigos)
+        codigos = np.concatenate([self.codigos[propios], otro.codigos])
+        limites = np.concatenate([self.limites[propios], otro.limites])
+        orden = np.argsort(codigos)
+        return IndiceMunicipios(codigos[orden], limites[orden])
+
+    def guardar(self, ruta: str = RUTA_INDICE_MUNICIPIOS):
+        """Escribe el índice de forma atómica"""
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporal, "wb") as f:
+                np.savez(f, codigos=self.codigos, limites=self.limites)
+            os.replace(temporal, ruta)
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+
+    @classmethod
+    def cargar(cls, ruta: str = RUTA_INDICE_MUNICIPIOS) -> "IndiceMunicipios":
+        with np.load(ruta) as datos:
+            return cls(datos['codigos'], datos['limites'])
+
+
+@functools.lru_cache(maxsize=32)
+def _transformador(crs: str) -> Transformer:
+    return Transformer.from_crs(CRS.from_user_input(crs), "EPSG:4258", always_xy=True)
+
+
+def _bbox_geografico(bbox: List[float], crs) -> List[float]:
+    """
+    bbox de los metadatos GeoParquet en lon/lat (EPSG:4258, como desde_limites)
+
+    El bbox viene en el CRS de la columna (UTM en los ficheros del ATOM);
+    sin clave crs es OGC:CRS84 y con crs nulo se deja como está.
+    """
+    if crs is None:
+        return bbox
+    transformador = _transformador(json.dumps(crs, sort_keys=True) if isinstance(crs, dict) else crs)
+    if transformador.name == "noop":
+        return bbox
+    return list(transformador.transform_bounds(*bbox, densify_pts=21))
+
+
+def desde_cache(cache: Optional[CacheDatasets] = None, campana: Optional[str] = None) -> IndiceMunicipios:
+    """Rectángulos de los municipios de la caché de datasets (bbox de los metadatos GeoParquet, en lon/lat)"""
+    cache = cache or obtener_cache_datasets()
+    patron = os.path.join(cache.directorio, f"campana={campana or '*'}", "provincia=*", "municipio=*", "recintos_*.parquet")
+
+    extensiones = {}
+    for ruta in glob.glob(patron):
+        partes = dict(p.split("=", 1) for p in ruta.split(os.sep)[-4:-1] if "=" in p)
+        try:
+            geo = json.loads(pq.read_metadata(ruta).metadata[b'geo'])
+        except (OSError, KeyError, ValueError):
+            continue  # expulsado o sin metadatos GeoParquet
+        columna = geo['columns'][geo['primary_column']]
+        if columna.get('bbox') is None:
+            continue
+        bbox = _bbox_geografico(columna['bbox'], columna.get('crs', "OGC:CRS84"))
+        codigo = int(partes['provincia']) * 1000 + int(partes['municipio'])
+        anterior = extensiones.get(codigo, bbox)
+        extensiones[codigo] = [min(anterior[0], bbox[0]), min(anterior[1], bbox[1]), max(anterior[2], bbox[2]), max(anterior[3], bbox[3])]
+
+    codigos = sorted(extensiones)
+    return IndiceMunicipios(codigos, [extensiones[c] for c in codigos])
+
+
+def desde_limites(ruta: str, campo_codigo: str = "codigo_ine", campo_provincia: Optional[str] = None, campo_municipio: Optional[str] = None) -> IndiceMunicipios:
+    """
+    Rectángulos de un fichero de límites municipales (cualquier formato que lea GDAL)
+
+    El municipio sale de `campo_codigo` (código INE de 5 cifras, PPMMM) o
+    de `campo_provincia` y `campo_municipio`. Las geometrías se pasan a
+    EPSG:4258 y las de un mismo municipio se agrupan.
+    """
+    import geopandas as gpd
+
+    campos = [campo_provincia, campo_municipio] if campo_provincia and campo_municipio else [campo_codigo]
+    gdf = gpd.read_file(ruta, engine="pyogrio", columns=campos)
+    if gdf.crs is not None:
+        gdf = gdf.to_crs("EPSG:4258")
+
+    if campo_provincia and campo_municipio:
+        codigos = gdf[campo_provincia].astype(int) * 1000 + gdf[campo_municipio].astype(int)
+    else:
+        codigos = gdf[campo_codigo].astype(str).str.strip().str.zfill(5).str[-5:].astype(int)
+
+    limites = gdf.bounds.groupby(codigos.to_numpy()).agg({'minx': 'min', 'miny': 'min', 'maxx': 'max', 'maxy': 'max'})
+    return IndiceMunicipios(limites.index.to_numpy(), limites.to_numpy())
+
+
+_indice = None
+_mtime_indice = None
+_lock_indice = threading.Lock()
+
+
+def obtener_indice_municipios() -> IndiceMunicipios:
+    """Índice persistido (se relee si otro proceso lo actualiza); vacío si aún no existe"""
+    global _indice, _mtime_indice
+    try:
+        mtime = os.path.getmtime(RUTA_INDICE_MUNICIPIOS)
+    except OSError:
+        mtime = None
+
+    with _lock_indice:
+        if _indice is None or mtime != _mtime_indice:
+            try:
+                _indice = IndiceMunicipios.cargar(RUTA_INDICE_MUNICIPIOS) if mtime is not None else IndiceMunicipios()
+            except (OSError, ValueError, KeyError):
+                _indice = IndiceMunicipios()
+            _mtime_indice = mtime
+        return _indice
+
+
+def actualizar_indice_municipios(ruta_limites: Optional[str] = None, **campos) -> IndiceMunicipios:
+    """
+    Recalcula el índice persistido con la caché de datasets
+
+    Conserva los municipios que ya tenía (p. ej. de un fichero de límites)
+    y, si se indica `ruta_limites`, añade los de ese fichero, que tienen
+    preferencia sobre los de la caché.
+    """
+    indice = obtener_indice_municipios().combinar(desde_cache())
+    if ruta_limites:
+        indice = indice.combinar(desde_limites(ruta_limites, **campos))
+    indice.guardar(RUTA_INDICE_MUNICIPIOS)
+    return indice
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m utils.indice_municipios", description="Crea el índice de extensiones de municipio")
+    parser.add_argument("--limites", help="Fichero de límites municipales (si no, solo los municipios de la caché)")
+    parser.add_argument("--campo-codigo", default="codigo_ine", help="Campo con el código INE PPMMM")
+    parser.add_argument("--campo-provincia", help="Campo con el código de provincia (con --campo-municipio)")
+    parser.add_argument("--campo-municipio", help="Campo con el código de municipio (con --campo-provincia)")
+    args = parser.parse_args(argv)
+
+    indice = actualizar_indice_municipios(
+        args.limites,
+        campo_codigo=args.campo_codigo,
+        campo_provincia=args.campo_provincia,
+        campo_municipio=args.campo_municipio,
+    )
+    print(f"{len(indice)} municipios en {RUTA_INDICE_MUNICIPIOS} ({os.path.getsize(RUTA_INDICE_MUNICIPIOS) / 1024:.0f} KB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
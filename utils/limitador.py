@@ -0,0 +1,122 @@
+"""
+Limitador de peticiones por host (token bucket) compartido entre procesos
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from utils.cache_disco import DIR_CACHE
+from utils.estado_compartido import obtener_estado_compartido
+
+# Presupuesto por host: (peticiones por segundo, ráfaga máxima)
+LIMITES_POR_DEFECTO = {
+    "sigpac-hubcloud.es": (10.0, 20.0),
+    "www.fega.gob.es": (5.0, 10.0),
+}
+
+
+def _leer_limites(texto: Optional[str]) -> Dict[str, Tuple[float, float]]:
+    """Lee SIGPAC_LIMITES con formato "host=tasa/rafaga,host=tasa/rafaga" """
+    if not texto:
+        return dict(LIMITES_POR_DEFECTO)
+
+    limites = {}
+    for item in texto.split(","):
+        if "=" not in item:
+            continue
+        host, valor = item.strip().split("=", 1)
+        tasa, _, rafaga = valor.partition("/")
+        limites[host.strip()] = (float(tasa), float(rafaga or tasa))
+    return limites
+
+
+class LimitadorTasa:
+    """
+    Token bucket por host guardado en SQLite.
+
+    Cada petición reserva un token dentro de una transacción; si el cubo
+    está vacío el saldo queda negativo y la petición espera su turno, de
+    modo que todos los workers de gunicorn comparten el mismo presupuesto.
+    """
+
+    def __init__(self, limites: Dict[str, Tuple[float, float]], ruta: Optional[str] = None):
+        self.limites = limites
+        self.ruta = ruta or os.path.join(DIR_CACHE, "limitador.sqlite")
+        self._local = threading.local()
+
+    def _conexion(self) -> sqlite3.Connection:
+        """Conexión SQLite del hilo actual (se reabre tras un fork)"""
+        con = getattr(self._local, "con", None)
+        if con is not None and self._local.pid == os.getpid():
+            return con
+
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        con = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("CREATE TABLE IF NOT EXISTS cubos (host TEXT PRIMARY KEY, tokens REAL, actualizado REAL)")
+        self._local.con = con
+        self._local.pid = os.getpid()
+        return con
+
+    def _reservar(self, host: str, tasa: float, rafaga: float) -> float:
+        """Reserva un token y devuelve los segundos que hay que esperar para usarlo"""
+        con = self._conexion()
+        ahora = time.time()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            fila = con.execute("SELECT tokens, actualizado FROM cubos WHERE host = ?", (host,)).fetchone()
+            tokens = rafaga if fila is None else min(rafaga, fila[0] + (ahora - fila[1]) * tasa)
+            tokens -= 1
+            con.execute("INSERT OR REPLACE INTO cubos (host, tokens, actualizado) VALUES (?, ?, ?)", (host, tokens, ahora))
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        return max(0.0, -tokens / tasa)
+
+    def adquirir(self, host: str) -> float:
+        """Bloquea hasta que el host admite otra petición; devuelve el tiempo esperado"""
+        if host not in self.limites:
+            return 0.0
+
+        tasa, rafaga = self.limites[host]
+        espera = self._reservar(host, tasa, rafaga)
+        if espera > 0:
+            time.sleep(espera)
+
+        estado = obtener_estado_compartido()
+        if espera > 0:
+            estado.sumar("limitador", peticiones=1, esperas=1, espera_total=espera)
+            estado.maximo("limitador", espera_max=espera)
+        else:
+            estado.sumar("limitador", peticiones=1)
+        return espera
+
+    def estadisticas(self) -> dict:
+        """Tiempo de espera en cola de las peticiones de todos los procesos"""
+        contadores = obtener_estado_compartido().contadores("limitador")
+        peticiones = int(contadores.get('peticiones', 0))
+        espera_total = contadores.get('espera_total', 0.0)
+        return {
+            'peticiones': peticiones,
+            'esperas': int(contadores.get('esperas', 0)),
+            'espera_total_s': round(espera_total, 3),
+            'espera_media_s': round(espera_total / peticiones, 4) if peticiones else 0.0,
+            'espera_max_s': round(contadores.get('espera_max', 0.0), 3),
+            'limites': {host: {'tasa': tasa, 'rafaga': rafaga} for host, (tasa, rafaga) in self.limites.items()},
+        }
+
+
+_limitador = None
+_lock_limitador = threading.Lock()
+
+
+def obtener_limitador() -> LimitadorTasa:
+    """Limitador del proceso con los límites de SIGPAC_LIMITES"""
+    global _limitador
+    with _lock_limitador:
+        if _limitador is None:
+            _limitador = LimitadorTasa(_leer_limites(os.environ.get("SIGPAC_LIMITES")))
+    return _limitador
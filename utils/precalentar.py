@@ -0,0 +1,142 @@
+"""
+Precalentado de las cachés locales (datasets ATOM y respuestas de recinfo)
+
+Uso:
+    python -m utils.precalentar --municipios 14:051 14:021
+    python -m utils.precalentar --top 20 --log /var/log/sigpac/accesos.tsv
+    python -m utils.precalentar --codigos codigos.csv
+
+Sin argumentos usa la lista de SIGPAC_PRECALENTAR ("14:051,14:021,...").
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+from utils.http_client import ErrorServicio
+from utils.indice_municipios import actualizar_indice_municipios
+from utils.sigpac_atom import RUTA_LOG_ACCESOS, precargar_municipio
+
+# Municipios ("PR:MUN") que se precalientan si no se indican otros
+MUNICIPIOS_PRECALENTAR = os.environ.get("SIGPAC_PRECALENTAR", "")
+
+
+def leer_lista(texto: str) -> List[Tuple[str, str]]:
+    """Lista "14:051,14:21 41:091" -> [("14", "051"), ("14", "021"), ("41", "091")]"""
+    municipios = []
+    for item in texto.replace(",", " ").split():
+        provincia, _, municipio = item.partition(":")
+        if provincia.isdigit() and municipio.isdigit():
+            municipios.append((provincia.zfill(2), municipio.zfill(3)))
+    return municipios
+
+
+def mas_pedidos(ruta_log: str, top: int, campana: Optional[str] = None) -> List[Tuple[str, str]]:
+    """Los `top` municipios más consultados según el log de accesos (SIGPAC_LOG_ACCESOS)"""
+    contador = Counter()
+    with open(ruta_log, encoding="utf-8") as f:
+        for linea in f:
+            partes = linea.rstrip("\n").split("\t")
+            if len(partes) < 4 or (campana and partes[1] != campana):
+                continue
+            contador[(partes[2], partes[3])] += 1
+    return [municipio for municipio, _ in contador.most_common(top)]
+
+
+def precalentar_municipios(municipios: List[Tuple[str, str]], campana: str, formato: str = "gpkg", concurrencia: int = 4) -> dict:
+    """
+    Descarga a la caché de datasets los municipios que no estén ya
+
+    Imprime una línea por municipio y devuelve el resumen (resultados,
+    bytes descargados, segundos).
+    """
+    resultados = Counter()
+    total_bytes = 0
+    inicio = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrencia)) as pool:
+        futuros = {pool.submit(precargar_municipio, pr, mun, campana, formato): (pr, mun) for pr, mun in municipios}
+        for futuro in as_completed(futuros):
+            pr, mun = futuros[futuro]
+            try:
+                resultado, descargados = futuro.result()
+            except ErrorServicio as e:
+                resultado, descargados = e.estado, 0
+            resultados[resultado] += 1
+            total_bytes += descargados
+            print(f"  {pr}:{mun}  {resultado:<14} {descargados / 1024 ** 2:8.1f} MB", flush=True)
+
+    return {"resultados": dict(resultados), "bytes": total_bytes, "segundos": time.perf_counter() - inicio}
+
+
+def precalentar_codigos(ruta: str) -> dict:
+    """Descarga a la caché de recinfo los códigos de un CSV/XLSX"""
+    from utils.importar_codigos import leer_codigos_por_lotes
+    from utils.sigpac_api import descargar_por_codigos_con_estado, obtener_cache_recinfo
+
+    cache = obtener_cache_recinfo()
+    bytes_previos = cache.estadisticas()["bytes"]
+    resultados = Counter()
+    inicio = time.perf_counter()
+
+    for lote in leer_codigos_por_lotes(ruta):
+        _gdf, estados = descargar_por_codigos_con_estado(lote)
+        resultados.update(estados.values())
+        print(f"  {sum(resultados.values())} códigos", flush=True)
+
+    return {
+        "resultados": dict(resultados),
+        "bytes": max(0, cache.estadisticas()["bytes"] - bytes_previos),
+        "segundos": time.perf_counter() - inicio,
+    }
+
+
+def _resumen(titulo: str, resumen: dict, unidad: str):
+    total = sum(resumen["resultados"].values())
+    segundos = max(resumen["segundos"], 1e-9)
+    print(f"{titulo}: {total} {unidad} en {resumen['segundos']:.1f} s "
+          f"({total / segundos:.2f} {unidad}/s, {resumen['bytes'] / 1024 ** 2:.1f} MB, "
+          f"{resumen['bytes'] / 1024 ** 2 / segundos:.2f} MB/s)")
+    for resultado, n in sorted(resumen["resultados"].items()):
+        print(f"  {resultado}: {n}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m utils.precalentar", description="Precalienta las cachés locales de SIGPAC")
+    parser.add_argument("--municipios", nargs="*", help="Municipios PR:MUN (por defecto SIGPAC_PRECALENTAR)")
+    parser.add_argument("--top", type=int, help="Precalentar los N municipios más consultados del log de accesos")
+    parser.add_argument("--log", default=RUTA_LOG_ACCESOS, help="Log de accesos (por defecto SIGPAC_LOG_ACCESOS)")
+    parser.add_argument("--codigos", help="CSV/XLSX con códigos SIGPAC para la caché de recinfo")
+    parser.add_argument("--campana", default="2024", help="Campaña ATOM (por defecto 2024)")
+    parser.add_argument("--formato", default="gpkg", choices=["gpkg", "shp"])
+    parser.add_argument("--concurrencia", type=int, default=4, help="Municipios descargados a la vez")
+    args = parser.parse_args(argv)
+
+    municipios = leer_lista(" ".join(args.municipios)) if args.municipios else []
+    if args.top:
+        if not args.log or not os.path.exists(args.log):
+            parser.error("--top necesita el log de accesos (--log o SIGPAC_LOG_ACCESOS)")
+        municipios += mas_pedidos(args.log, args.top, args.campana)
+    if not municipios and not args.codigos:
+        municipios = leer_lista(MUNICIPIOS_PRECALENTAR)
+    if not municipios and not args.codigos:
+        parser.error("no hay nada que precalentar: indica --municipios, --top o --codigos")
+
+    if municipios:
+        municipios = list(dict.fromkeys(municipios))
+        print(f"Precalentando {len(municipios)} municipio(s) de la campaña {args.campana}")
+        _resumen("ATOM", precalentar_municipios(municipios, args.campana, args.formato, args.concurrencia), "municipios")
+        print(f"Índice de municipios: {len(actualizar_indice_municipios())} municipios")
+
+    if args.codigos:
+        print(f"Precalentando recinfo con {args.codigos}")
+        _resumen("recinfo", precalentar_codigos(args.codigos), "códigos")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+Registro de resultados en el servidor
+
+Las descargas guardan el GeoDataFrame en una caché en disco compartida por
+todos los workers (y por los procesos de los callbacks en segundo plano) y
+los dcc.Store solo llevan su identificador. Así el resultado no viaja al
+navegador y de vuelta en cada callback que lo usa. Se guardan en binario
+(utils.serializacion).
+
+Cada proceso guarda además los últimos GeoDataFrames ya deserializados,
+por hash del contenido, para que los callbacks que leen el mismo
+resultado (mostrar, exportar a GPKG, a SHP...) no lo vuelvan a leer.
+"""
+import hashlib
+import os
+import secrets
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import geopandas as gpd
+import shapely
+
+from utils.cache_disco import CacheDisco
+from utils.serializacion import FORMATO, deserializar, serializar
+
+# Tiempo que se conserva un resultado desde que se guarda (2 horas) y tamaño máximo (500 MB)
+RESULTADOS_TTL = float(os.environ.get("SIGPAC_RESULTADOS_TTL", 2 * 3600))
+RESULTADOS_MAX_BYTES = int(os.environ.get("SIGPAC_RESULTADOS_MAX_BYTES", 500 * 1024 * 1024))
+
+# Memoria de cada proceso para resultados ya deserializados (256 MB)
+MEMO_RESULTADOS_MAX_BYTES = int(os.environ.get("SIGPAC_MEMO_RESULTADOS_MAX_BYTES", 256 * 1024 * 1024))
+
+MENSAJE_CADUCADO = "Los resultados han caducado. Vuelve a descargarlos"
+
+_cache_resultados = None
+_lock_cache = threading.Lock()
+
+
+def obtener_cache_resultados() -> CacheDisco:
+    """Caché en disco de resultados, compartida por todos los workers"""
+    global _cache_resultados
+    with _lock_cache:
+        if _cache_resultados is None:
+            _cache_resultados = CacheDisco("resultados", ttl=RESULTADOS_TTL, max_bytes=RESULTADOS_MAX_BYTES)
+    return _cache_resultados
+
+
+class MemoResultados:
+    """
+    GeoDataFrames deserializados de este proceso, por hash del contenido
+    guardado, con expulsión LRU al pasar de max_bytes.
+
+    Los GeoDataFrames se comparten entre callbacks: no hay que modificarlos.
+    """
+
+    def __init__(self, max_bytes: int = MEMO_RESULTADOS_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()  # hash -> (gdf, tamaño estimado)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    def obtener(self, clave: str) -> Optional[gpd.GeoDataFrame]:
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[0]
+
+    def guardar(self, clave: str, gdf: gpd.GeoDataFrame):
+        tamano = _tamano(gdf)
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= anterior[1]
+            self._entradas[clave] = (gdf, tamano)
+            self._bytes += tamano
+            while self._bytes > self.max_bytes:
+                _, (_, tamano_expulsado) = self._entradas.popitem(last=False)
+                self._bytes -= tamano_expulsado
+                self.expulsiones += 1
+
+    def estadisticas(self) -> dict:
+        """Contadores y ocupación, como CacheDisco.estadisticas"""
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': self.aciertos / consultas if consultas else 0.0,
+                'expulsiones': self.expulsiones,
+                'entradas': len(self._entradas),
+                'bytes': self._bytes,
+            }
+
+
+def _tamano(gdf: gpd.GeoDataFrame) -> int:
+    """Memoria aproximada: columnas (con el texto) más las coordenadas de las geometrías"""
+    return int(gdf.memory_usage(deep=True).sum()) + 16 * int(shapely.get_num_coordinates(gdf.geometry.values).sum())
+
+
+def _hash(contenido: bytes) -> str:
+    return hashlib.blake2b(contenido, digest_size=16).hexdigest()
+
+
+_memo_resultados = MemoResultados()
+
+
+def obtener_memo_resultados() -> MemoResultados:
+    """Memoria de resultados deserializados de este proceso"""
+    return _memo_resultados
+
+
+def guardar_resultado(gdf: gpd.GeoDataFrame) -> str:
+    """Guarda el resultado y devuelve el identificador opaco que va en el dcc.Store"""
+    id_resultado = secrets.token_urlsafe(16)
+    contenido = serializar(gdf)
+    obtener_cache_resultados().guardar(id_resultado, contenido, FORMATO)
+    _memo_resultados.guardar(_hash(contenido), gdf)
+    return id_resultado
+
+
+def obtener_resultado(id_resultado: Optional[str]) -> Optional[gpd.GeoDataFrame]:
+    """
+    GeoDataFrame guardado con ese identificador; None si no hay o ya se expulsó
+
+    Si este proceso ya lo deserializó devuelve el mismo objeto, que no hay
+    que modificar.
+    """
+    if not id_resultado or not isinstance(id_resultado, str):
+        return None
+    # Los guardados en otro formato se descartan como si hubieran caducado
+    contenido = obtener_cache_resultados().obtener(id_resultado, FORMATO)
+    if contenido is None:
+        return None
+
+    clave = _hash(contenido)
+    gdf = _memo_resultados.obtener(clave)
+    if gdf is None:
+        gdf = deserializar(contenido)
+        _memo_resultados.guardar(clave, gdf)
+    return gdf
@@ -0,0 +1,35 @@
+"""
+Serialización binaria de GeoDataFrames entre callbacks
+
+Arrow IPC (formato stream) con la geometría en WKB y los buffers
+comprimidos con zstd. Conserva los tipos de las columnas y el índice, que
+el GeoJSON pierde, y ocupa y tarda una fracción de lo que tarda
+gdf.to_json() + gpd.read_file(). Al leer, pyarrow descomprime cada buffer
+en memoria nueva y se vuelve a copiar al pasar a columnas de pandas.
+"""
+from typing import Optional
+
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+# Identificador del formato, para descartar lo guardado con otro
+FORMATO = "arrow-ipc-wkb"
+
+# Códec de los buffers: "zstd", "lz4" o None (sin comprimir)
+COMPRESION = "zstd"
+
+
+def serializar(gdf: gpd.GeoDataFrame, compresion: Optional[str] = COMPRESION) -> bytes:
+    """GeoDataFrame a bytes Arrow IPC"""
+    tabla = pa.table(gdf.to_arrow(geometry_encoding="WKB"))
+    salida = pa.BufferOutputStream()
+    with ipc.new_stream(salida, tabla.schema, options=ipc.IpcWriteOptions(compression=compresion)) as escritor:
+        escritor.write_table(tabla)
+    return salida.getvalue().to_pybytes()
+
+
+def deserializar(datos: bytes) -> gpd.GeoDataFrame:
+    """Bytes de serializar() a GeoDataFrame"""
+    tabla = ipc.open_stream(pa.py_buffer(datos)).read_all()
+    return gpd.GeoDataFrame.from_arrow(tabla)
@@ -2,43 +2,381 @@
 Utilidades para API SIGPAC - Métodos 1 y 2
 """
 import geopandas as gpd
-import requests
-from io import BytesIO
-from typing import Dict, Optional
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
 import pandas as pd
 
+from utils.cache_disco import CacheDisco
+from utils.http_client import ERROR_REMOTO, NO_ENCONTRADO, OK, ErrorServicio, peticion
+
 URL_BASE = "https://sigpac-hubcloud.es/servicioconsultassigpac/query/recinfo/{pr}/{mu}/{ag}/{zo}/{po}/{pa}/{re}.geojson"
+URL_OGC_RECINTOS = "https://sigpac-hubcloud.es/ogcapi/collections/recintos/items"
 
-def descargar_por_codigos(dict_parcelas: Dict[int, str]) -> Optional[gpd.GeoDataFrame]:
-    """Descarga parcelas por códigos SIGPAC"""
-    gdf_sigpac = None
-    
-    for k, v in dict_parcelas.items():
-        try:
-            parcela_info = v.split(":")
-            if len(parcela_info) != 5:
-                continue
-            
-            pr, mu, po, pa, re = parcela_info
-            ag = "0"
-            zo = "0"
-            
-            url = URL_BASE.format(pr=pr, mu=mu, ag=ag, zo=zo, po=po, pa=pa, re=re)
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            
-            gdf_temp = gpd.read_file(BytesIO(response.content))
-            gdf_temp['id_entrada'] = k
-            gdf_temp['codigo_sigpac'] = v
-            
-            if gdf_sigpac is None:
-                gdf_sigpac = gdf_temp
+# Peticiones simultáneas a recinfo por descarga
+MAX_CONCURRENCIA = int(os.environ.get("SIGPAC_MAX_CONCURRENCIA", 8))
+
+# Recintos por página de la API OGC y máximo por rectángulo
+LIMITE_PAGINA_OGC = int(os.environ.get("SIGPAC_OGC_LIMITE_PAGINA", 1000))
+MAX_RECINTOS_BBOX = int(os.environ.get("SIGPAC_MAX_RECINTOS_BBOX", 50000))
+
+# Campos que identifican un recinto (API OGC, recinfo y ATOM)
+CLAVE_RECINTO = ['provincia', 'municipio', 'agregado', 'zona', 'poligono', 'parcela', 'recinto']
+
+# Campaña vigente de recinfo: al cambiar se descartan las respuestas de campañas anteriores
+CAMPANA_RECINFO = os.environ.get("SIGPAC_CAMPANA", str(date.today().year))
+
+# Caché de respuestas recinfo (30 días, 200 MB)
+CACHE_RECINFO_TTL = float(os.environ.get("SIGPAC_CACHE_RECINFO_TTL", 30 * 24 * 3600))
+CACHE_RECINFO_MAX_BYTES = int(os.environ.get("SIGPAC_CACHE_RECINFO_MAX_BYTES", 200 * 1024 * 1024))
+
+# PR:MU:PO:PA:RE numéricos, admitiendo espacios alrededor de los separadores
+PATRON_CODIGO = r'^\s*(\d{1,2})\s*:\s*(\d{1,3})\s*:\s*(\d{1,5})\s*:\s*(\d{1,5})\s*:\s*(\d{1,5})\s*$'
+
+_cache_recinfo = None
+_lock_cache = threading.Lock()
+
+
+def obtener_cache_recinfo() -> CacheDisco:
+    """Caché en disco de respuestas recinfo, compartida por todos los workers"""
+    global _cache_recinfo
+    with _lock_cache:
+        if _cache_recinfo is None:
+            cache = CacheDisco("recinfo", ttl=CACHE_RECINFO_TTL, max_bytes=CACHE_RECINFO_MAX_BYTES)
+            cache.invalidar_campana(CAMPANA_RECINFO)
+            _cache_recinfo = cache
+    return _cache_recinfo
+
+
+def _clave_recinfo(pr, mu, ag, zo, po, pa, re) -> str:
+    """
+    Clave normalizada de un recinto (14:010:... y 14:10:... son el mismo)
+
+    Lleva delante la URL del servicio, para que las respuestas de otro
+    servidor (p. ej. el de los benchmarks) nunca contesten a las de SIGPAC.
+    """
+    servicio = URL_BASE.split("{", 1)[0]
+    return servicio + ":".join(str(int(campo)) for campo in (pr, mu, ag, zo, po, pa, re))
+
+
+def normalizar_codigos(dict_parcelas: Dict[int, str]) -> Tuple[pd.DataFrame, List[dict]]:
+    """
+    Valida y normaliza una lista de códigos SIGPAC de forma vectorizada
+
+    Parámetros:
+    -----------
+    dict_parcelas : dict
+        {id_entrada: "PR:MU:PO:PA:RE"}
+
+    Retorna:
+    --------
+    (codigos, invalidos)
+        codigos: DataFrame indexado por id_entrada con el texto original
+        (codigo_sigpac) y el código normalizado (codigo), con provincia y
+        municipio rellenos con ceros ("14:010:74:1492:4")
+        invalidos: lista de {"id_entrada", "linea", "motivo"}
+    """
+    lineas = pd.Series(list(dict_parcelas.values()), index=list(dict_parcelas.keys()), dtype="object")
+    lineas.index.name = 'id_entrada'
+    campos = lineas.str.extract(PATRON_CODIGO)
+    validos = campos.notna().all(axis=1)
+
+    num_campos = lineas.str.count(":") + 1
+    motivos = pd.Series("Código no numérico o fuera de rango", index=lineas.index)
+    motivos[num_campos != 5] = "Se esperaban 5 campos PR:MU:PO:PA:RE"
+    invalidos = [
+        {'id_entrada': k, 'linea': linea, 'motivo': motivo}
+        for k, linea, motivo in zip(lineas.index[~validos], lineas[~validos], motivos[~validos])
+    ]
+
+    campos = campos[validos].astype(int)
+    codigos = pd.DataFrame({
+        'codigo_sigpac': lineas[validos],
+        'codigo': (
+            campos[0].astype(str).str.zfill(2) + ":"
+            + campos[1].astype(str).str.zfill(3) + ":"
+            + campos[2].astype(str) + ":"
+            + campos[3].astype(str) + ":"
+            + campos[4].astype(str)
+        ),
+    })
+
+    return codigos, invalidos
+
+
+def _parsear_recinfo(contenido: bytes) -> Tuple[List[dict], Optional[str]]:
+    """Extrae las features (y el CRS, si viene declarado) de una respuesta recinfo"""
+    datos = json.loads(contenido)
+    crs = (datos.get('crs') or {}).get('properties', {}).get('name')
+
+    if datos.get('type') == 'Feature':
+        return [datos], crs
+    return datos.get('features') or [], crs
+
+
+def _ensamblar_gdf(resultados: Iterable[Tuple[int, str, List[dict]]], crs: Optional[str] = None) -> Optional[gpd.GeoDataFrame]:
+    """Construye un único GeoDataFrame a partir de las features de cada código"""
+    features = []
+    for k, v, features_codigo in resultados:
+        for feature in features_codigo:
+            propiedades = dict(feature.get('properties') or {})
+            propiedades['id_entrada'] = k
+            propiedades['codigo_sigpac'] = v
+            features.append({'type': 'Feature', 'geometry': feature.get('geometry'), 'properties': propiedades})
+
+    if not features:
+        return None
+
+    return gpd.GeoDataFrame.from_features(features, crs=crs or "EPSG:4326")
+
+
+def _descargar_recinto(codigo: str) -> Tuple[str, List[dict], Optional[str]]:
+    """Descarga un recinto por código normalizado PR:MU:PO:PA:RE (estado, features y CRS)"""
+    pr, mu, po, pa, re = codigo.split(":")
+    ag = "0"
+    zo = "0"
+
+    clave = _clave_recinfo(pr, mu, ag, zo, po, pa, re)
+    cache = obtener_cache_recinfo()
+    contenido = cache.obtener(clave, CAMPANA_RECINFO)
+    if contenido is not None:
+        return (OK, *_parsear_recinfo(contenido))
+
+    url = URL_BASE.format(pr=pr, mu=mu, ag=ag, zo=zo, po=po, pa=pa, re=re)
+    respuesta = peticion("GET", url, timeout=(10, 30))
+    if not respuesta.ok:
+        return respuesta.estado, [], None
+
+    try:
+        features, crs = _parsear_recinfo(respuesta.response.content)
+    except ValueError:
+        return ERROR_REMOTO, [], None
+
+    if not features:
+        return NO_ENCONTRADO, [], None
+
+    cache.guardar(clave, respuesta.response.content, CAMPANA_RECINFO)
+    return OK, features, crs
+
+
+@dataclass
+class ProgresoDescarga:
+    """Avance de una descarga por códigos"""
+    hechos: int
+    total: int
+    fallos: int
+    lote: Optional[gpd.GeoDataFrame] = None
+    terminado: bool = False
+    gdf: Optional[gpd.GeoDataFrame] = None
+    estados: Dict[int, str] = field(default_factory=dict)
+
+
+def iterar_descarga_por_codigos(
+    dict_parcelas: Dict[int, str],
+    max_concurrencia: int = MAX_CONCURRENCIA,
+    intervalo: float = 0.5
+) -> Iterator[ProgresoDescarga]:
+    """
+    Descarga parcelas por códigos SIGPAC emitiendo el progreso según llegan
+
+    Emite un ProgresoDescarga con la primera respuesta y después como
+    mucho uno cada `intervalo` segundos, aunque solo lleguen fallos.
+    `lote` contiene los recintos llegados desde el aviso anterior (sin
+    orden), o None si no ha llegado ninguno. El último aviso tiene
+    terminado=True, el GeoDataFrame completo en orden de id_entrada (`gdf`)
+    y el estado de cada código válido (`estados`).
+
+    Los códigos no válidos se descartan (ver normalizar_codigos) y los
+    repetidos se descargan una sola vez y se asignan a cada id_entrada.
+    """
+    codigos, _invalidos = normalizar_codigos(dict_parcelas or {})
+
+    # id_entrada y texto original de cada código normalizado
+    destinos: Dict[str, List[Tuple[int, str]]] = {}
+    for k, v, codigo in zip(codigos.index, codigos['codigo_sigpac'], codigos['codigo']):
+        destinos.setdefault(codigo, []).append((k, v))
+
+    total = len(destinos)
+    respuestas = {}
+    pendientes = []
+    fallos = 0
+    crs = None
+    ultimo_aviso = float("-inf")
+
+    pool = ThreadPoolExecutor(max_workers=max(1, max_concurrencia))
+    try:
+        futuros = {pool.submit(_descargar_recinto, codigo): codigo for codigo in destinos}
+        for futuro in as_completed(futuros):
+            codigo = futuros[futuro]
+            estado, features, crs_respuesta = respuestas[codigo] = futuro.result()
+
+            if estado == OK:
+                crs = crs or crs_respuesta
+                pendientes.extend((k, v, features) for k, v in destinos[codigo])
             else:
-                gdf_sigpac = pd.concat([gdf_sigpac, gdf_temp], ignore_index=True)
-        except:
-            continue
-    
-    return gdf_sigpac
+                fallos += 1
+
+            # Cada respuesta cambia hechos o fallos: se avisa aunque no haya recintos nuevos
+            if len(respuestas) < total and time.monotonic() - ultimo_aviso >= intervalo:
+                yield ProgresoDescarga(len(respuestas), total, fallos, _ensamblar_gdf(pendientes, crs))
+                pendientes = []
+                ultimo_aviso = time.monotonic()
+    finally:
+        # Si se abandona la descarga no se lanzan las peticiones pendientes
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    # Se recorren en el orden de entrada para conservar el orden de id_entrada
+    resultados = []
+    estados = {}
+    for k, v, codigo in zip(codigos.index, codigos['codigo_sigpac'], codigos['codigo']):
+        estado, features, _crs = respuestas[codigo]
+        estados[k] = estado
+        if estado == OK:
+            resultados.append((k, v, features))
+
+    # Un solo GeoDataFrame al final, sin concatenaciones intermedias
+    yield ProgresoDescarga(
+        total, total, fallos,
+        lote=_ensamblar_gdf(pendientes, crs),
+        terminado=True,
+        gdf=_ensamblar_gdf(resultados, crs),
+        estados=estados
+    )
+
+
+def descargar_por_codigos_con_estado(
+    dict_parcelas: Dict[int, str],
+    max_concurrencia: int = MAX_CONCURRENCIA
+) -> Tuple[Optional[gpd.GeoDataFrame], Dict[int, str]]:
+    """
+    Descarga parcelas por códigos SIGPAC, con varias peticiones en paralelo
+
+    Retorna:
+    --------
+    (gdf, estados)
+        gdf: GeoDataFrame con los recintos encontrados o None
+        estados: {id_entrada: ok | no_encontrado | error_remoto | timeout}
+        para cada código válido
+    """
+    for progreso in iterar_descarga_por_codigos(dict_parcelas, max_concurrencia):
+        if progreso.terminado:
+            return progreso.gdf, progreso.estados
+    return None, {}
+
+
+def descargar_por_codigos(
+    dict_parcelas: Dict[int, str],
+    max_concurrencia: int = MAX_CONCURRENCIA
+) -> Optional[gpd.GeoDataFrame]:
+    """Descarga parcelas por códigos SIGPAC (ver descargar_por_codigos_con_estado)"""
+    gdf, _estados = descargar_por_codigos_con_estado(dict_parcelas, max_concurrencia)
+    return gdf
+
+
+def pagina_ogc(url: str, params: Optional[dict] = None) -> dict:
+    """Una página de la API OGC (FeatureCollection); {} si no hay recintos"""
+    respuesta = peticion("GET", url, params=params, timeout=(10, 60))
+    if respuesta.estado == NO_ENCONTRADO:
+        return {}
+    if not respuesta.ok:
+        raise ErrorServicio(respuesta.estado, respuesta.detalle)
+    try:
+        return respuesta.response.json()
+    except ValueError:
+        raise ErrorServicio(ERROR_REMOTO, "Respuesta de la API OGC no válida")
+
+
+def _enlace_siguiente(pagina: dict) -> Optional[str]:
+    for enlace in pagina.get('links') or []:
+        if enlace.get('rel') == 'next' and enlace.get('href'):
+            return enlace['href']
+    return None
+
+
+def descargar_por_bbox_con_estado(
+    bbox: List[float],
+    max_recintos: int = MAX_RECINTOS_BBOX,
+    limite_pagina: int = LIMITE_PAGINA_OGC,
+    max_concurrencia: int = MAX_CONCURRENCIA
+) -> Tuple[Optional[gpd.GeoDataFrame], dict]:
+    """
+    Descarga todos los recintos de un rectángulo desde la API OGC, página a página
+
+    Si la primera página trae numberMatched y el enlace next pagina por
+    offset, el resto de páginas se piden en paralelo; si no, se siguen los
+    enlaces next uno a uno. Nunca se descargan más de `max_recintos`.
+
+    Retorna:
+    --------
+    (gdf, estado)
+        gdf: GeoDataFrame con los recintos o None
+        estado: {'recibidos', 'coincidentes' (numberMatched o None),
+        'recortado' (True si había más recintos que max_recintos)}
+
+    Lanza ErrorServicio si el servicio falla o no responde a tiempo.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    params = {
+        'f': 'json',
+        'limit': max(1, min(limite_pagina, max_recintos)),
+        'bbox': f"{min_lon},{min_lat},{max_lon},{max_lat}"
+    }
+
+    primera = pagina_ogc(URL_OGC_RECINTOS, params)
+    features, recortado = paginar_ogc(primera, params, max_recintos, max_concurrencia)
+    estado = {'recibidos': len(features), 'coincidentes': primera.get('numberMatched'), 'recortado': recortado}
+    if not features:
+        return None, estado
+    return gpd.GeoDataFrame.from_features(features, crs="EPSG:4326"), estado
+
+
+def paginar_ogc(primera: dict, params: dict, max_recintos: int, max_concurrencia: int = MAX_CONCURRENCIA) -> Tuple[List[dict], bool]:
+    """
+    Features de todas las páginas de una consulta a partir de la primera
+
+    Retorna (features, recortado); recortado es True si quedaban más de
+    `max_recintos`.
+    """
+    features = list(primera.get('features') or [])
+    coincidentes = primera.get('numberMatched')
+    siguiente = _enlace_siguiente(primera)
+
+    if siguiente and features and coincidentes is not None and 'offset' in parse_qs(urlparse(siguiente).query):
+        # El servidor puede devolver menos de lo pedido: las páginas van de lo que devuelve
+        paso = len(features)
+        offsets = range(paso, min(coincidentes, max_recintos), paso)
+        pool = ThreadPoolExecutor(max_workers=max(1, max_concurrencia))
+        try:
+            paginas = pool.map(lambda offset: pagina_ogc(URL_OGC_RECINTOS, {**params, 'limit': paso, 'offset': offset}), offsets)
+            for pagina in paginas:
+                features.extend(pagina.get('features') or [])
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        siguiente = None
+    else:
+        while siguiente and len(features) < max_recintos:
+            pagina = pagina_ogc(siguiente)
+            nuevas = pagina.get('features') or []
+            if not nuevas:
+                siguiente = None
+                break
+            features.extend(nuevas)
+            siguiente = _enlace_siguiente(pagina)
+
+    recortado = len(features) > max_recintos or bool(siguiente) or (coincidentes is not None and coincidentes > max_recintos)
+    return features[:max_recintos], recortado
+
+
+def descargar_por_bbox(bbox: List[float], max_recintos: int = MAX_RECINTOS_BBOX) -> Optional[gpd.GeoDataFrame]:
+    """Descarga los recintos de un rectángulo desde la API OGC (ver descargar_por_bbox_con_estado)"""
+    gdf, _estado = descargar_por_bbox_con_estado(bbox, max_recintos)
+    return gdf
 
 
 def calcular_estadisticas(gdf: gpd.GeoDataFrame) -> dict:
@@ -48,9 +386,9 @@ def calcular_estadisticas(gdf: gpd.GeoDataFrame) -> dict:
         'superficie_total': 0,
         'superficie_media': 0
     }
-    
+
     if 'superficie' in gdf.columns:
         stats['superficie_total'] = float(gdf['superficie'].sum())
         stats['superficie_media'] = float(gdf['superficie'].mean())
-    
+
     return stats
@@ -2,14 +2,141 @@
 SIGPAC ATOM - Descarga oficial desde FEGA
 """
 import geopandas as gpd
-import requests
-from zipfile import ZipFile
-from io import BytesIO
+import pyogrio
+from zipfile import BadZipFile, ZipFile
 import tempfile
+import glob
+import hashlib
 import os
-from typing import Optional, Union, List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union, List, Tuple
 from urllib.parse import quote
 
+from utils.atom_indice import PATRON_ARCHIVO, buscar_archivo
+from utils.cache_datasets import bloqueo_fichero, bloqueo_para_borrar, leer_parquet, obtener_cache_datasets
+from utils.cache_disco import DIR_CACHE, CacheDisco
+from utils.http_client import ERROR_REMOTO, NO_ENCONTRADO, OK, ErrorServicio, Respuesta, peticion
+
+# Fichero donde se apunta cada municipio consultado (para precalentar la caché con los más pedidos)
+RUTA_LOG_ACCESOS = os.environ.get("SIGPAC_LOG_ACCESOS")
+
+# Trozo de lectura al descargar los ZIP a disco
+TAMANO_BLOQUE = 1024 * 1024
+
+# Descargas a medias (.part) que se reanudan con peticiones Range
+DIR_DESCARGAS = os.path.join(DIR_CACHE, "descargas")
+REANUDACIONES = int(os.environ.get("SIGPAC_REANUDACIONES", 5))
+TTL_PARCIALES = 24 * 3600
+
+# Fecha de publicación que funcionó por provincia y campaña (30 días) y URLs
+# que dieron 404 (6 horas, por si FEGA publica un fichero nuevo)
+TTL_FECHA_CONOCIDA = 30 * 24 * 3600
+TTL_NO_ENCONTRADO = 6 * 3600
+
+# Sondas HEAD simultáneas al buscar la fecha de publicación
+MAX_SONDEOS = 3
+
+# Nombres de provincias (carpetas del servicio ATOM)
+NOMBRES_PROVINCIAS = {
+    "01": "ARABA/ALAVA", "02": "ALBACETE", "03": "ALACANT/ALICANTE",
+    "04": "ALMERIA", "05": "AVILA", "06": "BADAJOZ", "07": "BALEARS, ILLES",
+    "08": "BARCELONA", "09": "BURGOS", "10": "CACERES", "11": "CADIZ",
+    "12": "CASTELLO/CASTELLON", "13": "CIUDAD REAL", "14": "CORDOBA",
+    "15": "CORUNA, A", "16": "CUENCA", "17": "GIRONA", "18": "GRANADA",
+    "19": "GUADALAJARA", "20": "GIPUZKOA", "21": "HUELVA", "22": "HUESCA",
+    "23": "JAEN", "24": "LEON", "25": "LLEIDA", "26": "RIOJA, LA",
+    "27": "LUGO", "28": "MADRID", "29": "MALAGA", "30": "MURCIA",
+    "31": "NAVARRA", "32": "OURENSE", "33": "ASTURIAS", "34": "PALENCIA",
+    "35": "PALMAS, LAS", "36": "PONTEVEDRA", "37": "SALAMANCA",
+    "38": "SANTA CRUZ DE TENERIFE", "39": "CANTABRIA", "40": "SEGOVIA",
+    "41": "SEVILLA", "42": "SORIA", "43": "TARRAGONA", "44": "TERUEL",
+    "45": "TOLEDO", "46": "VALENCIA/VALENCIA", "47": "VALLADOLID",
+    "48": "BIZKAIA", "49": "ZAMORA", "50": "ZARAGOZA"
+}
+
+# Fechas de publicación que se prueban cuando el índice del feed no está disponible
+FECHAS_PROBAR = ["20240115", "20240105", "20240201", "20250205", "20250215"]
+
+_cache_fechas = None
+_cache_404 = None
+_lock_caches = threading.Lock()
+
+
+def obtener_caches_atom() -> Tuple[CacheDisco, CacheDisco]:
+    """Cachés en disco de fechas conocidas y de URLs inexistentes"""
+    global _cache_fechas, _cache_404
+    with _lock_caches:
+        if _cache_fechas is None:
+            _cache_fechas = CacheDisco("atom_fechas", ttl=TTL_FECHA_CONOCIDA)
+            _cache_404 = CacheDisco("atom_404", ttl=TTL_NO_ENCONTRADO, max_bytes=10 * 1024 * 1024)
+    return _cache_fechas, _cache_404
+
+
+def _sondear(url: str) -> Respuesta:
+    """Comprueba si existe un fichero sin descargarlo (HEAD, o GET sin leer el cuerpo si no se admite HEAD)"""
+    respuesta = peticion("HEAD", url, timeout=(10, 30), allow_redirects=True)
+    if respuesta.response is not None and respuesta.response.status_code in (405, 501):
+        respuesta = peticion("GET", url, timeout=(10, 30), stream=True)
+        if respuesta.response is not None:
+            respuesta.response.close()
+    return respuesta
+
+
+def _localizar_archivo(urls_por_fecha: dict, clave_fecha: str) -> Tuple[Optional[str], Optional[Respuesta]]:
+    """
+    Busca cuál de las URLs candidatas existe
+
+    Primero prueba la fecha recordada para la provincia y campaña; si no,
+    sondea el resto de candidatas (sin las que dieron 404 recientemente),
+    hasta MAX_SONDEOS a la vez, y se queda con la más reciente que existe.
+    Devuelve (url, None) o (None, último error remoto).
+    """
+    cache_fechas, cache_404 = obtener_caches_atom()
+
+    conocida = cache_fechas.obtener(clave_fecha)
+    if conocida is not None and conocida.decode() in urls_por_fecha and cache_404.obtener(urls_por_fecha[conocida.decode()]) is None:
+        url = urls_por_fecha[conocida.decode()]
+        respuesta = _sondear(url)
+        if respuesta.ok:
+            return url, None
+        if respuesta.estado == NO_ENCONTRADO:
+            cache_404.guardar(url, b"")
+
+    # De la más reciente a la más antigua: la elegida no depende de qué sonda responda antes
+    candidatas = sorted((
+        (fecha, url) for fecha, url in urls_por_fecha.items()
+        if cache_404.obtener(url) is None and (conocida is None or fecha != conocida.decode())
+    ), reverse=True)
+    if not candidatas:
+        return None, None
+
+    error = None
+    encontrada = None
+    pool = ThreadPoolExecutor(max_workers=min(MAX_SONDEOS, len(candidatas)))
+    try:
+        futuros = [(fecha, url, pool.submit(_sondear, url)) for fecha, url in candidatas]
+        for fecha, url, futuro in futuros:
+            respuesta = futuro.result()
+            if respuesta.estado == OK:
+                encontrada = (fecha, url)
+                break
+            if respuesta.estado == NO_ENCONTRADO:
+                cache_404.guardar(url, b"")
+            else:
+                error = respuesta
+    finally:
+        # No se espera a las sondas en curso y las que aún no han empezado se cancelan
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if encontrada is None:
+        return None, error
+
+    fecha, url = encontrada
+    cache_fechas.guardar(clave_fecha, fecha.encode())
+    return url, None
+
 
 def descargar_sigpac(
     provincia: int,
@@ -18,7 +145,8 @@ def descargar_sigpac(
     pendiente_min_mil: Optional[int] = None,
     uso_sigpac: Optional[Union[str, List[str]]] = None,
     campana: str = "2024",
-    formato: str = "gpkg"
+    formato: str = "gpkg",
+    columnas: Optional[List[str]] = None
 ) -> Optional[gpd.GeoDataFrame]:
     """
     Descarga recintos SIGPAC desde servicio ATOM oficial
@@ -39,90 +167,386 @@ def descargar_sigpac(
         Año de campaña (por defecto "2024")
     formato : str
         Formato: "gpkg" o "shp"
+    columnas : list, opcional
+        Atributos a leer (por defecto todos)
     
     Retorna:
     --------
     GeoDataFrame con los recintos filtrados o None
+
+    Lanza ErrorServicio si FEGA no responde y no se encontró el fichero.
     """
     
     cod_prov = str(provincia).zfill(2)
     cod_mun = str(municipio).zfill(3)
     formato = formato.lower()
+    _registrar_acceso(campana, cod_prov, cod_mun, formato)
     
-    # Nombres de provincias
-    nombres_provincias = {
-        "01": "ARABA/ALAVA", "02": "ALBACETE", "03": "ALACANT/ALICANTE",
-        "04": "ALMERIA", "05": "AVILA", "06": "BADAJOZ", "07": "BALEARS, ILLES",
-        "08": "BARCELONA", "09": "BURGOS", "10": "CACERES", "11": "CADIZ",
-        "12": "CASTELLO/CASTELLON", "13": "CIUDAD REAL", "14": "CORDOBA",
-        "15": "CORUNA, A", "16": "CUENCA", "17": "GIRONA", "18": "GRANADA",
-        "19": "GUADALAJARA", "20": "GIPUZKOA", "21": "HUELVA", "22": "HUESCA",
-        "23": "JAEN", "24": "LEON", "25": "LLEIDA", "26": "RIOJA, LA",
-        "27": "LUGO", "28": "MADRID", "29": "MALAGA", "30": "MURCIA",
-        "31": "NAVARRA", "32": "OURENSE", "33": "ASTURIAS", "34": "PALENCIA",
-        "35": "PALMAS, LAS", "36": "PONTEVEDRA", "37": "SALAMANCA",
-        "38": "SANTA CRUZ DE TENERIFE", "39": "CANTABRIA", "40": "SEGOVIA",
-        "41": "SEVILLA", "42": "SORIA", "43": "TARRAGONA", "44": "TERUEL",
-        "45": "TOLEDO", "46": "VALENCIA/VALENCIA", "47": "VALLADOLID",
-        "48": "BIZKAIA", "49": "ZAMORA", "50": "ZARAGOZA"
-    }
+    # El índice de los feeds ATOM da la URL y la versión (fecha de publicación)
+    archivo = buscar_archivo(cod_prov, cod_mun, campana, formato)
+    version = archivo["fecha"] if archivo is not None else None
     
-    nombre_prov = nombres_provincias.get(cod_prov, "PROVINCIA")
+    # Copia local del municipio (la misma versión si se conoce la publicada)
+    cache = obtener_cache_datasets()
+    filtros = filtros_parquet(superficie_max_ha, pendiente_min_mil, uso_sigpac)
+    gdf = cache.leer(campana, cod_prov, cod_mun, formato, version, columnas, filtros)
     
-    # Fechas a probar
-    fechas_probar = ["20240115", "20240105", "20240201", "20250205", "20250215"]
+    if gdf is None and not cache.max_bytes:
+        # Caché desactivada: filtros aplicados al leer el ZIP
+        gdf = _descargar_municipio(archivo, cod_prov, cod_mun, campana, formato,
+                                   superficie_max_ha, pendiente_min_mil, uso_sigpac, columnas)
+    elif gdf is None:
+        ruta, _ = _guardar_en_cache(archivo, cod_prov, cod_mun, campana, formato)
+        gdf = leer_parquet(ruta, columnas, filtros) if ruta else None
     
-    base_url = f"https://www.fega.gob.es/atom/{campana}/rec_{campana}"
-    subdir = f"{cod_prov} - {nombre_prov}"
-    subdir_encoded = quote(subdir)
+    if gdf is None or len(gdf) == 0:
+        return None
     
-    gdf = None
+    # Añadir columna superficie_ha
+    if 'dn_surface' in gdf.columns:
+        gdf['superficie_ha'] = gdf['dn_surface'] / 10000
     
-    for fecha in fechas_probar:
-        nombre_archivo = f"{cod_prov}{cod_mun}_rec_{campana}_{fecha}_{formato}.zip"
-        url = f"{base_url}/{subdir_encoded}/{nombre_archivo}"
+    return gdf
+
+
+def precargar_municipio(
+    provincia: Union[int, str],
+    municipio: Union[int, str],
+    campana: str = "2024",
+    formato: str = "gpkg"
+) -> Tuple[str, int]:
+    """
+    Deja un municipio en la caché de datasets sin leerlo
+
+    Devuelve (resultado, bytes descargados); resultado es "en_cache",
+    "descargado" o "no_encontrado". Lanza ErrorServicio si FEGA no responde.
+    """
+    cod_prov = str(provincia).zfill(2)
+    cod_mun = str(municipio).zfill(3)
+    formato = formato.lower()
+    
+    archivo = buscar_archivo(cod_prov, cod_mun, campana, formato)
+    ruta, descargados = _guardar_en_cache(archivo, cod_prov, cod_mun, campana, formato)
+    if ruta is None:
+        return "no_encontrado", 0
+    return ("descargado" if descargados else "en_cache"), descargados
+
+
+def _guardar_en_cache(archivo: Optional[dict], cod_prov: str, cod_mun: str, campana: str, formato: str) -> Tuple[Optional[str], int]:
+    """
+    Ruta del municipio en la caché de datasets, descargándolo si no hay copia válida
+
+    Devuelve (ruta o None si no existe, bytes descargados).
+    """
+    cache = obtener_cache_datasets()
+    version = archivo["fecha"] if archivo is not None else None
+    
+    with cache.bloqueo(campana, cod_prov, cod_mun, formato):
+        # Otro worker puede haberlo descargado mientras se esperaba
+        ruta = cache.ruta_valida(campana, cod_prov, cod_mun, formato, version)
+        if ruta is not None:
+            return ruta, 0
+        
+        descarga = descargar_zip_municipio(archivo, cod_prov, cod_mun, campana, formato)
+        if descarga is None:
+            return None, 0
         
+        ruta_zip, version = descarga
         try:
-            response = requests.get(url, timeout=120)
-            
-            if response.status_code == 404:
+            descargados = os.path.getsize(ruta_zip)
+            completo = procesar_zip(ruta_zip, formato)
+        finally:
+            os.remove(ruta_zip)
+        
+        if completo is None:
+            return None, descargados
+        return cache.guardar(completo, campana, cod_prov, cod_mun, formato, version), descargados
+
+
+def _registrar_acceso(campana: str, cod_prov: str, cod_mun: str, formato: str):
+    """Añade una línea "fecha campana provincia municipio formato" al log de accesos"""
+    if not RUTA_LOG_ACCESOS:
+        return
+    linea = f"{time.strftime('%Y-%m-%dT%H:%M:%S')}\t{campana}\t{cod_prov}\t{cod_mun}\t{formato}\n"
+    try:
+        # Una sola escritura en modo append: las líneas de varios workers no se mezclan
+        with open(RUTA_LOG_ACCESOS, "a", encoding="utf-8") as f:
+            f.write(linea)
+    except OSError:
+        pass
+
+
+def _descargar_municipio(archivo: Optional[dict], cod_prov: str, cod_mun: str, campana: str, formato: str, *filtros) -> Optional[gpd.GeoDataFrame]:
+    """Descarga el ZIP de un municipio y lee su capa con los filtros indicados (sin caché)"""
+    descarga = descargar_zip_municipio(archivo, cod_prov, cod_mun, campana, formato)
+    if descarga is None:
+        return None
+    
+    ruta_zip, _version = descarga
+    try:
+        return procesar_zip(ruta_zip, formato, *filtros)
+    finally:
+        os.remove(ruta_zip)
+
+
+def descargar_zip_municipio(archivo: Optional[dict], cod_prov: str, cod_mun: str, campana: str, formato: str) -> Optional[Tuple[str, str]]:
+    """
+    Descarga a disco el ZIP de un municipio
+
+    `archivo` es su entrada en el índice del feed (o None para probar
+    fechas). Devuelve (ruta del ZIP, versión) o None si no existe; hay que
+    borrar el ZIP al terminar.
+    """
+    url = archivo["url"] if archivo is not None else _buscar_url(cod_prov, cod_mun, campana, formato)
+    if url is None:
+        return None
+    
+    coincidencia = PATRON_ARCHIVO.search(url)
+    tamano = archivo.get("tamano") if archivo is not None else None
+    return _descargar_a_disco(url, tamano), coincidencia.group(4) if coincidencia else "0"
+
+
+def _buscar_url(cod_prov: str, cod_mun: str, campana: str, formato: str) -> Optional[str]:
+    """URL del fichero de un municipio probando las fechas conocidas (sin índice del feed)"""
+    nombre_prov = NOMBRES_PROVINCIAS.get(cod_prov, "PROVINCIA")
+    base_url = f"https://www.fega.gob.es/atom/{campana}/rec_{campana}"
+    subdir_encoded = quote(f"{cod_prov} - {nombre_prov}")
+    
+    urls_por_fecha = {
+        fecha: f"{base_url}/{subdir_encoded}/{cod_prov}{cod_mun}_rec_{campana}_{fecha}_{formato}.zip"
+        for fecha in FECHAS_PROBAR
+    }
+    
+    # FEGA publica todos los municipios de una provincia con la misma fecha
+    url, error = _localizar_archivo(urls_por_fecha, f"{campana}:{cod_prov}:{formato}")
+    
+    if url is None and error is not None:
+        raise ErrorServicio(error.estado, error.detalle)
+    return url
+
+
+def filtros_parquet(
+    superficie_max_ha: Optional[float] = None,
+    pendiente_min_mil: Optional[int] = None,
+    uso_sigpac: Optional[Union[str, List[str]]] = None
+) -> List[tuple]:
+    """Los mismos filtros que _construir_filtro, para leer GeoParquet con pyarrow"""
+    filtros = []
+    if superficie_max_ha:
+        filtros.append(('dn_surface', '<=', float(superficie_max_ha) * 10000))
+    if pendiente_min_mil:
+        filtros.append(('pendiente_media', '>', float(pendiente_min_mil)))
+    if uso_sigpac:
+        filtros.append(('uso_sigpac', 'in', [uso_sigpac] if isinstance(uso_sigpac, str) else list(uso_sigpac)))
+    return filtros
+
+
+def _descargar_a_disco(url: str, tamano: Optional[int] = None) -> str:
+    """
+    Descarga un fichero por trozos a disco y devuelve su ruta
+
+    Lo descargado se guarda en un fichero .part que sobrevive a los cortes:
+    si la conexión se interrumpe se reanuda con una petición Range (aquí o
+    en la siguiente llamada con la misma URL). Al terminar se comprueba el
+    tamaño (el anunciado por el servidor o `tamano`, del índice del feed)
+    y la integridad del ZIP. Hay que borrar el fichero al terminar.
+    """
+    os.makedirs(DIR_DESCARGAS, exist_ok=True)
+    _limpiar_parciales()
+    parcial = os.path.join(DIR_DESCARGAS, hashlib.sha1(url.encode()).hexdigest() + ".zip.part")
+    
+    try:
+        with bloqueo_fichero(parcial + ".lock"):
+            total = _descargar_parcial(url, parcial, tamano)
+        
+            try:
+                if total is not None and os.path.getsize(parcial) != total:
+                    raise BadZipFile(f"tamaño {os.path.getsize(parcial)} en lugar de {total}")
+                with ZipFile(parcial) as z:
+                    erroneo = z.testzip()
+                if erroneo is not None:
+                    raise BadZipFile(f"CRC incorrecto en {erroneo}")
+            except BadZipFile as e:
+                _borrar_parcial(parcial)
+                raise ErrorServicio(ERROR_REMOTO, f"Fichero descargado dañado: {e}")
+        
+            # Nombre único: otra llamada con la misma URL puede empezar un .part nuevo
+            descriptor, ruta = tempfile.mkstemp(suffix=".zip", dir=DIR_DESCARGAS)
+            os.close(descriptor)
+            os.replace(parcial, ruta)
+            _borrar_parcial(parcial)
+    finally:
+        # El fichero de bloqueo se borra al terminar, salvo si otro espera esta misma URL
+        with bloqueo_para_borrar(parcial + ".lock"):
+            pass
+    return ruta
+
+
+def _descargar_parcial(url: str, parcial: str, tamano: Optional[int]) -> Optional[int]:
+    """
+    Completa el fichero .part pidiendo solo lo que falta; devuelve el tamaño total
+
+    Cada corte con avance se reanuda; se abandona tras REANUDACIONES
+    intentos seguidos sin recibir datos.
+    """
+    total = tamano
+    sin_avance = 0
+    
+    while True:
+        inicio = os.path.getsize(parcial) if os.path.exists(parcial) else 0
+        if total is not None and inicio >= total:
+            return total
+        
+        cabeceras = {}
+        if inicio:
+            cabeceras["Range"] = f"bytes={inicio}-"
+            validador = _leer_validador(parcial)
+            if validador:
+                # Si el fichero cambió en el servidor se recibe completo (200)
+                cabeceras["If-Range"] = validador
+        
+        respuesta = peticion("GET", url, timeout=(10, 120), stream=True, headers=cabeceras)
+        if not respuesta.ok:
+            if respuesta.response is not None and respuesta.response.status_code == 416 and sin_avance < REANUDACIONES:
+                # El .part no corresponde al fichero actual: se empieza de cero
+                _borrar_parcial(parcial)
+                sin_avance += 1
                 continue
-            
-            response.raise_for_status()
-            gdf = _procesar_zip(response.content, formato)
-            
-            if gdf is not None:
-                break
-        except:
+            raise ErrorServicio(respuesta.estado, respuesta.detalle)
+        
+        response = respuesta.response
+        if response.status_code == 206:
+            modo = "ab"
+            rango_total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            if rango_total.isdigit():
+                total = int(rango_total)
+        else:
+            # El servidor no admite Range (o el fichero cambió): se reescribe
+            modo = "wb"
+            inicio = 0
+            if response.headers.get("Content-Length", "").isdigit():
+                total = int(response.headers["Content-Length"])
+        
+        validador = response.headers.get("ETag") or response.headers.get("Last-Modified")
+        with open(parcial + ".validador", "w") as f:
+            f.write(validador or "")
+        
+        recibidos = 0
+        try:
+            with response, open(parcial, modo) as f:
+                for bloque in response.iter_content(TAMANO_BLOQUE):
+                    f.write(bloque)
+                    recibidos += len(bloque)
+        except OSError as e:
+            # Conexión cortada a mitad de descarga (las excepciones de requests son OSError)
+            sin_avance = 0 if recibidos else sin_avance + 1
+            if sin_avance > REANUDACIONES:
+                raise ErrorServicio(ERROR_REMOTO, f"Descarga interrumpida: {e}")
             continue
-    
-    if gdf is None:
+        
+        if total is None:
+            return inicio + recibidos
+        if inicio + recibidos >= total:
+            return total
+        # Respuesta más corta de lo anunciado sin error de conexión
+        sin_avance = 0 if recibidos else sin_avance + 1
+        if sin_avance > REANUDACIONES:
+            raise ErrorServicio(ERROR_REMOTO, "Descarga incompleta")
+
+
+def _leer_validador(parcial: str) -> Optional[str]:
+    """ETag o Last-Modified de la respuesta con la que se empezó el .part"""
+    try:
+        with open(parcial + ".validador") as f:
+            return f.read().strip() or None
+    except OSError:
         return None
+
+
+def _borrar_parcial(parcial: str):
+    for ruta in (parcial, parcial + ".validador"):
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+
+def _limpiar_parciales():
+    """Borra los .part, ZIP y bloqueos abandonados (procesos interrumpidos) hace más de TTL_PARCIALES"""
+    limite = time.time() - TTL_PARCIALES
+    for ruta in glob.glob(os.path.join(DIR_DESCARGAS, "*.part")) + glob.glob(os.path.join(DIR_DESCARGAS, "*.zip")):
+        try:
+            if os.path.getmtime(ruta) < limite:
+                _borrar_parcial(ruta)
+        except OSError:
+            pass
+    for ruta in glob.glob(os.path.join(DIR_DESCARGAS, "*.lock")):
+        try:
+            if os.path.getmtime(ruta) < limite:
+                with bloqueo_para_borrar(ruta):
+                    pass
+        except OSError:
+            pass
+
+
+def _construir_filtro(
+    campos: List[str],
+    superficie_max_ha: Optional[float] = None,
+    pendiente_min_mil: Optional[int] = None,
+    uso_sigpac: Optional[Union[str, List[str]]] = None
+) -> Optional[str]:
+    """Cláusula WHERE (SQL de OGR) con los filtros que se pueden aplicar a los campos de la capa"""
+    condiciones = []
     
-    # Añadir columna superficie_ha
-    if 'dn_surface' in gdf.columns:
-        gdf['superficie_ha'] = gdf['dn_surface'] / 10000
+    if superficie_max_ha and 'dn_surface' in campos:
+        condiciones.append(f"dn_surface <= {float(superficie_max_ha) * 10000!r}")
     
-    # Aplicar filtros
-    if superficie_max_ha and 'superficie_ha' in gdf.columns:
-        gdf = gdf[gdf['superficie_ha'] <= superficie_max_ha].copy()
+    if pendiente_min_mil and 'pendiente_media' in campos:
+        condiciones.append(f"pendiente_media > {float(pendiente_min_mil)!r}")
     
-    if pendiente_min_mil and 'pendiente_media' in gdf.columns:
-        gdf = gdf[gdf['pendiente_media'] > pendiente_min_mil].copy()
+    if uso_sigpac and 'uso_sigpac' in campos:
+        usos = [uso_sigpac] if isinstance(uso_sigpac, str) else list(uso_sigpac)
+        lista = ", ".join("'" + str(uso).replace("'", "''") + "'" for uso in usos)
+        condiciones.append(f"uso_sigpac IN ({lista})")
     
-    if uso_sigpac and 'uso_sigpac' in gdf.columns:
-        if isinstance(uso_sigpac, str):
-            gdf = gdf[gdf['uso_sigpac'] == uso_sigpac].copy()
-        elif isinstance(uso_sigpac, list):
-            gdf = gdf[gdf['uso_sigpac'].isin(uso_sigpac)].copy()
+    return " AND ".join(condiciones) or None
+
+
+def leer_capa(
+    ruta: str,
+    superficie_max_ha: Optional[float] = None,
+    pendiente_min_mil: Optional[int] = None,
+    uso_sigpac: Optional[Union[str, List[str]]] = None,
+    columnas: Optional[List[str]] = None
+) -> gpd.GeoDataFrame:
+    """
+    Lee una capa de recintos aplicando los filtros en la propia lectura
+
+    Los filtros se traducen a una cláusula WHERE y solo se leen las
+    columnas pedidas, así que GDAL solo decodifica las filas y campos que
+    se devuelven. Solo entonces se lee por Arrow: sin filtro ni columnas la
+    tabla Arrow y el GeoDataFrame coexisten y el pico de memoria sube.
+    """
+    campos = list(pyogrio.read_info(ruta)["fields"])
+    where = _construir_filtro(campos, superficie_max_ha, pendiente_min_mil, uso_sigpac)
+    
+    if columnas is not None:
+        # dn_surface hace falta para calcular superficie_ha
+        columnas = [c for c in campos if c in columnas or c == 'dn_surface']
     
-    return gdf if len(gdf) > 0 else None
+    usar_arrow = where is not None or columnas is not None
+    return gpd.read_file(ruta, engine="pyogrio", use_arrow=usar_arrow, where=where, columns=columnas)
 
 
-def _procesar_zip(contenido_zip: bytes, formato: str) -> Optional[gpd.GeoDataFrame]:
-    """Procesa ZIP en memoria"""
+def procesar_zip(
+    ruta_zip: str,
+    formato: str,
+    superficie_max_ha: Optional[float] = None,
+    pendiente_min_mil: Optional[int] = None,
+    uso_sigpac: Optional[Union[str, List[str]]] = None,
+    columnas: Optional[List[str]] = None
+) -> Optional[gpd.GeoDataFrame]:
+    """Lee la capa del ZIP directamente con /vsizip/ de GDAL, sin descomprimirlo"""
     try:
-        with ZipFile(BytesIO(contenido_zip)) as z:
+        with ZipFile(ruta_zip) as z:
             extension = '.gpkg' if formato == 'gpkg' else '.shp'
             
             archivo_geo = None
@@ -133,12 +557,7 @@ def _procesar_zip(contenido_zip: bytes, formato: str) -> Optional[gpd.GeoDataFra
             
             if not archivo_geo:
                 return None
-            
-            with tempfile.TemporaryDirectory() as tmpdir:
-                z.extractall(tmpdir)
-                ruta = os.path.join(tmpdir, archivo_geo)
-                gdf = gpd.read_file(ruta)
         
-        return gdf
-    except:
-        return None
\ No newline at end of file
+        return leer_capa(f"/vsizip/{ruta_zip}/{archivo_geo}", superficie_max_ha, pendiente_min_mil, uso_sigpac, columnas)
+    except Exception:
+        return None
@@ -0,0 +1,256 @@
+"""
+Descarga de rectángulos grandes de la API OGC por teselas
+
+Las teselas son celdas de una rejilla fija en grados: el nivel 0 mide
+TAMANO_TESELA_BASE y cada nivel divide la celda en cuatro. Una tesela con
+más de MAX_RECINTOS_TESELA recintos se divide; las demás se descargan en
+paralelo, se guardan en una caché en disco (las consultas que se solapan
+después las reutilizan) y los recintos que cruzan bordes se quedan una vez
+por su identificador.
+"""
+import json
+import math
+import os
+import threading
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional, Tuple
+
+import geopandas as gpd
+import shapely
+
+from utils.cache_disco import CacheDisco
+from utils.http_client import TIMEOUT, ErrorServicio
+from utils.sigpac_api import (
+    CAMPANA_RECINFO, CLAVE_RECINTO, LIMITE_PAGINA_OGC, MAX_CONCURRENCIA, MAX_RECINTOS_BBOX, URL_OGC_RECINTOS,
+    pagina_ogc, paginar_ogc
+)
+
+# Rejilla: lado de la tesela de nivel 0 (grados) y nivel más fino
+TAMANO_TESELA_BASE = 0.64
+NIVEL_MAX = 8
+
+# Recintos a partir de los cuales una tesela se divide
+MAX_RECINTOS_TESELA = int(os.environ.get("SIGPAC_RECINTOS_TESELA", 2000))
+
+# Caché de teselas (7 días, 500 MB)
+CACHE_TESELAS_TTL = float(os.environ.get("SIGPAC_CACHE_TESELAS_TTL", 7 * 24 * 3600))
+CACHE_TESELAS_MAX_BYTES = int(os.environ.get("SIGPAC_CACHE_TESELAS_MAX_BYTES", 500 * 1024 * 1024))
+
+# Marca en la caché de las teselas que hay que dividir
+DIVIDIR = b"dividir"
+
+Tesela = Tuple[int, int, int]
+
+_cache_teselas = None
+_lock_cache = threading.Lock()
+
+
+def obtener_cache_teselas() -> CacheDisco:
+    """Caché en disco de teselas de la API OGC, compartida por todos los workers"""
+    global _cache_teselas
+    with _lock_cache:
+        if _cache_teselas is None:
+            cache = CacheDisco("teselas_ogc", ttl=CACHE_TESELAS_TTL, max_bytes=CACHE_TESELAS_MAX_BYTES)
+            cache.invalidar_campana(CAMPANA_RECINFO)
+            _cache_teselas = cache
+    return _cache_teselas
+
+
+def _lado(nivel: int) -> float:
+    return TAMANO_TESELA_BASE / 2 ** nivel
+
+
+def limites_tesela(tesela: Tesela) -> List[float]:
+    """[min_lon, min_lat, max_lon, max_lat] de la tesela (nivel, columna, fila)"""
+    nivel, i, j = tesela
+    lado = _lado(nivel)
+    return [-180 + i * lado, -90 + j * lado, -180 + (i + 1) * lado, -90 + (j + 1) * lado]
+
+
+def teselas_bbox(bbox: List[float], nivel: int) -> List[Tesela]:
+    """Teselas de un nivel que cortan al rectángulo"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    lado = _lado(nivel)
+    columnas = range(math.floor((min_lon + 180) / lado), math.ceil((max_lon + 180) / lado))
+    filas = range(math.floor((min_lat + 90) / lado), math.ceil((max_lat + 90) / lado))
+    return [(nivel, i, j) for i in columnas for j in filas]
+
+
+def _hijas(tesela: Tesela, bbox: List[float]) -> List[Tesela]:
+    """Las cuatro teselas del nivel siguiente que cortan al rectángulo"""
+    nivel, i, j = tesela
+    consulta = shapely.box(*bbox)
+    hijas = [(nivel + 1, 2 * i + di, 2 * j + dj) for di in (0, 1) for dj in (0, 1)]
+    return [h for h in hijas if shapely.box(*limites_tesela(h)).intersects(consulta)]
+
+
+def _nivel_inicial(bbox: List[float], coincidentes: Optional[int]) -> int:
+    """Nivel en el que cada tesela tendría del orden de la mitad de MAX_RECINTOS_TESELA recintos"""
+    area = max((bbox[2] - bbox[0]) * (bbox[3] - bbox[1]), 1e-12)
+    if not coincidentes:
+        # Sin estimación (la consulta entera no respondió): unas 16 teselas
+        lado = math.sqrt(area) / 4
+    else:
+        lado = math.sqrt(MAX_RECINTOS_TESELA / 2 / (coincidentes / area))
+    return min(NIVEL_MAX, max(0, round(math.log2(TAMANO_TESELA_BASE / lado))))
+
+
+def _descargar_tesela(tesela: Tesela, max_recintos: int) -> Tuple[Optional[List[dict]], bool]:
+    """
+    Features de una tesela, de la caché o de la API
+
+    Retorna (None, False) si la tesela tiene demasiados recintos y hay que
+    dividirla; si no, (features, recortado).
+    """
+    cache = obtener_cache_teselas()
+    clave = "/".join(map(str, tesela))
+    contenido = cache.obtener(clave, CAMPANA_RECINFO)
+    if contenido == DIVIDIR:
+        return None, False
+    if contenido is not None:
+        return json.loads(zlib.decompress(contenido)), False
+
+    min_lon, min_lat, max_lon, max_lat = limites_tesela(tesela)
+    params = {'f': 'json', 'limit': LIMITE_PAGINA_OGC, 'bbox': f"{min_lon},{min_lat},{max_lon},{max_lat}"}
+    primera = pagina_ogc(URL_OGC_RECINTOS, params)
+    coincidentes = primera.get('numberMatched')
+    if coincidentes is not None and coincidentes > MAX_RECINTOS_TESELA and tesela[0] < NIVEL_MAX:
+        cache.guardar(clave, DIVIDIR, CAMPANA_RECINFO)
+        return None, False
+
+    features, recortado = paginar_ogc(primera, params, max_recintos, max_concurrencia=1)
+    if not recortado:
+        cache.guardar(clave, zlib.compress(json.dumps(features).encode(), 1), CAMPANA_RECINFO)
+    return features, recortado
+
+
+def _leer_de_cache(tesela: Tesela, bbox: List[float]) -> Optional[Tuple[List[dict], int]]:
+    """
+    (features, teselas) de la tesela, o de sus hijas si está marcada para
+    dividir, si todas están en la caché; None si falta alguna
+    """
+    cache = obtener_cache_teselas()
+    contenido = cache.obtener("/".join(map(str, tesela)), CAMPANA_RECINFO, contar_fallos=False)
+    if contenido is None:
+        return None
+    if contenido != DIVIDIR:
+        return json.loads(zlib.decompress(contenido)), 1
+    features = []
+    leidas = 0
+    for hija in _hijas(tesela, bbox):
+        en_cache = _leer_de_cache(hija, bbox)
+        if en_cache is None:
+            return None
+        features.extend(en_cache[0])
+        leidas += en_cache[1]
+    return features, leidas
+
+
+def _teselas_en_cache(bbox: List[float]) -> Optional[Tuple[List[dict], int]]:
+    """
+    (features, teselas) del rectángulo si algún nivel de la rejilla lo cubre
+    entero con teselas de la caché; None si no
+    """
+    for nivel in range(NIVEL_MAX + 1):
+        features = []
+        leidas = 0
+        for tesela in teselas_bbox(bbox, nivel):
+            en_cache = _leer_de_cache(tesela, bbox)
+            if en_cache is None:
+                break
+            features.extend(en_cache[0])
+            leidas += en_cache[1]
+        else:
+            return features, leidas
+    return None
+
+
+def _unir(features: List[dict], bbox: List[float], max_recintos: int) -> Tuple[Optional[gpd.GeoDataFrame], bool]:
+    """
+    GeoDataFrame de las features de varias teselas, sin repetidos y dentro
+    del rectángulo; retorna (gdf, recortado)
+    """
+    if not features:
+        return None, False
+    # Los recintos que cruzan bordes llegan en varias teselas y las de los bordes se salen del rectángulo
+    gdf = gpd.GeoDataFrame.from_features(features, crs="EPSG:4326")
+    if all(c in gdf.columns for c in CLAVE_RECINTO):
+        gdf = gdf.drop_duplicates(CLAVE_RECINTO)
+    gdf = gdf[gdf.intersects(shapely.box(*bbox))]
+    recortado = len(gdf) > max_recintos
+    gdf = gdf.iloc[:max_recintos].reset_index(drop=True)
+    return (gdf if len(gdf) else None), recortado
+
+
+def descargar_por_teselas(
+    bbox: List[float],
+    max_recintos: int = MAX_RECINTOS_BBOX,
+    max_concurrencia: int = MAX_CONCURRENCIA
+) -> Tuple[Optional[gpd.GeoDataFrame], dict]:
+    """
+    Recintos de un rectángulo desde la API OGC, por teselas si es grande
+
+    Si la caché de teselas cubre el rectángulo entero no se consulta el
+    servicio. Si no, una petición con limit=1 da numberMatched: si el
+    rectángulo tiene como mucho MAX_RECINTOS_TESELA recintos (o más de
+    `max_recintos`, y entonces se recorta igualmente) se pagina tal cual;
+    si no, se descarga por teselas. Si esa petición agota el tiempo de
+    espera también se pasa a teselas.
+
+    Retorna (gdf, estado) como descargar_por_bbox_con_estado, con
+    'teselas' (teselas descargadas o leídas de la caché).
+    """
+    en_cache = _teselas_en_cache(bbox)
+    if en_cache is not None:
+        features, teselas = en_cache
+        gdf, recortado = _unir(features, bbox, max_recintos)
+        estado = {'recibidos': 0 if gdf is None else len(gdf), 'coincidentes': None, 'recortado': recortado, 'teselas': teselas}
+        return gdf, estado
+
+    min_lon, min_lat, max_lon, max_lat = bbox
+    params = {'f': 'json', 'limit': max(1, min(LIMITE_PAGINA_OGC, max_recintos)), 'bbox': f"{min_lon},{min_lat},{max_lon},{max_lat}"}
+
+    coincidentes = None
+    try:
+        coincidentes = pagina_ogc(URL_OGC_RECINTOS, {**params, 'limit': 1}).get('numberMatched')
+    except ErrorServicio as e:
+        if e.estado != TIMEOUT:
+            raise
+    else:
+        if coincidentes is None or coincidentes <= MAX_RECINTOS_TESELA or coincidentes > max_recintos:
+            primera = pagina_ogc(URL_OGC_RECINTOS, params)
+            features, recortado = paginar_ogc(primera, params, max_recintos, max_concurrencia)
+            estado = {'recibidos': len(features), 'coincidentes': coincidentes, 'recortado': recortado, 'teselas': 0}
+            if not features:
+                return None, estado
+            return gpd.GeoDataFrame.from_features(features, crs="EPSG:4326"), estado
+
+    features = []
+    recortado = False
+    descargadas = 0
+
+    pool = ThreadPoolExecutor(max_workers=max(1, max_concurrencia))
+    try:
+        pendientes = {pool.submit(_descargar_tesela, t, max_recintos): t for t in teselas_bbox(bbox, _nivel_inicial(bbox, coincidentes))}
+        while pendientes:
+            hechas, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in hechas:
+                tesela = pendientes.pop(futuro)
+                features_tesela, recortada = futuro.result()
+                if features_tesela is None:
+                    for hija in _hijas(tesela, bbox):
+                        pendientes[pool.submit(_descargar_tesela, hija, max_recintos)] = hija
+                    continue
+                descargadas += 1
+                recortado = recortado or recortada
+                features.extend(features_tesela)
+            if len(features) >= max_recintos and pendientes:
+                recortado = True
+                break
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    gdf, recortado_union = _unir(features, bbox, max_recintos)
+    estado = {'recibidos': 0 if gdf is None else len(gdf), 'coincidentes': coincidentes, 'recortado': recortado or recortado_union, 'teselas': descargadas}
+    return gdf, estado